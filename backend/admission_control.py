@@ -0,0 +1,252 @@
+"""
+Admission control and load shedding.
+
+Every /api request is put in a route class with its own concurrency limit
+and a bounded wait queue. When a class is full, new requests wait in the
+queue for up to ADMISSION_QUEUE_TIMEOUT seconds. When the queue is full too,
+or the wait times out, they get 503 with a Retry-After header instead of
+piling up on a slow upstream.
+
+A monitor task measures event-loop lag. Above ADMISSION_MAX_LAG_MS,
+low-priority classes (exports, batch chains) are shed outright and no class
+queues any more: a request is admitted only if a slot is free.
+
+Health, login, market status and admin routes are never queued or shed.
+
+Environment variables:
+    ADMISSION_CONTROL         "false" disables the middleware
+    ADMISSION_LIMITS          comma separated class=concurrency/queue pairs
+                              (default "market=32/64,bulk=4/4,default=32/32")
+    ADMISSION_QUEUE_TIMEOUT   max seconds a request waits for a slot (default 5)
+    ADMISSION_MAX_LAG_MS      event-loop lag that starts shedding (default 250)
+    ADMISSION_RETRY_AFTER     Retry-After seconds on 503 responses (default 2)
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = "market=32/64,bulk=4/4,default=32/32"
+
+# Never queued or shed (the alert stream stays open for a whole session)
+EXEMPT_PATHS = ("/api/health", "/api/auth/login", "/api/market/status", "/api/admission", "/api/",
+                "/api/alerts/stream")
+EXEMPT_PREFIXES = ("/api/admin/",)
+
+# (path prefix, route class), first match wins
+ROUTE_CLASSES: List[Tuple[str, str]] = [
+    ("/api/market/optionchains/batch", "bulk"),
+    ("/api/export/", "bulk"),
+    ("/api/market/", "market"),
+]
+LOW_PRIORITY = {"bulk"}
+
+
+class RouteClass:
+    """Concurrency slots plus a bounded FIFO of requests waiting for one"""
+
+    def __init__(self, name: str, concurrency: int, queue_depth: int):
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.queue_depth = max(queue_depth, 0)
+        self.in_flight = 0
+        self._waiting: Deque[asyncio.Future] = deque()
+        self.metrics = {"admitted": 0, "queued": 0, "shed": 0}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < self.concurrency and not self._waiting:
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self, timeout: float) -> bool:
+        """Wait for a slot; False if the queue is full or the wait timed out"""
+        if self.try_acquire():
+            return True
+        if len(self._waiting) >= self.queue_depth:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.append(waiter)
+        self.metrics["queued"] += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            # A slot may have been handed over just as the wait expired
+            return waiter.done() and not waiter.cancelled()
+        except asyncio.CancelledError:
+            # Client went away; hand back a slot that was already passed to us
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+
+    def release(self):
+        # Hand the slot straight to the oldest live waiter
+        while self._waiting:
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            **self.metrics,
+        }
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a periodic sleep"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - started - self.interval, 0.0) * 1000
+            # Jump to spikes immediately, decay back gradually
+            self.lag_ms = max(lag, self.lag_ms * 0.5)
+
+    def ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+        except RuntimeError:
+            self._task = None
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class AdmissionController:
+    """Per-route-class admission decisions and counters"""
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[int, int]],
+        queue_timeout: float = 5.0,
+        max_lag_ms: float = 250.0,
+        retry_after: int = 2
+    ):
+        limits = dict(limits)
+        limits.setdefault("default", (32, 32))
+        self.classes = {name: RouteClass(name, c, q) for name, (c, q) in limits.items()}
+        self.queue_timeout = queue_timeout
+        self.max_lag_ms = max_lag_ms
+        self.retry_after = retry_after
+        self.monitor = LoopLagMonitor()
+
+    def classify(self, path: str) -> Optional[RouteClass]:
+        """Route class for a path, or None if the path is exempt"""
+        if not path.startswith("/api/") or path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES):
+            return None
+        for prefix, name in ROUTE_CLASSES:
+            if path.startswith(prefix):
+                return self.classes.get(name, self.classes["default"])
+        return self.classes["default"]
+
+    async def admit(self, route_class: RouteClass) -> bool:
+        self.monitor.ensure_started()
+        if self.monitor.lag_ms > self.max_lag_ms:
+            # Overloaded loop: drop low-priority work, and don't queue anything
+            admitted = route_class.name not in LOW_PRIORITY and route_class.try_acquire()
+        else:
+            admitted = await route_class.acquire(self.queue_timeout)
+        route_class.metrics["admitted" if admitted else "shed"] += 1
+        return admitted
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "loop_lag_ms": round(self.monitor.lag_ms, 1),
+            "max_lag_ms": self.max_lag_ms,
+            "in_flight": sum(c.in_flight for c in self.classes.values()),
+            "classes": {name: c.snapshot() for name, c in self.classes.items()},
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware; exempt routes pass straight through"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        route_class = self.controller.classify(scope["path"])
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        if not await self.controller.admit(route_class):
+            logger.warning(f"Shed {scope['method']} {scope['path']} ({route_class.name})")
+            body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.controller.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release()
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        concurrency, _, queue_depth = value.partition("/")
+        try:
+            limits[name.strip()] = (int(concurrency), int(queue_depth or 0))
+        except ValueError:
+            continue
+    return limits
+
+
+def controller_from_env() -> Optional[AdmissionController]:
+    if os.environ.get("ADMISSION_CONTROL", "true").lower() == "false":
+        return None
+    try:
+        return AdmissionController(
+            parse_limits(os.environ.get("ADMISSION_LIMITS", DEFAULT_LIMITS)),
+            queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "5")),
+            max_lag_ms=float(os.environ.get("ADMISSION_MAX_LAG_MS", "250")),
+            retry_after=int(os.environ.get("ADMISSION_RETRY_AFTER", "2"))
+        )
+    except Exception as e:
+        logger.warning(f"Admission control disabled: {str(e)}")
+        return None
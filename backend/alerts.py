@@ -0,0 +1,407 @@
+"""
+Per-user market alerts, evaluated on every market update.
+
+An alert fires when a symbol's value crosses its threshold: "above" when the
+value moves from below the threshold to at or above it, "below" the other
+way round. Fields:
+
+    spot                 last traded price
+    change_percent       day change %
+    iv_percentile        IV percentile
+    oi_change_percent    % change in an expiry's total option-chain OI over the last
+                         ALERTS_OI_WINDOW seconds (any expiry of the symbol can fire)
+
+Active alerts are indexed by (symbol, field, direction) as a sorted list of
+thresholds, so a tick only looks at the alerts for its own symbol and finds
+the crossed ones by bisecting between the previous and the new value:
+O(log n + fired) no matter how many alerts exist. One-shot alerts leave the
+index when they fire; repeating ones re-arm once the value crosses back.
+A value can belong to one of several series of the same symbol (the OI
+change of each expiry); crossings are tracked per series.
+
+The OI change is measured against the expiry's total OI as of
+ALERTS_OI_WINDOW seconds ago (the latest chain seen at or before then), so
+it doesn't depend on how often the chain happens to be refreshed. It is
+only reported once a chain older than the window exists, and the series
+restarts if no chain was seen for two windows.
+
+Alerts live in MongoDB (``alerts``, next to ``tokens``). Fired events go to
+``alert_events`` and to the push hub when they are flushed. Event ids are
+ObjectIds assigned at flush, so they follow insertion order. The hub wakes
+server-sent-event streams in this process; streams on other workers, and
+clients polling instead, read MongoDB by event id. Clocks differ between
+workers, so those reads go back ALERTS_POLL_OVERLAP seconds before the
+last id seen and callers drop ids they already have. The in-memory index is rebuilt from MongoDB every
+ALERTS_RELOAD_INTERVAL seconds, so alerts created on another worker take
+effect.
+
+Environment variables:
+    ALERTS_RELOAD_INTERVAL   seconds between index reloads from MongoDB (default 30)
+    ALERTS_POLL_INTERVAL     seconds between MongoDB polls per open stream (default 5)
+    ALERTS_POLL_OVERLAP      seconds polls re-read before the last event id (default 10)
+    ALERTS_OI_WINDOW         window of oi_change_percent in seconds (default 900)
+    ALERTS_EVENT_TTL         seconds fired events are kept (default 86400)
+    ALERTS_MAX_PER_USER      active alerts allowed per username (default 200)
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("spot", "change_percent", "iv_percentile", "oi_change_percent")
+DIRECTIONS = ("above", "below")
+
+
+class ThresholdIndex:
+    """Alert ids sorted by threshold for one (symbol, field, direction)"""
+
+    __slots__ = ("thresholds", "ids")
+
+    def __init__(self):
+        self.thresholds: List[float] = []
+        self.ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, threshold: float, alert_id: str):
+        position = bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(position, threshold)
+        self.ids.insert(position, alert_id)
+
+    def remove(self, threshold: float, alert_id: str):
+        position = bisect_left(self.thresholds, threshold)
+        while position < len(self.ids) and self.thresholds[position] == threshold:
+            if self.ids[position] == alert_id:
+                del self.thresholds[position]
+                del self.ids[position]
+                return
+            position += 1
+
+    def crossed(self, direction: str, previous: float, value: float) -> List[str]:
+        if direction == "above":
+            # previous < threshold <= value
+            if value <= previous:
+                return []
+            return self.ids[bisect_right(self.thresholds, previous):bisect_right(self.thresholds, value)]
+        # value <= threshold < previous
+        if value >= previous:
+            return []
+        return self.ids[bisect_left(self.thresholds, value):bisect_left(self.thresholds, previous)]
+
+
+class AlertHub:
+    """In-process fan-out of fired events to open streams, by username"""
+
+    def __init__(self):
+        self._queues: Dict[str, Set[asyncio.Queue]] = {}
+
+    def subscribe(self, username: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self._queues.setdefault(username, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, username: str, queue: asyncio.Queue):
+        queues = self._queues.get(username)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._queues[username]
+
+    def publish(self, event: Dict[str, Any]):
+        for queue in self._queues.get(event["username"], ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # slow consumer - it will catch up from MongoDB
+
+
+class AlertEngine:
+    """Symbol-indexed alert evaluation with MongoDB persistence"""
+
+    def __init__(
+        self,
+        get_db: Callable,
+        reload_interval: float = 30.0,
+        event_ttl: int = 86400,
+        max_per_user: int = 200,
+        oi_window: float = 900.0,
+        poll_overlap: float = 10.0
+    ):
+        self.get_db = get_db
+        self.reload_interval = reload_interval
+        self.event_ttl = event_ttl
+        self.max_per_user = max_per_user
+        self.oi_window = oi_window
+        self.poll_overlap = poll_overlap
+        self.hub = AlertHub()
+        self._alerts: Dict[str, Dict[str, Any]] = {}
+        self._index: Dict[Tuple[str, str, str], ThresholdIndex] = {}
+        # Last value seen per (symbol, field, series), the "previous" side of a crossing
+        self._last: Dict[Tuple[str, str, str], float] = {}
+        # (symbol, expiry) -> (monotonic time, total OI) samples covering oi_window
+        self._open_interest: Dict[Tuple[str, str], Deque[Tuple[float, float]]] = {}
+        self._fired: List[Dict[str, Any]] = []
+        self._loaded_at = None
+        self._indexed = False
+        self._lock = asyncio.Lock()
+
+    # Index maintenance
+
+    def _arm(self, alert: Dict[str, Any]):
+        self._alerts[alert["_id"]] = alert
+        key = (alert["symbol"], alert["field"], alert["direction"])
+        self._index.setdefault(key, ThresholdIndex()).add(alert["threshold"], alert["_id"])
+
+    def _disarm(self, alert_id: str) -> Optional[Dict[str, Any]]:
+        alert = self._alerts.pop(alert_id, None)
+        if alert is not None:
+            key = (alert["symbol"], alert["field"], alert["direction"])
+            index = self._index.get(key)
+            if index is not None:
+                index.remove(alert["threshold"], alert_id)
+                if not index:
+                    del self._index[key]
+        return alert
+
+    def watches(self, symbol: str, field: str) -> bool:
+        """Whether any active alert looks at this symbol's field"""
+        return any((symbol, field, direction) in self._index for direction in DIRECTIONS)
+
+    def update(self, symbol: str, values: Dict[str, Optional[float]], series: str = "") -> List[Dict[str, Any]]:
+        """Apply one symbol's new values; returns the events fired (kept until flush())"""
+        fired = []
+        for field, value in values.items():
+            if value is None:
+                continue
+            previous = self._last.get((symbol, field, series))
+            self._last[(symbol, field, series)] = value
+            if previous is None:
+                continue
+            for direction in DIRECTIONS:
+                index = self._index.get((symbol, field, direction))
+                if index is None:
+                    continue
+                for alert_id in index.crossed(direction, previous, value):
+                    fired.append(self._fire(self._alerts[alert_id], previous, value))
+        # One-shot alerts leave the index only after the loop above
+        for event in fired:
+            if not self._alerts[event["alert_id"]]["repeat"]:
+                self._disarm(event["alert_id"])
+        return fired
+
+    def update_open_interest(
+        self,
+        symbol: str,
+        expiry: str,
+        total: float,
+        now: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """Record an expiry's total OI and evaluate its change over oi_window"""
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.oi_window
+        samples = self._open_interest.setdefault((symbol, expiry), deque())
+        if samples and samples[-1][0] < cutoff - self.oi_window:
+            # Not seen for two windows: restart rather than compare across the gap
+            samples.clear()
+            self._last.pop((symbol, "oi_change_percent", expiry), None)
+        samples.append((now, total))
+        # Keep one sample at or before the cutoff - the reference value
+        while len(samples) > 1 and samples[1][0] <= cutoff:
+            samples.popleft()
+        reference_at, reference = samples[0]
+        if reference_at > cutoff or not reference:
+            return []
+        change = round((total / reference - 1.0) * 100.0, 2)
+        return self.update(symbol, {"oi_change_percent": change}, series=expiry)
+
+    def _fire(self, alert: Dict[str, Any], previous: float, value: float) -> Dict[str, Any]:
+        event = {
+            "alert_id": alert["_id"],
+            "username": alert["username"],
+            "symbol": alert["symbol"],
+            "field": alert["field"],
+            "direction": alert["direction"],
+            "threshold": alert["threshold"],
+            "previous": previous,
+            "value": value,
+            "triggered_at": datetime.now(timezone.utc),
+        }
+        self._fired.append(event)
+        return event
+
+    # Persistence
+
+    async def _prepare(self, db):
+        if self._indexed:
+            return
+        await db.alerts.create_index([("symbol", 1), ("active", 1)], name="symbol_active")
+        await db.alerts.create_index("username", name="username")
+        await db.alert_events.create_index([("username", 1), ("triggered_at", 1)], name="username_triggered")
+        await db.alert_events.create_index([("username", 1), ("_id", 1)], name="username_id")
+        await db.alert_events.create_index("triggered_at", expireAfterSeconds=self.event_ttl, name="triggered_at_ttl")
+        self._indexed = True
+
+    async def reload_if_stale(self):
+        """Rebuild the index from MongoDB every reload_interval seconds"""
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.reload_interval:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.reload_interval:
+                return
+            self._loaded_at = time.monotonic()
+            db = self.get_db()
+            if db is None:
+                return
+            try:
+                await self._prepare(db)
+                alerts = [doc async for doc in db.alerts.find({"active": True})]
+            except Exception as e:
+                logger.warning(f"Could not load alerts: {str(e)}")
+                return
+            self._alerts = {}
+            self._index = {}
+            for alert in alerts:
+                self._arm(alert)
+
+    async def flush(self):
+        """Publish and persist events fired since the last flush, retire one-shot alerts"""
+        fired, self._fired = self._fired, []
+        for event in fired:
+            # Assigned here, just before the insert, so ids follow insertion order
+            event["_id"] = ObjectId()
+            self.hub.publish(event)
+        db = self.get_db()
+        if not fired or db is None:
+            return
+        try:
+            await db.alert_events.insert_many(fired, ordered=False)
+            await db.alerts.bulk_write([
+                UpdateOne(
+                    {"_id": event["alert_id"]},
+                    {"$set": {"last_triggered_at": event["triggered_at"], "last_value": event["value"]}}
+                    if self._alerts.get(event["alert_id"], {}).get("repeat")
+                    else {"$set": {"active": False, "last_triggered_at": event["triggered_at"],
+                                   "last_value": event["value"]}}
+                )
+                for event in fired
+            ], ordered=False)
+        except Exception as e:
+            logger.error(f"Could not store fired alerts: {str(e)}")
+
+    # User operations
+
+    async def create(
+        self,
+        username: str,
+        symbol: str,
+        field: str,
+        direction: str,
+        threshold: float,
+        repeat: bool = False
+    ) -> Dict[str, Any]:
+        db = self.get_db()
+        await self._prepare(db)
+        if await db.alerts.count_documents({"username": username, "active": True}) >= self.max_per_user:
+            raise ValueError(f"At most {self.max_per_user} active alerts per user")
+        alert = {
+            "_id": uuid.uuid4().hex,
+            "username": username,
+            "symbol": symbol,
+            "field": field,
+            "direction": direction,
+            "threshold": float(threshold),
+            "repeat": repeat,
+            "active": True,
+            "created_at": datetime.now(timezone.utc),
+        }
+        await db.alerts.insert_one(alert)
+        self._arm(alert)
+        return alert
+
+    async def list(self, username: str) -> List[Dict[str, Any]]:
+        db = self.get_db()
+        return [doc async for doc in db.alerts.find({"username": username}).sort("created_at", -1)]
+
+    async def delete(self, username: str, alert_id: str) -> bool:
+        db = self.get_db()
+        result = await db.alerts.delete_one({"_id": alert_id, "username": username})
+        if result.deleted_count:
+            self._disarm(alert_id)
+        return bool(result.deleted_count)
+
+    async def events_since(self, username: str, since: datetime) -> List[Dict[str, Any]]:
+        db = self.get_db()
+        if db is None:
+            return []
+        cursor = db.alert_events.find({"username": username, "triggered_at": {"$gt": since}}).sort("triggered_at", 1)
+        return [doc async for doc in cursor]
+
+    async def events_after(self, username: str, after: ObjectId) -> List[Dict[str, Any]]:
+        """Events inserted after `after`, oldest first, re-reading poll_overlap seconds
+
+        Callers drop the ids they already have.
+        """
+        db = self.get_db()
+        if db is None:
+            return []
+        start = ObjectId.from_datetime(after.generation_time - timedelta(seconds=self.poll_overlap))
+        cursor = db.alert_events.find({"username": username, "_id": {"$gt": start}}).sort("_id", 1)
+        return [doc async for doc in cursor]
+
+
+def alerts_from_env(get_db: Callable) -> AlertEngine:
+    return AlertEngine(
+        get_db,
+        reload_interval=float(os.environ.get("ALERTS_RELOAD_INTERVAL", "30")),
+        event_ttl=int(os.environ.get("ALERTS_EVENT_TTL", "86400")),
+        max_per_user=int(os.environ.get("ALERTS_MAX_PER_USER", "200")),
+        oi_window=float(os.environ.get("ALERTS_OI_WINDOW", "900")),
+        poll_overlap=float(os.environ.get("ALERTS_POLL_OVERLAP", "10"))
+    )
+
+
+def _benchmark(count: int, ticks: int = 100000):
+    """Time evaluation with `count` alerts spread over 20 symbols"""
+    import random
+
+    rng = random.Random(7)
+    engine = AlertEngine(lambda: None)
+    symbols = [f"SYM{i:02d}" for i in range(20)]
+    for i in range(count):
+        engine._arm({
+            "_id": str(i), "username": f"user{i % 50}", "symbol": rng.choice(symbols),
+            "field": rng.choice(FIELDS), "direction": rng.choice(DIRECTIONS),
+            "threshold": rng.uniform(90, 110) if rng.random() < 0.5 else rng.uniform(-3, 3),
+            "repeat": True,
+        })
+    # Random walks, so ticks move a little and only nearby thresholds fire
+    level = {symbol: 100.0 for symbol in symbols}
+    updates = []
+    for _ in range(ticks):
+        symbol = rng.choice(symbols)
+        level[symbol] *= 1 + rng.gauss(0, 0.001)
+        updates.append((symbol, {"spot": level[symbol], "change_percent": level[symbol] - 100.0}))
+    started = time.perf_counter()
+    fired = 0
+    for symbol, values in updates:
+        fired += len(engine.update(symbol, values))
+        if len(engine._fired) > 10000:
+            engine._fired.clear()
+    elapsed = time.perf_counter() - started
+    print(f"{count} alerts, {ticks} ticks: {elapsed / ticks * 1e6:.2f} us per tick, {fired} fired")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,53 @@
+"""
+NumPy kernels for option-chain analytics.
+
+Functions here are pure and take/return plain arrays and dicts so they can
+run in the analytics process pool (see analytics_pool.py) with their inputs
+mapped from shared memory.
+"""
+import json
+from typing import Any, Dict
+
+import numpy as np
+
+from option_chain import unique_rows
+
+
+def chain_oi_arrays(data: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Strike-sorted strike / call OI / put OI columns, one entry per strike (see unique_rows)"""
+    rows = unique_rows(data)
+    return {
+        "strike": np.array([row["strike"] for row in rows], dtype=np.float64),
+        "call_oi": np.array([row["call_oi"] or 0.0 for row in rows], dtype=np.float64),
+        "put_oi": np.array([row["put_oi"] or 0.0 for row in rows], dtype=np.float64),
+    }
+
+
+def max_pain(strike: np.ndarray, call_oi: np.ndarray, put_oi: np.ndarray) -> Dict[str, Any]:
+    """Expiry price that minimises total option-writer payout
+
+    For every candidate settlement K, calls pay call_oi * max(K - s, 0) and
+    puts pay put_oi * max(s - K, 0) over all strikes s.
+    """
+    if strike.size == 0:
+        return {"max_pain": None, "total_call_oi": 0.0, "total_put_oi": 0.0, "pcr": None}
+    # (candidate, strike) matrix of intrinsic values
+    diff = strike[:, None] - strike[None, :]
+    payout = np.maximum(diff, 0.0) @ call_oi + np.maximum(-diff, 0.0) @ put_oi
+    total_call = float(call_oi.sum())
+    total_put = float(put_oi.sum())
+    return {
+        "max_pain": float(strike[int(np.argmin(payout))]),
+        "total_call_oi": total_call,
+        "total_put_oi": total_put,
+        "pcr": round(total_put / total_call, 4) if total_call else None,
+    }
+
+
+def max_pain_from_payload(payload: np.ndarray) -> Dict[str, Any]:
+    """max_pain of a raw option-chain body (UTF-8 JSON as a uint8 array)
+
+    Parsing and normalisation cost more than max_pain itself on large
+    chains, so the whole job runs in the pool rather than on the loop.
+    """
+    return max_pain(**chain_oi_arrays(json.loads(payload.tobytes())))
@@ -0,0 +1,180 @@
+"""
+Process-pool executor for CPU-bound analytics.
+
+Async handlers hand heavy jobs (chain analytics, volatility fits, ...) to
+``AnalyticsPool.run`` instead of computing inline, so the event loop keeps
+serving cheap routes like /api/health while the job runs in another process.
+
+Large NumPy inputs are copied once into ``multiprocessing.shared_memory``
+blocks and the worker maps them directly instead of unpickling a copy. Only
+the (small) result is pickled back.
+
+Where processes or /dev/shm are unavailable (e.g. serverless runtimes), or
+with ANALYTICS_WORKERS=0, jobs run in a thread instead; that still keeps the
+loop free while NumPy releases the GIL.
+
+Environment variables:
+    ANALYTICS_WORKERS        worker processes (default cpu_count - 1, min 1)
+    ANALYTICS_JOB_TIMEOUT    seconds before a job is abandoned (default 10)
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# name -> (shared memory block name, shape, dtype string)
+ArrayDescriptor = Tuple[str, Tuple[int, ...], str]
+
+
+def _run_with_shared_arrays(func: Callable, descriptors: Dict[str, ArrayDescriptor], kwargs: Dict[str, Any]):
+    """Worker-side entry point: map the shared arrays and call the job"""
+    blocks = []
+    arrays = {}
+    try:
+        for name, (block_name, shape, dtype) in descriptors.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        return func(**arrays, **kwargs)
+    finally:
+        # Drop views before closing the mapping
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+class AnalyticsPool:
+    """Lazily started process pool with per-job timeouts and counters"""
+
+    def __init__(self, workers: int, job_timeout: float):
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._use_processes = workers > 0
+        self.metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "in_flight": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+        }
+
+    @property
+    def mode(self) -> str:
+        return "process" if self._use_processes else "thread"
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if not self._use_processes:
+            return None
+        if self._executor is None:
+            try:
+                # spawn: the parent has live threads (log listener, loop) that fork would copy
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"Analytics process pool unavailable, using threads: {str(e)}")
+                self._use_processes = False
+        return self._executor
+
+    def _share(self, arrays: Dict[str, np.ndarray]):
+        blocks = []
+        descriptors = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                descriptors[name] = (block.name, array.shape, array.dtype.str)
+        except Exception:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+        return blocks, descriptors
+
+    async def run(self, func: Callable, arrays: Optional[Dict[str, np.ndarray]] = None, **kwargs) -> Any:
+        """Run func(**arrays, **kwargs) off the event loop and return its result"""
+        arrays = arrays or {}
+        loop = asyncio.get_running_loop()
+        self.metrics["submitted"] += 1
+        self.metrics["in_flight"] += 1
+        started = time.perf_counter()
+        blocks = []
+        try:
+            executor = self._get_executor()
+            if executor is not None:
+                try:
+                    blocks, descriptors = self._share(arrays)
+                except OSError as e:
+                    # No usable /dev/shm - fall back to threads for good
+                    logger.warning(f"Shared memory unavailable, using threads: {str(e)}")
+                    self._use_processes = False
+                    executor = None
+            if executor is not None:
+                future = loop.run_in_executor(
+                    executor, _run_with_shared_arrays, func, descriptors, kwargs
+                )
+            else:
+                future = loop.run_in_executor(None, functools.partial(func, **arrays, **kwargs))
+
+            result = await asyncio.wait_for(future, timeout=self.job_timeout)
+            self.metrics["completed"] += 1
+            return result
+        except asyncio.TimeoutError:
+            # The worker can't be interrupted; it finishes in the background
+            self.metrics["timed_out"] += 1
+            raise
+        except BrokenProcessPool:
+            self.metrics["failed"] += 1
+            self._executor = None  # recreate on next job
+            raise
+        except Exception:
+            self.metrics["failed"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics["in_flight"] -= 1
+            self.metrics["total_seconds"] += elapsed
+            self.metrics["max_seconds"] = max(self.metrics["max_seconds"], elapsed)
+            for block in blocks:
+                # Unlinking is safe even if a timed-out worker still has it mapped
+                block.close()
+                block.unlink()
+
+    def snapshot(self) -> Dict[str, Any]:
+        done = self.metrics["completed"] + self.metrics["failed"] + self.metrics["timed_out"]
+        return {
+            "mode": self.mode,
+            "workers": self.workers if self._use_processes else 0,
+            "job_timeout": self.job_timeout,
+            **self.metrics,
+            "avg_seconds": self.metrics["total_seconds"] / done if done else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def pool_from_env() -> AnalyticsPool:
+    default_workers = max((os.cpu_count() or 2) - 1, 1)
+    return AnalyticsPool(
+        int(os.environ.get("ANALYTICS_WORKERS", str(default_workers))),
+        float(os.environ.get("ANALYTICS_JOB_TIMEOUT", "10"))
+    )
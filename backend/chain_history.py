@@ -0,0 +1,315 @@
+"""
+Intraday option-chain history, delta-compressed, for OI / price change per strike.
+
+Sampling is driven by chain refreshes, not a timer: a chain is sampled
+(at most once per CHAIN_HISTORY_INTERVAL seconds) whenever it is fetched
+from upstream, because a user opened it or because the prefetcher keeps it
+warm (the most-viewed and "High Volatility" symbols' nearest expiries, see
+chain_prefetch.py). Those watched chains therefore get periodic samples
+during market hours; a chain nobody opens has no history. The sample is
+stored by a background task, so a refresh never waits on MongoDB. Samples
+are kept in MongoDB ``chain_history``, one document per stored sample:
+
+    keyframe   all strikes plus a (field, strike) matrix of FIELDS
+    delta      the (field, strike) cells that changed since the previous
+               sample: flat indices as gaps, and the change of each value
+
+Every document carries ``root``, the _id of its keyframe (a keyframe's own
+_id), and ``seq``, its position after that keyframe (0 for the keyframe).
+A chain is rebuilt by following the root of the latest sample at or before
+the requested time and applying its deltas in seq order, so neither
+timestamp ties nor another worker's samples written in between can mix
+deltas into the wrong keyframe.
+
+Every field has at most two decimals (OI, volume, prices in paise), so
+values are kept as int64 hundredths, with a sentinel for missing ones, and a
+delta's steps are integer differences. Those stay exact even across the
+sentinel, because int64 arithmetic wraps, and small steps compress well.
+Arrays are packed little-endian, byte-plane shuffled and zlib-compressed. A sample with no
+changes is not stored at all. A keyframe is written every
+CHAIN_HISTORY_KEYFRAME samples, when the strike list changes, and when the
+latest stored sample isn't the one this worker diffed against (another
+worker wrote in between; if that happens between the check and the insert,
+the two workers just continue separate roots). So reading the chain as of any time decodes one
+keyframe and at most CHAIN_HISTORY_KEYFRAME - 1 deltas, never the whole
+history. Documents expire CHAIN_HISTORY_RETENTION_DAYS after the contract
+expires.
+
+Environment variables:
+    CHAIN_HISTORY_ENABLED          record chain samples (default true)
+    CHAIN_HISTORY_INTERVAL         minimum seconds between samples of a chain (default 60)
+    CHAIN_HISTORY_KEYFRAME         samples per keyframe (default 30)
+    CHAIN_HISTORY_RETENTION_DAYS   days kept after expiry (default 7)
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from market_calendar import IST
+from option_chain import unique_rows
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("call_oi", "put_oi", "call_ltp", "put_ltp", "call_volume", "put_volume")
+MISSING = np.iinfo(np.int64).min
+
+
+def _pack(values: np.ndarray, dtype: str) -> bytes:
+    array = np.ascontiguousarray(values, dtype=dtype).reshape(-1)
+    # Byte planes (every first byte, then every second byte, ...): the mostly
+    # zero high bytes of small numbers compress to almost nothing
+    return zlib.compress(array.view(np.uint8).reshape(-1, array.itemsize).T.tobytes())
+
+
+def _unpack(blob: bytes, dtype: str) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(-1)
+
+
+def chain_matrix(data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Strike-sorted strikes and a (len(FIELDS), strikes) matrix; NaN where missing"""
+    rows = unique_rows(data)
+    strikes = np.array([row["strike"] for row in rows], dtype=np.float64)
+    values = np.array(
+        [[np.nan if row[f] is None else row[f] for row in rows] for f in FIELDS],
+        dtype=np.float64
+    ).reshape(len(FIELDS), len(strikes))
+    return strikes, values
+
+
+def quantize(values: np.ndarray) -> np.ndarray:
+    """Float values to int64 hundredths, MISSING for NaN"""
+    with np.errstate(invalid="ignore"):
+        return np.where(np.isnan(values), MISSING, np.rint(values * 100.0)).astype(np.int64)
+
+
+def dequantize(values: np.ndarray) -> np.ndarray:
+    return np.where(values == MISSING, np.nan, values / 100.0)
+
+
+def expiry_datetime(expiry: str) -> datetime:
+    return datetime.strptime(expiry, "%d-%m-%Y").replace(tzinfo=IST)
+
+
+class ChainHistory:
+    """Records chain samples and rebuilds the chain as of any stored time"""
+
+    def __init__(
+        self,
+        get_db: Callable,
+        interval: float = 60.0,
+        keyframe_every: int = 30,
+        retention_days: int = 7
+    ):
+        self.get_db = get_db
+        self.interval = interval
+        self.keyframe_every = max(1, keyframe_every)
+        self.retention_days = retention_days
+        # (symbol, expiry) -> (_id, root, strikes, quantized values, seq), as last stored here
+        self._last: Dict[Tuple[str, str], Tuple[ObjectId, ObjectId, np.ndarray, np.ndarray, int]] = {}
+        self._sampled_at: Dict[Tuple[str, str], float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._indexed = False
+
+    async def _prepare(self, db):
+        if self._indexed:
+            return
+        await db.chain_history.create_index([("symbol", 1), ("expiry", 1), ("ts", 1)], name="symbol_expiry_ts")
+        await db.chain_history.create_index([("root", 1), ("seq", 1)], name="root_seq")
+        await db.chain_history.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+        self._indexed = True
+
+    def due(self, symbol: str, expiry: str) -> bool:
+        """Whether this chain's next refresh should be sampled"""
+        return time.monotonic() - self._sampled_at.get((symbol, expiry), -self.interval) >= self.interval
+
+    def encode(self, symbol: str, expiry: str, ts: datetime, strikes: np.ndarray, values: np.ndarray,
+               latest: Optional[ObjectId]) -> Optional[Dict[str, Any]]:
+        """Document for a sample (None if nothing changed); updates the per-chain state
+
+        latest is the _id of the newest stored sample of the chain.
+        """
+        values = quantize(values)
+        key = (symbol, expiry)
+        last = self._last.get(key)
+        doc = {
+            "_id": ObjectId(),
+            "symbol": symbol,
+            "expiry": expiry,
+            "ts": ts,
+            "expires_at": expiry_datetime(expiry) + timedelta(days=self.retention_days),
+        }
+        keyframe = (
+            last is None
+            or latest is None
+            or latest != last[0]
+            or last[4] + 1 >= self.keyframe_every
+            or not np.array_equal(last[2], strikes)
+        )
+        if keyframe:
+            doc.update(keyframe=True, root=doc["_id"], seq=0, strikes=_pack(strikes, "<f8"), values=_pack(values, "<i8"))
+            self._last[key] = (doc["_id"], doc["_id"], strikes, values, 0)
+            return doc
+        _, root, _, previous, seq = last
+        cells = np.flatnonzero(previous != values)
+        if not len(cells):
+            return None
+        steps = values.ravel()[cells] - previous.ravel()[cells]
+        doc.update(
+            keyframe=False, root=root, seq=seq + 1,
+            cells=_pack(np.diff(cells, prepend=0), "<u4"), steps=_pack(steps, "<i8")
+        )
+        self._last[key] = (doc["_id"], root, strikes, values, seq + 1)
+        return doc
+
+    def sample(self, symbol: str, expiry: str, data: Dict[str, Any]):
+        """Record a sample in a background task, off the caller's refresh path"""
+        self._sampled_at[(symbol, expiry)] = time.monotonic()
+        task = asyncio.get_running_loop().create_task(self.record(symbol, expiry, data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Wait for samples still being stored (shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def record(self, symbol: str, expiry: str, data: Dict[str, Any]):
+        """Store a sample of a freshly fetched chain"""
+        self._sampled_at[(symbol, expiry)] = time.monotonic()
+        db = self.get_db()
+        if db is None:
+            return
+        try:
+            strikes, values = chain_matrix(data)
+            if not len(strikes):
+                return
+            await self._prepare(db)
+            latest = await db.chain_history.find_one(
+                {"symbol": symbol, "expiry": expiry}, {"_id": 1}, sort=[("ts", -1), ("_id", -1)]
+            )
+            # Mongo keeps millisecond precision
+            now = datetime.now(timezone.utc)
+            ts = now.replace(microsecond=now.microsecond // 1000 * 1000)
+            doc = self.encode(symbol, expiry, ts, strikes, values, latest["_id"] if latest else None)
+            if doc is not None:
+                await db.chain_history.insert_one(doc)
+        except Exception as e:
+            # Forget the state so the next sample starts from a keyframe
+            self._last.pop((symbol, expiry), None)
+            logger.error(f"Could not record chain history for {symbol} {expiry}: {str(e)}")
+
+    async def chain_at(self, symbol: str, expiry: str, at: datetime) -> Optional[Dict[str, Any]]:
+        """Chain as of `at` (latest sample at or before it; else the first sample after)"""
+        db = self.get_db()
+        query = {"symbol": symbol, "expiry": expiry}
+        fields = {"root": 1, "seq": 1, "ts": 1}
+        sample = await db.chain_history.find_one({**query, "ts": {"$lte": at}}, fields, sort=[("ts", -1), ("_id", -1)])
+        if sample is None:
+            sample = await db.chain_history.find_one(query, fields, sort=[("ts", 1), ("_id", 1)])
+            if sample is None:
+                return None
+        cursor = db.chain_history.find({"root": sample["root"], "seq": {"$lte": sample["seq"]}}).sort("seq", 1)
+        docs = [doc async for doc in cursor]
+        if not docs or docs[0]["seq"] != 0:
+            return None
+        keyframe = docs[0]
+        strikes = _unpack(keyframe["strikes"], "<f8")
+        values = _unpack(keyframe["values"], "<i8").reshape(len(FIELDS), len(strikes)).copy()
+        flat = values.reshape(-1)
+        ts = keyframe["ts"]
+        for seq, delta in enumerate(docs[1:], 1):
+            if delta["seq"] != seq:
+                # A lost insert; later deltas are relative to it
+                logger.warning(f"Chain history for {symbol} {expiry} is missing sample {seq} of {sample['root']}")
+                break
+            flat[np.cumsum(_unpack(delta["cells"], "<u4"))] += _unpack(delta["steps"], "<i8")
+            ts = delta["ts"]
+        return {"ts": ts.replace(tzinfo=timezone.utc), "strikes": strikes, "values": dequantize(values)}
+
+    async def changes(self, symbol: str, expiry: str, start: datetime, end: datetime) -> Optional[Dict[str, Any]]:
+        """Per-strike values at `end` and their change since `start`"""
+        before = await self.chain_at(symbol, expiry, start)
+        after = await self.chain_at(symbol, expiry, end)
+        if before is None or after is None:
+            return None
+        # Align on the later chain's strikes; strikes listed since start have no change
+        position = np.minimum(np.searchsorted(before["strikes"], after["strikes"]), len(before["strikes"]) - 1)
+        listed = before["strikes"][position] == after["strikes"]
+        change = after["values"] - np.where(listed, before["values"][:, position], np.nan)
+        columns = {"strike": after["strikes"].tolist()}
+        for i, field in enumerate(FIELDS):
+            columns[field] = _json_list(after["values"][i])
+            columns[f"{field}_change"] = _json_list(change[i])
+        totals = {}
+        for side in ("call", "put"):
+            row = FIELDS.index(f"{side}_oi")
+            totals[f"{side}_oi"] = round(float(np.nansum(after["values"][row])), 2)
+            totals[f"{side}_oi_change"] = round(float(np.nansum(change[row])), 2)
+        return {"start": before["ts"], "end": after["ts"], "totals": totals, "columns": columns}
+
+
+def _json_list(values: np.ndarray) -> List[Optional[float]]:
+    return [None if v != v else round(v, 2) for v in values.tolist()]
+
+
+def history_from_env(get_db: Callable) -> Optional[ChainHistory]:
+    if os.environ.get("CHAIN_HISTORY_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    return ChainHistory(
+        get_db,
+        interval=float(os.environ.get("CHAIN_HISTORY_INTERVAL", "60")),
+        keyframe_every=int(os.environ.get("CHAIN_HISTORY_KEYFRAME", "30")),
+        retention_days=int(os.environ.get("CHAIN_HISTORY_RETENTION_DAYS", "7"))
+    )
+
+
+def _benchmark(strikes: int = 120, samples: int = 8250):
+    """Stored size over an expiry cycle (~22 sessions of one-minute samples)"""
+    rng = np.random.default_rng(11)
+    history = ChainHistory(lambda: None)
+    values = np.vstack([
+        rng.integers(1000, 500000, (2, strikes)).astype(np.float64),
+        np.round(rng.uniform(1, 800, (2, strikes)), 2),
+        rng.integers(0, 100000, (2, strikes)).astype(np.float64),
+    ])
+    grid = np.arange(strikes) * 50.0 + 20000
+    raw = keyframe_bytes = delta_bytes = stored = 0
+    ts = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    latest = None
+    started = time.perf_counter()
+    for _ in range(samples):
+        # Roughly a quarter of the strikes trade in a minute
+        active = rng.random(strikes) < 0.25
+        values[0:2, active] += rng.integers(-500, 500, (2, active.sum())) * 25
+        values[2:4, active] = np.round(values[2:4, active] * rng.uniform(0.98, 1.02, (2, active.sum())), 2)
+        values[4:6, active] += rng.integers(0, 500, (2, active.sum()))
+        ts += timedelta(minutes=1)
+        doc = history.encode("NIFTY", "27-01-2026", ts, grid, values.copy(), latest)
+        raw += grid.nbytes + values.nbytes
+        if doc is None:
+            continue
+        latest = doc["_id"]
+        stored += 1
+        size = sum(len(v) for v in doc.values() if isinstance(v, bytes))
+        if doc["keyframe"]:
+            keyframe_bytes += size
+        else:
+            delta_bytes += size
+    elapsed = time.perf_counter() - started
+    print(f"{samples} samples x {strikes} strikes, {stored} stored, {elapsed / samples * 1e6:.0f} us per sample")
+    print(f"raw {raw / 1e6:.1f} MB, keyframes {keyframe_bytes / 1e6:.2f} MB, deltas {delta_bytes / 1e6:.2f} MB "
+          f"({raw / (keyframe_bytes + delta_bytes):.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    _benchmark(*(int(a) for a in sys.argv[1:3]))
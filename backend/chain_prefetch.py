@@ -0,0 +1,243 @@
+"""
+Background option-chain prefetcher.
+
+Keeps the option-chain snapshot cache warm for the chains users are most
+likely to open next, so clicking a dashboard row is normally a cache hit
+instead of a fresh (up to 30 s) getoptionchain call.
+
+Candidates are the most-viewed symbols (decayed request counts) plus any
+symbol the last dashboard flagged "High Volatility", each for its nearest
+monthly expiries and the expiries users recently asked for. Upstream calls
+are limited by a per-minute token bucket; with the shared snapshot store the
+bucket lives in the store, so the budget is shared by all workers rather
+than multiplied by their number. Popularity is tracked for at most
+PREFETCH_MAX_SYMBOLS symbols, least recently requested dropped first.
+
+ttl(symbol) gives the cache TTL a symbol's chain currently gets (it varies
+with market phase and volatility); a chain is re-warmed once it would expire
+before the next cycle.
+
+The prefetcher needs a live TrueData token and borrows the most recent one
+seen on an incoming request; it idles until one arrives, and while
+should_run() is false (e.g. outside market hours).
+
+Environment variables:
+    PREFETCH_ENABLED          "false" disables the background loop
+    PREFETCH_INTERVAL         seconds between cycles (default 10)
+    PREFETCH_BUDGET_PER_MIN   max upstream chain fetches per minute (default 20)
+    PREFETCH_TOP_SYMBOLS      most-viewed symbols to keep warm (default 5)
+    PREFETCH_HALF_LIFE        popularity half-life in seconds (default 900)
+    PREFETCH_MAX_SYMBOLS      symbols tracked for popularity (default 256)
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from market_calendar import last_thursday
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Shared-store key holding the cross-worker token bucket
+BUDGET_KEY = "prefetch:budget"
+
+
+def nearest_monthly_expiries(today: date, count: int = 2) -> List[str]:
+    """Upcoming monthly expiries (last Thursday) in the DD-MM-YYYY format the routes use"""
+    expiries = []
+    year, month = today.year, today.month
+    while len(expiries) < count:
+        expiry = last_thursday(year, month)
+        if expiry >= today:
+            expiries.append(expiry.strftime("%d-%m-%Y"))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return expiries
+
+
+class TokenBucket:
+    """Allows `rate` events per minute with bursts up to `rate`
+
+    With a store, the bucket level is kept in the store under BUDGET_KEY
+    (its written_at is the last update) and changed under the key's refresh
+    lease, so every worker draws from the same budget. A worker that can't
+    take the lease treats the bucket as empty for that attempt.
+    """
+
+    def __init__(self, rate_per_min: float, store=None):
+        self.capacity = max(rate_per_min, 0.0)
+        self.tokens = self.capacity
+        self.fill_rate = self.capacity / 60.0
+        self.store = store
+        self.updated = time.monotonic() if store is None else time.time()
+
+    def take(self) -> bool:
+        if self.store is None:
+            return self._take(time.monotonic())
+        with self.store.refresh_lease(BUDGET_KEY) as elected:
+            if not elected:
+                return False
+            state = self.store.read(BUDGET_KEY)
+            if state is not None:
+                self.updated, level = state
+                self.tokens = float(level)
+            now = time.time()
+            taken = self._take(now)
+            self.store.write(BUDGET_KEY, repr(self.tokens).encode(), written_at=now)
+            return taken
+
+    def _take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + max(now - self.updated, 0.0) * self.fill_rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class ChainPrefetcher:
+    """Tracks chain popularity and warms the most likely chains in the background"""
+
+    def __init__(
+        self,
+        warm: Callable[[str, str, str, float], Awaitable[bool]],
+        is_fresh: Callable[[str, str, float], bool],
+        ttl: Callable[[str], float],
+        interval: float = 10.0,
+        budget_per_min: float = 20.0,
+        top_symbols: int = 5,
+        half_life: float = 900.0,
+        should_run: Optional[Callable[[], bool]] = None,
+        store=None,
+        max_symbols: int = 256
+    ):
+        self.warm = warm
+        self.is_fresh = is_fresh
+        self.should_run = should_run
+        self.ttl = ttl
+        self.interval = interval
+        self.bucket = TokenBucket(budget_per_min, store)
+        self.top_symbols = top_symbols
+        self.decay = math.log(2) / half_life
+        self.max_symbols = max(1, max_symbols)
+        # symbol -> (decayed score, last update), least recently requested first
+        self._scores: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._recent_expiries: Dict[str, Deque[str]] = {}
+        self._high_volatility: List[str] = []
+        self._token: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _score(self, symbol: str, now: float) -> float:
+        score, updated = self._scores.get(symbol, (0.0, now))
+        return score * math.exp(-self.decay * (now - updated))
+
+    def note_chain_request(self, token: str, symbol: str, expiry: str):
+        """Record a user opening a chain"""
+        now = time.monotonic()
+        self._scores[symbol] = (self._score(symbol, now) + 1.0, now)
+        self._scores.move_to_end(symbol)
+        while len(self._scores) > self.max_symbols:
+            evicted, _ = self._scores.popitem(last=False)
+            self._recent_expiries.pop(evicted, None)
+        expiries = self._recent_expiries.setdefault(symbol, deque(maxlen=3))
+        if expiry not in expiries:
+            expiries.append(expiry)
+        self._token = token
+        self.ensure_started()
+
+    def note_dashboard(self, token: str, high_volatility: List[str]):
+        """Record the symbols the latest dashboard flagged as high volatility"""
+        self._high_volatility = list(high_volatility)
+        self._token = token
+        self.ensure_started()
+
+    def candidates(self) -> List[Tuple[str, str]]:
+        """(symbol, expiry) pairs to keep warm, most valuable first"""
+        now = time.monotonic()
+        ranked = sorted(self._scores, key=lambda s: self._score(s, now), reverse=True)
+        symbols = list(dict.fromkeys(ranked[:self.top_symbols] + self._high_volatility))
+
+        default_expiries = nearest_monthly_expiries(date.today())
+        pairs = []
+        for symbol in symbols:
+            recent = list(reversed(self._recent_expiries.get(symbol, ())))
+            for expiry in dict.fromkeys(recent + default_expiries):
+                pairs.append((symbol, expiry))
+        return pairs
+
+    async def run_cycle(self) -> int:
+        """Warm chains that would go stale before the next cycle; returns fetch count"""
+        if self._token is None:
+            return 0
+        if self.should_run is not None and not self.should_run():
+            return 0
+        fetched = 0
+        for symbol, expiry in self.candidates():
+            # Refresh anything that would expire (at the symbol's current TTL) before we look again
+            max_age = max(self.ttl(symbol) - self.interval, 0.0)
+            if self.is_fresh(symbol, expiry, max_age):
+                continue
+            if not self.bucket.take():
+                break
+            try:
+                if await self.warm(self._token, symbol, expiry, max_age):
+                    fetched += 1
+            except Exception as e:
+                logger.warning(f"Prefetch failed for {symbol} {expiry}: {str(e)}", extra={"category": "upstream"})
+        return fetched
+
+    async def _loop(self):
+        while True:
+            try:
+                with span("prefetch cycle") as cycle_span:
+                    fetched = await self.run_cycle()
+                    cycle_span.set_attribute("prefetch.fetched", fetched)
+                if fetched:
+                    logger.debug(f"Prefetched {fetched} option chains")
+            except Exception as e:
+                logger.error(f"Prefetch cycle error: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def ensure_started(self):
+        """Start the background loop on the running event loop if it isn't running"""
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._task = None
+            return
+        # Called from inside a request: start the task in an empty context so
+        # it doesn't inherit that request's trace span (and sampling decision)
+        self._task = contextvars.Context().run(loop.create_task, self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def prefetcher_from_env(warm, is_fresh, ttl: Callable[[str], float], should_run=None, store=None) -> Optional[ChainPrefetcher]:
+    if os.environ.get("PREFETCH_ENABLED", "true").lower() == "false":
+        return None
+    try:
+        return ChainPrefetcher(
+            warm,
+            is_fresh,
+            ttl,
+            interval=float(os.environ.get("PREFETCH_INTERVAL", "10")),
+            budget_per_min=float(os.environ.get("PREFETCH_BUDGET_PER_MIN", "20")),
+            top_symbols=int(os.environ.get("PREFETCH_TOP_SYMBOLS", "5")),
+            half_life=float(os.environ.get("PREFETCH_HALF_LIFE", "900")),
+            should_run=should_run,
+            store=store,
+            max_symbols=int(os.environ.get("PREFETCH_MAX_SYMBOLS", "256"))
+        )
+    except Exception as e:
+        logger.warning(f"Option chain prefetch disabled: {str(e)}")
+        return None
@@ -0,0 +1,436 @@
+"""
+Daily ATM implied-volatility history and the backfill job that builds it.
+
+The backfill walks the symbol universe and, for each symbol:
+
+1. fetches daily underlying bars from the TrueData history API (getbars)
+2. picks each day's near-month monthly expiry and ATM strike
+3. fetches daily bars for every distinct ATM call / put contract, one
+   request per contract covering all the days it was ATM
+4. solves Black-Scholes IV for all days at once (vectorized bisection)
+5. writes the days with insert_many(ordered=False) in batches; a unique
+   (symbol, date) index turns re-inserted days into ignored duplicates
+6. records in backfill_checkpoints the last day before the first one with
+   a failed contract fetch (timeout, rate limit), or the last day if none
+   failed
+
+Upstream requests are bounded by one semaphore for the whole run, with
+several symbols in flight at once. An interrupted run resumes from each
+symbol's checkpoint, so days whose contracts could not be fetched are
+retried. The underlying bars are also merged into the realized volatility
+history file (see volatility.py), which live workers may be writing to.
+
+Strike steps for the equities are guessed from the price level unless listed
+in STRIKE_STEPS; IV uses a flat risk-free rate and no dividends.
+
+    python iv_history.py [--symbols A,B] [--days 365] [--token T]
+
+Credentials come from --token or TRUEDATA_USERNAME / TRUEDATA_PASSWORD;
+MongoDB from MONGO_URL / DB_NAME as for the server.
+
+Environment variables:
+    BACKFILL_CONCURRENCY           upstream requests in flight (default 16)
+    BACKFILL_SYMBOL_CONCURRENCY    symbols processed at once (default 8)
+    BACKFILL_BATCH                 documents per insert_many (default 1000)
+    RISK_FREE_RATE                 annual rate for the IV solver (default 0.065)
+    IV_PERCENTILE_TTL              seconds between history reloads in the server (default 3600)
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pymongo.errors import BulkWriteError
+
+from export_stream import bounded_as_completed, parse_list
+from market_calendar import IST, last_thursday
+
+logger = logging.getLogger(__name__)
+
+TRUEDATA_HISTORY_URL = "https://history.truedata.in"
+
+STRIKE_STEPS = {
+    "NIFTY": 50.0,
+    "BANKNIFTY": 100.0,
+}
+
+
+def strike_step(symbol: str, price: float) -> float:
+    step = STRIKE_STEPS.get(symbol)
+    if step is not None:
+        return step
+    for limit, step in ((250, 2.5), (500, 5.0), (1000, 10.0), (2500, 20.0), (5000, 50.0)):
+        if price < limit:
+            return step
+    return 100.0
+
+
+def monthly_expiry_after(day: date) -> date:
+    """First monthly expiry strictly after `day` (a contract is never priced on its expiry)"""
+    expiry = last_thursday(day.year, day.month)
+    if expiry <= day:
+        year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+        expiry = last_thursday(year, month)
+    return expiry
+
+
+def contract_symbol(symbol: str, expiry: date, strike: float, kind: str) -> str:
+    """TrueData monthly option symbol, e.g. NIFTY25NOV24800CE"""
+    text = str(int(strike)) if float(strike).is_integer() else repr(float(strike))
+    return f"{symbol}{expiry:%y}{expiry.strftime('%b').upper()}{text}{kind}"
+
+
+# Black-Scholes, vectorized
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """Standard normal CDF (Abramowitz-Stegun 7.1.26, |error| < 1e-7)"""
+    z = np.abs(x) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def bs_price(spot, strike, years, rate, sigma, is_call):
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * years) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    discount = strike * np.exp(-rate * years)
+    call = spot * norm_cdf(d1) - discount * norm_cdf(d2)
+    return np.where(is_call, call, call - spot + discount)
+
+
+def implied_volatility(
+    price: np.ndarray,
+    spot: np.ndarray,
+    strike: np.ndarray,
+    years: np.ndarray,
+    rate: float,
+    is_call: np.ndarray,
+    iterations: int = 60
+) -> np.ndarray:
+    """IV (annualized, as a fraction) for arrays of options; NaN outside no-arbitrage bounds"""
+    price, spot, strike, years = (np.asarray(a, dtype=np.float64) for a in (price, spot, strike, years))
+    is_call = np.asarray(is_call, dtype=bool)
+    discount = strike * np.exp(-rate * years)
+    lower = np.where(is_call, np.maximum(spot - discount, 0.0), np.maximum(discount - spot, 0.0))
+    upper = np.where(is_call, spot, discount)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        valid = (price > lower) & (price < upper) & (years > 0) & (spot > 0) & (strike > 0)
+    low = np.full(price.shape, 1e-4)
+    high = np.full(price.shape, 5.0)
+    safe = np.where(valid, 1.0, 0.0)
+    # Price is increasing in sigma, so bisection always converges
+    for _ in range(iterations):
+        mid = 0.5 * (low + high)
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            above = bs_price(np.where(valid, spot, 1.0), np.where(valid, strike, 1.0),
+                             np.where(valid, years, 1.0), rate, mid, is_call) > price * safe
+        high = np.where(above, mid, high)
+        low = np.where(above, low, mid)
+    return np.where(valid, 0.5 * (low + high), np.nan)
+
+
+# TrueData history API
+
+def _history_time(day: date, end: bool) -> str:
+    return f"{day:%y%m%d}T{'23:59:59' if end else '00:00:00'}"
+
+
+def parse_bars(data: Dict[str, Any]) -> List[Tuple[date, float, float, float, float]]:
+    """getbars JSON Records ([timestamp, open, high, low, close, volume, ...]) as daily rows"""
+    rows = []
+    for record in data.get("Records") or []:
+        try:
+            rows.append((
+                date.fromisoformat(str(record[0])[:10]),
+                float(record[1]), float(record[2]), float(record[3]), float(record[4]),
+            ))
+        except (IndexError, TypeError, ValueError):
+            continue
+    return rows
+
+
+class IvBackfill:
+    """Resumable, checkpointed ATM IV backfill over a symbol universe"""
+
+    def __init__(
+        self,
+        get: Callable,
+        db,
+        token: str,
+        concurrency: int = 16,
+        symbol_concurrency: int = 8,
+        batch_size: int = 1000,
+        rate: float = 0.065,
+        bar_history=None
+    ):
+        self.get = get
+        self.db = db
+        self.token = token
+        self.symbol_concurrency = symbol_concurrency
+        self.batch_size = batch_size
+        self.rate = rate
+        self.bar_history = bar_history
+        self._upstream = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.inserted = 0
+        self.fetch_failures = 0
+
+    async def prepare(self):
+        await self.db.iv_history.create_index(
+            [("symbol", 1), ("date", 1)], unique=True, name="symbol_date_unique"
+        )
+
+    async def bars(self, symbol: str, start: date, end: date) -> List[Tuple[date, float, float, float, float]]:
+        params = {
+            "symbol": symbol,
+            "from": _history_time(start, False),
+            "to": _history_time(end, True),
+            "response": "json",
+            "interval": "eod",
+        }
+        async with self._upstream:
+            self.requests += 1
+            response = await self.get("getbars", self.token, params, 30.0)
+        if response.status_code != 200:
+            raise RuntimeError(f"getbars {symbol} returned {response.status_code}")
+        return parse_bars(response.json())
+
+    async def checkpoint(self, symbol: str) -> Optional[date]:
+        doc = await self.db.backfill_checkpoints.find_one({"_id": f"iv:{symbol}"})
+        return doc["through"].date() if doc else None
+
+    async def save_checkpoint(self, symbol: str, through: date):
+        await self.db.backfill_checkpoints.replace_one(
+            {"_id": f"iv:{symbol}"},
+            {
+                "_id": f"iv:{symbol}",
+                "through": datetime(through.year, through.month, through.day, tzinfo=timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
+            },
+            upsert=True
+        )
+
+    async def insert(self, docs: List[Dict[str, Any]]):
+        for start in range(0, len(docs), self.batch_size):
+            batch = docs[start:start + self.batch_size]
+            try:
+                result = await self.db.iv_history.insert_many(batch, ordered=False)
+                self.inserted += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Days already written by an interrupted run are fine; anything else is not
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                self.inserted += e.details.get("nInserted", 0)
+
+    async def backfill_symbol(self, symbol: str, start: date, end: date) -> int:
+        """Backfill one symbol from its checkpoint (or start) through end; returns days written"""
+        through = await self.checkpoint(symbol)
+        if through is not None:
+            start = max(start, through + timedelta(days=1))
+        if start > end:
+            return 0
+
+        underlying = await self.bars(symbol, start, end)
+        if not underlying:
+            return 0
+        if self.bar_history is not None:
+            await self.bar_history.store_bars(symbol, underlying)
+
+        days = [row[0] for row in underlying]
+        spot = np.array([row[4] for row in underlying])
+        expiries = [monthly_expiry_after(day) for day in days]
+        steps = np.array([strike_step(symbol, price) for price in spot])
+        strikes = np.round(spot / steps) * steps
+
+        # One request per contract for all the days it was at the money
+        contracts: Dict[Tuple[date, float], List[int]] = {}
+        for i, key in enumerate(zip(expiries, strikes.tolist())):
+            contracts.setdefault(key, []).append(i)
+
+        call = np.full(len(days), np.nan)
+        put = np.full(len(days), np.nan)
+        # Days with a contract that couldn't be fetched (as opposed to one with no trades)
+        failed = np.zeros(len(days), dtype=bool)
+
+        async def fetch(expiry: date, strike: float, kind: str, indices: List[int]):
+            try:
+                rows = await self.bars(contract_symbol(symbol, expiry, strike, kind), days[indices[0]], days[indices[-1]])
+            except Exception as e:
+                self.fetch_failures += 1
+                failed[indices] = True
+                logger.warning(f"No {kind} bars for {symbol} {expiry} {strike}: {str(e)}")
+                return
+            closes = {row[0]: row[4] for row in rows}
+            target = call if kind == "CE" else put
+            for i in indices:
+                target[i] = closes.get(days[i], np.nan)
+
+        await asyncio.gather(*(
+            fetch(expiry, strike, kind, indices)
+            for (expiry, strike), indices in contracts.items()
+            for kind in ("CE", "PE")
+        ))
+
+        years = np.array([(expiry - day).days / 365.0 for expiry, day in zip(expiries, days)])
+        n = len(days)
+        iv = implied_volatility(
+            np.concatenate([call, put]), np.tile(spot, 2), np.tile(strikes, 2), np.tile(years, 2),
+            self.rate, np.repeat([True, False], n)
+        ) * 100.0
+        call_iv, put_iv = iv[:n], iv[n:]
+        with np.errstate(invalid="ignore"):
+            atm_iv = np.nanmean(np.vstack([call_iv, put_iv]), axis=0) if n else iv[:0]
+
+        def num(value):
+            return None if math.isnan(value) else round(float(value), 2)
+
+        docs = [
+            {
+                "symbol": symbol,
+                "date": datetime(day.year, day.month, day.day, tzinfo=timezone.utc),
+                "spot": float(spot[i]),
+                "expiry": expiries[i].isoformat(),
+                "strike": float(strikes[i]),
+                "call_iv": num(call_iv[i]),
+                "put_iv": num(put_iv[i]),
+                "atm_iv": num(atm_iv[i]),
+            }
+            for i, day in enumerate(days)
+            if not math.isnan(atm_iv[i])
+        ]
+        await self.insert(docs)
+        # Stop the checkpoint short of the first failed day so a rerun retries it;
+        # days after it that were written are ignored as duplicates then
+        first_failed = int(np.argmax(failed)) if failed.any() else len(days)
+        if first_failed > 0:
+            await self.save_checkpoint(symbol, days[first_failed - 1])
+        return len(docs)
+
+    async def run(self, symbols: Sequence[str], start: date, end: date) -> Dict[str, Any]:
+        await self.prepare()
+        started = time.perf_counter()
+        failed = {}
+
+        def job(symbol):
+            async def run_symbol():
+                try:
+                    return symbol, await self.backfill_symbol(symbol, start, end), None
+                except Exception as e:
+                    return symbol, 0, str(e)
+            return run_symbol
+
+        async for symbol, written, error in bounded_as_completed(
+            (job(symbol) for symbol in symbols), self.symbol_concurrency
+        ):
+            if error:
+                failed[symbol] = error
+                logger.error(f"IV backfill failed for {symbol}: {error}")
+            else:
+                logger.info(f"IV backfill {symbol}: {written} days")
+
+        return {
+            "symbols": len(symbols),
+            "failed": failed,
+            "fetch_failures": self.fetch_failures,
+            "requests": self.requests,
+            "inserted": self.inserted,
+            "seconds": round(time.perf_counter() - started, 1),
+        }
+
+
+class IvPercentiles:
+    """Latest backfilled ATM IV and its percentile rank over the last year, per symbol"""
+
+    def __init__(self, get_db: Callable, ttl: float = 3600.0, days: int = 365):
+        self.get_db = get_db
+        self.ttl = ttl
+        self.days = days
+        self._values: Dict[str, Tuple[float, float]] = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def get(self, symbol: str) -> Optional[Tuple[float, float]]:
+        return self._values.get(symbol)
+
+    async def refresh_if_stale(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            self._loaded_at = time.monotonic()
+            db = self.get_db()
+            if db is None:
+                return
+            try:
+                cutoff = datetime.now(timezone.utc) - timedelta(days=self.days)
+                series: Dict[str, List[float]] = {}
+                cursor = db.iv_history.find(
+                    {"date": {"$gte": cutoff}, "atm_iv": {"$ne": None}},
+                    {"_id": 0, "symbol": 1, "atm_iv": 1}
+                ).sort([("symbol", 1), ("date", 1)])
+                async for doc in cursor:
+                    series.setdefault(doc["symbol"], []).append(doc["atm_iv"])
+                values = {}
+                for symbol, ivs in series.items():
+                    history = np.array(ivs)
+                    latest = history[-1]
+                    values[symbol] = (float(latest), round(float((history <= latest).mean() * 100.0), 2))
+                self._values = values
+            except Exception as e:
+                logger.warning(f"Could not load IV history: {str(e)}")
+
+
+def percentiles_from_env(get_db: Callable) -> IvPercentiles:
+    return IvPercentiles(get_db, ttl=float(os.environ.get("IV_PERCENTILE_TTL", "3600")))
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Backfill daily ATM implied volatility")
+    parser.add_argument("--symbols", help="comma-separated symbols (default: the dashboard universe)")
+    parser.add_argument("--days", type=int, default=365, help="calendar days of history (default 365)")
+    parser.add_argument("--token", help="TrueData access token (default: log in with TRUEDATA_USERNAME/PASSWORD)")
+    args = parser.parse_args()
+
+    import server
+
+    token = args.token
+    if not token:
+        result = await server.get_truedata_token(
+            os.environ.get("TRUEDATA_USERNAME", ""), os.environ.get("TRUEDATA_PASSWORD", "")
+        )
+        if "error" in result:
+            raise SystemExit(f"TrueData login failed: {result['error']}")
+        token = result["access_token"]
+    db = server.get_mongo_db()
+    if db is None:
+        raise SystemExit("MONGO_URL and DB_NAME must be set")
+
+    async def get(path, token, params, timeout):
+        return await server.truedata_get(path, token, params, timeout, base_url=TRUEDATA_HISTORY_URL)
+
+    backfill = IvBackfill(
+        get,
+        db,
+        token,
+        concurrency=int(os.environ.get("BACKFILL_CONCURRENCY", "16")),
+        symbol_concurrency=int(os.environ.get("BACKFILL_SYMBOL_CONCURRENCY", "8")),
+        batch_size=int(os.environ.get("BACKFILL_BATCH", "1000")),
+        rate=float(os.environ.get("RISK_FREE_RATE", "0.065")),
+        bar_history=server.volatility_engine.history
+    )
+    end = datetime.now(IST).date() - timedelta(days=1)
+    summary = await backfill.run(parse_list(args.symbols) or server.TOP_20_STOCKS, end - timedelta(days=args.days), end)
+    print(summary)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
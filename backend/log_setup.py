@@ -0,0 +1,188 @@
+"""
+Non-blocking, structured logging for the backend.
+
+Request handlers only enqueue log records; a background QueueListener thread
+formats them as JSON lines and writes them to stderr, so log I/O never runs
+on the event loop. Serverless functions (Vercel, Netlify / AWS Lambda) log
+synchronously instead: the runtime freezes the process between invocations
+and atexit never runs, so queued records would sit there unwritten.
+
+High-volume categories can be sampled below ERROR; errors are never sampled,
+only rate limited per call site. A record's category is its ``extra={"category": ...}`` value,
+falling back to the logger name (e.g. "httpx" for per-request client logs).
+Per-symbol upstream failures (a symbol's LTP or chain fetch failing, an
+export skipping an empty chain) are warnings in the "upstream" category.
+
+Environment variables:
+    LOG_LEVEL              root level (default INFO)
+    LOG_FORMAT             "json" (default) or "text"
+    LOG_SAMPLE_RATES       comma separated category=rate pairs, rate in [0, 1]
+                           (default "httpx=0.1,upstream=0.1")
+    LOG_ERROR_RATE_LIMIT   max error records per call site per minute (default 10)
+    LOG_SYNC               "true" to write on the calling thread (default: only
+                           when running serverless)
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+DEFAULT_SAMPLE_RATES = "httpx=0.1,upstream=0.1"
+ERROR_RATE_WINDOW = 60.0
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[QueueListener] = None
+_configured = False
+
+
+def running_serverless() -> bool:
+    """Whether this process is a serverless function (frozen between invocations)"""
+    return bool(os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        category, rate = item.split("=", 1)
+        try:
+            rates[category.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        # Queued records arrive with the traceback already rendered; synchronous ones don't
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records below ERROR from configured categories"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        rate = self.rates.get(getattr(record, "category", None) or record.name)
+        if rate is None or rate >= 1.0:
+            return True
+        return random.random() < rate
+
+
+class ErrorRateLimitFilter(logging.Filter):
+    """Drop repeated errors from the same call site beyond a per-minute budget"""
+
+    def __init__(self, limit: int, window: float = ERROR_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> (window start, count, suppressed)
+        self._sites: Dict[Tuple[str, int], Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.ERROR or self.limit <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._sites.get(site, (now, 0, 0))
+            if now - start >= self.window:
+                if suppressed:
+                    record.suppressed = suppressed
+                start, count, suppressed = now, 0, 0
+            if count >= self.limit:
+                self._sites[site] = (start, count, suppressed + 1)
+                return False
+            self._sites[site] = (start, count + 1, suppressed)
+            return True
+
+
+class PreparedQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting to the listener thread
+
+    The stock QueueHandler renders the final message with its own formatter
+    before enqueueing; here only the arguments and traceback are resolved (so
+    the record is safe to hand across threads) and the JSON rendering happens
+    in the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+
+def setup_logging():
+    """Install the queue-based (or, serverless, synchronous) handlers on the root logger (idempotent)"""
+    global _listener, _configured
+    if _configured:
+        return
+    _configured = True
+
+    if os.environ.get("LOG_FORMAT", "json").lower() == "text":
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    else:
+        formatter = JsonFormatter()
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+    synchronous = os.environ.get("LOG_SYNC", "").lower() in ("1", "true", "yes") or running_serverless()
+
+    log_queue = queue.SimpleQueue()
+    entry = output if synchronous else PreparedQueueHandler(log_queue)
+    # Filters run on the calling thread so dropped records are never copied
+    entry.addFilter(SamplingFilter(parse_sample_rates(
+        os.environ.get("LOG_SAMPLE_RATES", DEFAULT_SAMPLE_RATES)
+    )))
+    entry.addFilter(ErrorRateLimitFilter(int(os.environ.get("LOG_ERROR_RATE_LIMIT", "10"))))
+
+    root = logging.getLogger()
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(entry)
+    if synchronous:
+        return
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Flush queued records before the process exits
+    atexit.register(_listener.stop)
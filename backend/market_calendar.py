@@ -0,0 +1,195 @@
+"""
+NSE trading calendar and market-hours-aware refresh cadence.
+
+The calendar knows the session times (pre-open 09:00, open 09:15, close
+15:30 IST), weekends, exchange holidays and monthly expiry days. The cadence
+turns that into cache TTLs:
+
+* market open: the base TTL for volatile symbols (and for everything on
+  expiry day), base * MARKET_CALM_FACTOR for calm ones
+* pre-open: at least MARKET_PRE_OPEN_TTL
+* closed: a snapshot taken after the last close stays fresh until the next
+  session, so nothing is fetched from TrueData off-hours
+
+It also recommends how long browsers should wait before the next dashboard
+refresh (see /api/market/status).
+
+Environment variables:
+    MARKET_HOURS_AWARE              "false" treats the market as always open
+    MARKET_HOLIDAYS                 comma-separated YYYY-MM-DD exchange holidays
+    MARKET_CALM_FACTOR              TTL multiplier for calm symbols (default 3)
+    MARKET_PRE_OPEN_TTL             minimum TTL during pre-open in seconds (default 60)
+    MARKET_CLIENT_REFRESH_ACTIVE    browser refresh while volatile, seconds (default 300)
+    MARKET_CLIENT_REFRESH_CALM      browser refresh while calm, seconds (default 1800)
+"""
+import logging
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+IST = timezone(timedelta(hours=5, minutes=30))
+PRE_OPEN = time(9, 0)
+OPEN = time(9, 15)
+CLOSE = time(15, 30)
+
+PHASE_PRE_OPEN = "pre_open"
+PHASE_OPEN = "open"
+PHASE_CLOSED = "closed"
+
+
+def last_thursday(year: int, month: int) -> date:
+    if month == 12:
+        last_day = date(year, 12, 31)
+    else:
+        last_day = date(year, month + 1, 1) - timedelta(days=1)
+    return last_day - timedelta(days=(last_day.weekday() - 3) % 7)
+
+
+class MarketCalendar:
+    """Trading days and session phases for NSE"""
+
+    def __init__(self, holidays: Iterable[date] = ()):
+        self.holidays: Set[date] = set(holidays)
+
+    def is_trading_day(self, day: date) -> bool:
+        return day.weekday() < 5 and day not in self.holidays
+
+    def is_expiry_day(self, day: date) -> bool:
+        """Monthly expiry: last Thursday, moved back to the previous trading day on a holiday"""
+        expiry = last_thursday(day.year, day.month)
+        while not self.is_trading_day(expiry):
+            expiry -= timedelta(days=1)
+        return day == expiry
+
+    def phase(self, now: datetime) -> str:
+        local = now.astimezone(IST)
+        if not self.is_trading_day(local.date()):
+            return PHASE_CLOSED
+        clock = local.time()
+        if PRE_OPEN <= clock < OPEN:
+            return PHASE_PRE_OPEN
+        if OPEN <= clock < CLOSE:
+            return PHASE_OPEN
+        return PHASE_CLOSED
+
+    def last_close(self, now: datetime) -> datetime:
+        """Most recent session close at or before now"""
+        local = now.astimezone(IST)
+        day = local.date()
+        if local.time() < CLOSE:
+            day -= timedelta(days=1)
+        while not self.is_trading_day(day):
+            day -= timedelta(days=1)
+        return datetime.combine(day, CLOSE, IST)
+
+    def next_pre_open(self, now: datetime) -> datetime:
+        """Start of the next pre-open session after now"""
+        local = now.astimezone(IST)
+        day = local.date()
+        if local.time() >= PRE_OPEN:
+            day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return datetime.combine(day, PRE_OPEN, IST)
+
+
+class RefreshCadence:
+    """Cache TTLs and client refresh intervals that follow the trading session"""
+
+    def __init__(
+        self,
+        calendar: MarketCalendar,
+        enabled: bool = True,
+        calm_factor: float = 3.0,
+        pre_open_ttl: float = 60.0,
+        client_active: float = 300.0,
+        client_calm: float = 1800.0
+    ):
+        self.calendar = calendar
+        self.enabled = enabled
+        self.calm_factor = calm_factor
+        self.pre_open_ttl = pre_open_ttl
+        self.client_active = client_active
+        self.client_calm = client_calm
+        # None until a dashboard has been built in this process
+        self._volatile: Optional[Set[str]] = None
+
+    def note_volatile(self, symbols: Iterable[str]):
+        """Record the symbols the latest dashboard flagged as high volatility"""
+        self._volatile = set(symbols)
+
+    def phase(self, now: Optional[datetime] = None) -> str:
+        if not self.enabled:
+            return PHASE_OPEN
+        return self.calendar.phase(now or datetime.now(timezone.utc))
+
+    def is_open(self) -> bool:
+        return self.phase() == PHASE_OPEN
+
+    def _volatile_session(self, now: datetime, symbol: Optional[str]) -> bool:
+        if self.enabled and self.calendar.is_expiry_day(now.astimezone(IST).date()):
+            return True
+        if self._volatile is None:
+            return True  # no signal yet - keep the base cadence
+        return symbol in self._volatile if symbol else bool(self._volatile)
+
+    def ttl(self, base: float, symbol: Optional[str] = None, now: Optional[datetime] = None) -> float:
+        """Cache TTL for a key whose base TTL applies to a volatile open market"""
+        now = now or datetime.now(timezone.utc)
+        phase = self.phase(now)
+        if phase == PHASE_CLOSED:
+            # Anything written after the last close is the closing snapshot
+            return max(base, (now - self.calendar.last_close(now)).total_seconds())
+        if phase == PHASE_PRE_OPEN:
+            return max(base, self.pre_open_ttl)
+        return base if self._volatile_session(now, symbol) else base * self.calm_factor
+
+    def client_refresh_after(self, now: Optional[datetime] = None) -> float:
+        """Seconds a browser should wait before refreshing the dashboard"""
+        now = now or datetime.now(timezone.utc)
+        phase = self.phase(now)
+        if phase == PHASE_CLOSED:
+            return max((self.calendar.next_pre_open(now) - now).total_seconds(), self.client_active)
+        if phase == PHASE_PRE_OPEN:
+            opens = datetime.combine(now.astimezone(IST).date(), OPEN, IST)
+            return max((opens - now).total_seconds(), 1.0)
+        return self.client_active if self._volatile_session(now, None) else self.client_calm
+
+    def status(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        now = now or datetime.now(timezone.utc)
+        local_day = now.astimezone(IST).date()
+        return {
+            "phase": self.phase(now),
+            "hours_aware": self.enabled,
+            "trading_day": self.calendar.is_trading_day(local_day),
+            "expiry_day": self.calendar.is_expiry_day(local_day),
+            "last_close": self.calendar.last_close(now).isoformat(),
+            "next_pre_open": self.calendar.next_pre_open(now).isoformat(),
+            "refresh_after": round(self.client_refresh_after(now)),
+        }
+
+
+def parse_holidays(value: str) -> Set[date]:
+    holidays = set()
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            holidays.add(date.fromisoformat(item))
+        except ValueError:
+            logger.warning(f"Ignoring invalid MARKET_HOLIDAYS entry: {item}")
+    return holidays
+
+
+def cadence_from_env(enabled: bool = True) -> RefreshCadence:
+    return RefreshCadence(
+        MarketCalendar(parse_holidays(os.environ.get("MARKET_HOLIDAYS", ""))),
+        enabled=enabled and os.environ.get("MARKET_HOURS_AWARE", "true").lower() != "false",
+        calm_factor=float(os.environ.get("MARKET_CALM_FACTOR", "3")),
+        pre_open_ttl=float(os.environ.get("MARKET_PRE_OPEN_TTL", "60")),
+        client_active=float(os.environ.get("MARKET_CLIENT_REFRESH_ACTIVE", "300")),
+        client_calm=float(os.environ.get("MARKET_CLIENT_REFRESH_CALM", "1800"))
+    )
@@ -0,0 +1,156 @@
+"""
+Market snapshot recorder and replay engine for TrueData responses.
+
+The recorder appends every upstream response (LTP, option chain) with its
+timestamp to gzip-compressed JSON-lines segments that rotate after a fixed
+number of records. The replayer loads those segments and serves them back in
+place of TrueData, at 1x or accelerated speed, so a busy session can be
+reproduced offline.
+
+Enable with environment variables:
+    MARKET_RECORD_DIR        directory to write segments to
+    MARKET_RECORD_SEGMENT    records per segment before rotating (default 5000)
+    MARKET_REPLAY_DIR        directory to replay segments from
+    MARKET_REPLAY_SPEED      replay clock multiplier (default 1.0)
+"""
+import atexit
+import bisect
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_GLOB = "segment-*.jsonl.gz"
+
+
+def record_key(path: str, params: Dict[str, str]) -> str:
+    """Canonical key for an upstream request (path plus sorted params)"""
+    return f"{path}?{urlencode(sorted(params.items()))}"
+
+
+class MarketRecorder:
+    """Appends upstream responses to compressed, rotating segment files"""
+
+    def __init__(self, directory: str, segment_records: int = 5000):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_records = max(1, segment_records)
+        self._lock = threading.Lock()
+        self._file = None
+        self._count = 0
+
+    def _open_segment(self):
+        # Segment names sort chronologically; the pid keeps workers apart
+        name = f"segment-{time.time_ns()}-{os.getpid()}.jsonl.gz"
+        self._file = gzip.open(self.directory / name, "at", encoding="utf-8")
+        self._count = 0
+        logger.info(f"Recording market data to {name}")
+
+    def record(self, path: str, params: Dict[str, str], status_code: int, body: str):
+        """Append one upstream response to the current segment"""
+        line = json.dumps({
+            "ts": time.time(),
+            "key": record_key(path, params),
+            "status": status_code,
+            "body": body
+        }, separators=(",", ":"))
+        with self._lock:
+            if self._file is None or self._count >= self.segment_records:
+                self.close_segment()
+                self._open_segment()
+            self._file.write(line + "\n")
+            self._count += 1
+
+    def close_segment(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception as e:
+                logger.error(f"Error closing recording segment: {str(e)}")
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self.close_segment()
+
+
+class MarketReplayer:
+    """Serves recorded responses on a replay clock instead of calling TrueData"""
+
+    def __init__(self, directory: str, speed: float = 1.0):
+        self.directory = Path(directory)
+        self.speed = speed if speed > 0 else 1.0
+        # key -> parallel lists of timestamps and (status, body)
+        self._times: Dict[str, List[float]] = {}
+        self._responses: Dict[str, List[Tuple[int, str]]] = {}
+        self._first_ts: Optional[float] = None
+        self._started_at: Optional[float] = None
+        self._load()
+
+    def _load(self):
+        records = []
+        for segment in sorted(self.directory.glob(SEGMENT_GLOB)):
+            try:
+                with gzip.open(segment, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            records.append(json.loads(line))
+            except (OSError, EOFError, json.JSONDecodeError) as e:
+                # A segment cut off by a crash still yields its complete lines
+                logger.warning(f"Stopped reading truncated segment {segment.name}: {str(e)}")
+
+        records.sort(key=lambda r: r["ts"])
+        for r in records:
+            self._times.setdefault(r["key"], []).append(r["ts"])
+            self._responses.setdefault(r["key"], []).append((r["status"], r["body"]))
+        if records:
+            self._first_ts = records[0]["ts"]
+        logger.info(f"Loaded {len(records)} recorded responses for replay from {self.directory}")
+
+    def replay_time(self) -> float:
+        """Recorded timestamp the replay clock currently points at"""
+        now = time.monotonic()
+        if self._started_at is None:
+            self._started_at = now
+        return (self._first_ts or 0.0) + (now - self._started_at) * self.speed
+
+    def lookup(self, path: str, params: Dict[str, str]) -> Optional[Tuple[int, str]]:
+        """Latest recorded response for a request at the current replay time"""
+        key = record_key(path, params)
+        times = self._times.get(key)
+        if not times:
+            return None
+        i = bisect.bisect_right(times, self.replay_time()) - 1
+        return self._responses[key][max(i, 0)]
+
+
+def recorder_from_env() -> Optional[MarketRecorder]:
+    directory = os.environ.get("MARKET_RECORD_DIR")
+    if not directory:
+        return None
+    try:
+        recorder = MarketRecorder(directory, int(os.environ.get("MARKET_RECORD_SEGMENT", "5000")))
+        # Serverless handlers never run shutdown hooks; close the gzip trailer at exit
+        atexit.register(recorder.close)
+        return recorder
+    except Exception as e:
+        logger.warning(f"Market recorder disabled: {str(e)}")
+        return None
+
+
+def replayer_from_env() -> Optional[MarketReplayer]:
+    directory = os.environ.get("MARKET_REPLAY_DIR")
+    if not directory:
+        return None
+    try:
+        return MarketReplayer(directory, float(os.environ.get("MARKET_REPLAY_SPEED", "1.0")))
+    except Exception as e:
+        logger.warning(f"Market replay disabled: {str(e)}")
+        return None
@@ -0,0 +1,213 @@
+"""
+Struct-of-arrays market snapshot for the dashboard.
+
+Instead of one validated Pydantic StockData object per symbol, a snapshot
+keeps one NumPy column per field and serializes the DashboardResponse JSON
+straight from those columns. Missing floats are NaN, missing volumes -1 and
+signals are small integer codes; all of them serialize as null, so the JSON
+is the same shape the StockData/DashboardResponse models produce.
+
+Run ``python market_snapshot.py [symbols]`` for a memory / serialization
+benchmark against the Pydantic models.
+"""
+import json
+import math
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+SIGNALS = (None, "Bullish", "Bearish", "Neutral", "High Volatility")
+_SIGNAL_CODES = {name: code for code, name in enumerate(SIGNALS)}
+_SIGNAL_JSON = [json.dumps(name) for name in SIGNALS]
+
+
+def timestamp_json(timestamp: datetime) -> str:
+    """ISO timestamp in the form Pydantic emits (UTC as Z)"""
+    text = timestamp.isoformat()
+    if text.endswith("+00:00"):
+        text = text[:-6] + "Z"
+    return json.dumps(text)
+
+
+class MarketSnapshot:
+    """Dashboard rows stored column-wise"""
+
+    __slots__ = (
+        "symbols", "spot", "change_percent", "volume", "iv", "iv_percentile",
+        "rv", "iv_rv_ratio", "signal", "errors", "_symbols_json"
+    )
+
+    def __init__(self, symbols: Sequence[str]):
+        n = len(symbols)
+        self.symbols: List[str] = list(symbols)
+        self.spot = np.full(n, np.nan)
+        self.change_percent = np.full(n, np.nan)
+        self.volume = np.full(n, -1, dtype=np.int64)
+        self.iv = np.full(n, np.nan)
+        self.iv_percentile = np.full(n, np.nan)
+        self.rv = np.full(n, np.nan)
+        self.iv_rv_ratio = np.full(n, np.nan)
+        self.signal = np.zeros(n, dtype=np.int8)
+        # Only failed rows carry a message
+        self.errors: Dict[int, str] = {}
+        self._symbols_json = [json.dumps(s, ensure_ascii=False) for s in self.symbols]
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def set_row(
+        self,
+        index: int,
+        spot: float,
+        change_percent: float,
+        volume: int,
+        iv: float,
+        iv_percentile: float,
+        signal: Optional[str],
+        rv: Optional[float] = None,
+        iv_rv_ratio: Optional[float] = None
+    ):
+        self.spot[index] = spot
+        self.change_percent[index] = change_percent
+        self.volume[index] = volume
+        self.iv[index] = iv
+        self.iv_percentile[index] = iv_percentile
+        self.rv[index] = np.nan if rv is None else rv
+        self.iv_rv_ratio[index] = np.nan if iv_rv_ratio is None else iv_rv_ratio
+        self.signal[index] = _SIGNAL_CODES.get(signal, 0)
+
+    def set_error(self, index: int, error: str):
+        self.errors[index] = error
+
+    def all_failed(self) -> bool:
+        return len(self.errors) == len(self.symbols)
+
+    def symbols_with_signal(self, signal: str) -> List[str]:
+        code = _SIGNAL_CODES[signal]
+        return [self.symbols[i] for i in np.flatnonzero(self.signal == code)]
+
+    def row(self, index: int) -> Dict[str, Any]:
+        """One row as a StockData-shaped dict"""
+        def num(column):
+            value = float(column[index])
+            return None if math.isnan(value) else value
+
+        volume = int(self.volume[index])
+        return {
+            "symbol": self.symbols[index],
+            "spot": num(self.spot),
+            "change_percent": num(self.change_percent),
+            "volume": volume if volume >= 0 else None,
+            "iv": num(self.iv),
+            "iv_percentile": num(self.iv_percentile),
+            "rv": num(self.rv),
+            "iv_rv_ratio": num(self.iv_rv_ratio),
+            "signal": SIGNALS[self.signal[index]],
+            "error": self.errors.get(index),
+        }
+
+    def to_json(self, timestamp: datetime, success: bool = True) -> bytes:
+        """DashboardResponse JSON built directly from the columns"""
+        # Each column is converted to JSON text in one pass (NaN != NaN -> null)
+        def floats(column: np.ndarray) -> List[str]:
+            return ["null" if v != v else repr(v) for v in column.tolist()]
+
+        volume = ["null" if v < 0 else str(v) for v in self.volume.tolist()]
+        signal = [_SIGNAL_JSON[code] for code in self.signal.tolist()]
+        error = ["null"] * len(self.symbols)
+        for i, message in self.errors.items():
+            error[i] = json.dumps(message, ensure_ascii=False)
+
+        rows = ",".join([
+            f'{{"symbol":{sym},"spot":{sp},"change_percent":{ch},"volume":{vol},'
+            f'"iv":{v},"iv_percentile":{vp},"rv":{r},"iv_rv_ratio":{ratio},"signal":{sig},"error":{err}}}'
+            for sym, sp, ch, vol, v, vp, r, ratio, sig, err in zip(
+                self._symbols_json, floats(self.spot), floats(self.change_percent), volume,
+                floats(self.iv), floats(self.iv_percentile), floats(self.rv), floats(self.iv_rv_ratio),
+                signal, error
+            )
+        ])
+        return (
+            f'{{"success":{"true" if success else "false"},'
+            f'"data":[{rows}],'
+            f'"timestamp":{timestamp_json(timestamp)}}}'
+        ).encode()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the snapshot"""
+        columns = (self.spot, self.change_percent, self.volume, self.iv, self.iv_percentile,
+                   self.rv, self.iv_rv_ratio, self.signal)
+        return (
+            sum(c.nbytes for c in columns)
+            + sum(sys.getsizeof(s) for s in self.symbols)
+            + sum(sys.getsizeof(s) for s in self._symbols_json)
+            + sum(sys.getsizeof(e) for e in self.errors.values())
+        )
+
+
+def _benchmark(count: int, repeat: int = 20):
+    """Compare the snapshot against StockData/DashboardResponse models"""
+    import random
+    import time
+    import tracemalloc
+
+    from server import DashboardResponse, StockData
+
+    rng = random.Random(42)
+    symbols = [f"SYM{i:04d}" for i in range(count)]
+    rows = []
+    for symbol in symbols:
+        change = round(rng.uniform(-3.0, 3.0), 2)
+        rows.append({
+            "spot": round(rng.uniform(100, 25000), 2),
+            "change_percent": change,
+            "volume": rng.randint(1000000, 50000000),
+            "iv": float(rng.randint(20, 50)),
+            "iv_percentile": float(rng.randint(30, 90)),
+            "signal": "High Volatility" if abs(change) > 2 else "Neutral",
+        })
+    now = datetime.now(timezone.utc)
+
+    def build_models():
+        return DashboardResponse(
+            success=True,
+            data=[StockData(symbol=s, **r) for s, r in zip(symbols, rows)],
+            timestamp=now
+        )
+
+    def build_snapshot():
+        snapshot = MarketSnapshot(symbols)
+        for i, r in enumerate(rows):
+            snapshot.set_row(i, **r)
+        return snapshot
+
+    def measure(build, serialize):
+        tracemalloc.start()
+        built = build()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            build()
+        build_ms = (time.perf_counter() - start) / repeat * 1000
+        start = time.perf_counter()
+        for _ in range(repeat):
+            payload = serialize(built)
+        serialize_ms = (time.perf_counter() - start) / repeat * 1000
+        return memory, build_ms, serialize_ms, payload
+
+    model = measure(build_models, lambda m: m.model_dump_json().encode())
+    snap = measure(build_snapshot, lambda s: s.to_json(now))
+    assert json.loads(model[3]) == json.loads(snap[3]), "snapshot JSON differs from models"
+
+    print(f"{count} symbols, {repeat} repeats")
+    print(f"{'':>10} {'memory KB':>10} {'build ms':>10} {'serialize ms':>13}")
+    for name, (memory, build_ms, serialize_ms, _) in (("pydantic", model), ("snapshot", snap)):
+        print(f"{name:>10} {memory / 1024:>10.1f} {build_ms:>10.3f} {serialize_ms:>13.3f}")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,199 @@
+"""
+Helpers for TrueData option-chain payloads.
+
+A getoptionchain response is a dict whose "Records" list holds one row per
+contract line: [symbol, expiry, ..., call OI, call LTP, ..., strike, ...]
+with the strike at index 11 (see normalize_record for the other columns).
+Rows are not guaranteed to be sorted and a strike can appear more than once.
+Every per-strike view (columnar chains, chain history, smile quotes, max
+pain OI) resolves duplicates the same way, through unique_rows.
+"""
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+STRIKE_INDEX = 11
+
+
+class SortedChain:
+    """Chain rows sorted by strike, with the strike column kept alongside"""
+
+    __slots__ = ("strikes", "records", "distinct_strikes", "extra", "_columns")
+
+    def __init__(self, data: Dict[str, Any]):
+        rows = [
+            r for r in data.get("Records") or []
+            if isinstance(r, list) and len(r) > STRIKE_INDEX
+            and isinstance(r[STRIKE_INDEX], (int, float)) and r[STRIKE_INDEX]
+        ]
+        rows.sort(key=lambda r: r[STRIKE_INDEX])
+        self.records: List[list] = rows
+        self.strikes: List[float] = [r[STRIKE_INDEX] for r in rows]
+        self.distinct_strikes: List[float] = sorted(set(self.strikes))
+        # Everything in the payload besides the rows, returned unchanged
+        self.extra = {k: v for k, v in data.items() if k != "Records"}
+        self._columns: Optional[Dict[str, list]] = None
+
+    def between(self, min_strike: Optional[float], max_strike: Optional[float]) -> List[list]:
+        """Rows with min_strike <= strike <= max_strike (either bound optional)"""
+        lo = 0 if min_strike is None else bisect_left(self.strikes, min_strike)
+        hi = len(self.strikes) if max_strike is None else bisect_right(self.strikes, max_strike)
+        return self.records[lo:hi]
+
+    def around(self, spot: Optional[float], strikes_each_side: int) -> Tuple[List[list], Optional[float]]:
+        """Rows for the ATM strike plus N distinct strikes on each side of it
+
+        Falls back to the middle of the chain when spot is unknown. Returns
+        the rows and the ATM strike the window is centred on.
+        """
+        lo, hi, atm = self.window(spot, strikes_each_side)
+        return (self.between(lo, hi) if atm is not None else []), atm
+
+    def window(self, spot: Optional[float], strikes_each_side: int) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        """(lowest, highest, ATM) strike of the window around() returns"""
+        if not self.distinct_strikes:
+            return None, None, None
+        distinct = self.distinct_strikes
+        if spot is None:
+            atm_index = len(distinct) // 2
+        else:
+            atm_index = min(bisect_left(distinct, spot), len(distinct) - 1)
+            # Snap to whichever neighbour is nearer to spot
+            if atm_index > 0 and spot - distinct[atm_index - 1] < distinct[atm_index] - spot:
+                atm_index -= 1
+        lo = distinct[max(atm_index - strikes_each_side, 0)]
+        hi = distinct[min(atm_index + strikes_each_side, len(distinct) - 1)]
+        return lo, hi, distinct[atm_index]
+
+    def columns(self, min_strike: Optional[float] = None, max_strike: Optional[float] = None) -> Dict[str, list]:
+        """Parallel NORMALIZED_FIELDS arrays, one entry per distinct strike in range
+
+        Built once per chain from unique_rows (the first row for a duplicated
+        strike), and every missing value is None.
+        """
+        if self._columns is None:
+            self._columns = merged_columns(self.records)
+        columns = self._columns
+        lo = 0 if min_strike is None else bisect_left(columns["strike"], min_strike)
+        hi = len(columns["strike"]) if max_strike is None else bisect_right(columns["strike"], max_strike)
+        if lo == 0 and hi == len(columns["strike"]):
+            return columns
+        return {field: values[lo:hi] for field, values in columns.items()}
+
+
+class SortedChainCache:
+    """Small LRU of parsed, strike-sorted chains keyed by payload digest"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, SortedChain]]" = OrderedDict()
+
+    def get(self, symbol: str, expiry: str, digest: str, data_loader) -> SortedChain:
+        """Sorted chain for this payload, parsing only when the payload changed"""
+        key = (symbol, expiry)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == digest:
+            self._entries.move_to_end(key)
+            return entry[1]
+        chain = SortedChain(data_loader())
+        self._entries[key] = (digest, chain)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return chain
+
+
+# Flat per-strike view of a chain, as rendered by OptionChainModal
+NORMALIZED_FIELDS = (
+    "strike",
+    "call_oi", "call_ltp", "call_bid", "call_ask", "call_volume",
+    "put_oi", "put_ltp", "put_bid", "put_ask", "put_volume",
+)
+
+
+def _number(value) -> Optional[float]:
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _positive(value) -> Optional[float]:
+    value = _number(value)
+    return value if value is not None and value > 0 else None
+
+
+def normalize_record(record: list) -> Optional[Dict[str, Any]]:
+    """Map one raw chain row to NORMALIZED_FIELDS (None if it has no strike)
+
+    Uses the index heuristics OptionChainModal.jsx used to apply in the
+    browser: call OI/LTP at 3/4, call bid/ask/volume among 5-10, put OI
+    among 12-15 and put bid/ask/LTP/volume at 16-19.
+    """
+    if not isinstance(record, list) or len(record) <= STRIKE_INDEX:
+        return None
+    strike = _positive(record[STRIKE_INDEX])
+    if strike is None:
+        return None
+
+    call_bid = call_ask = call_volume = None
+    for value in record[5:11]:
+        value = _positive(value)
+        if value is None:
+            continue
+        if call_bid is None:
+            call_bid = value
+        elif call_ask is None:
+            call_ask = value
+        elif call_volume is None and value > 1000:
+            call_volume = value
+
+    put_oi = None
+    for value in record[12:16]:
+        value = _positive(value)
+        if value is not None and value < 1000000:
+            put_oi = value
+            break
+
+    def at(index: int, positive: bool = True):
+        if index >= len(record):
+            return None
+        return _positive(record[index]) if positive else _number(record[index])
+
+    return {
+        "strike": strike,
+        "call_oi": at(3, positive=False),
+        "call_ltp": at(4, positive=False),
+        "call_bid": call_bid,
+        "call_ask": call_ask,
+        "call_volume": call_volume,
+        "put_oi": put_oi,
+        "put_ltp": at(18),
+        "put_bid": at(16),
+        "put_ask": at(17),
+        "put_volume": at(19),
+    }
+
+
+def normalized_rows(data: Dict[str, Any]):
+    """Yield normalized rows for every usable record, in payload order"""
+    for record in data.get("Records") or []:
+        row = normalize_record(record)
+        if row is not None:
+            yield row
+
+
+def unique_rows(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Normalized rows sorted by strike, one per strike
+
+    A strike that appears more than once keeps its first usable row in
+    payload order, whole: fields are never mixed across rows, so a bid and
+    an ask always come from the same quote.
+    """
+    rows: Dict[float, Dict[str, Any]] = {}
+    for row in normalized_rows(data):
+        rows.setdefault(row["strike"], row)
+    return [rows[strike] for strike in sorted(rows)]
+
+
+def merged_columns(records: List[list]) -> Dict[str, list]:
+    """Strike-sorted parallel arrays of NORMALIZED_FIELDS, one entry per strike (see unique_rows)"""
+    rows = unique_rows({"Records": records})
+    return {field: [row[field] for row in rows] for field in NORMALIZED_FIELDS}
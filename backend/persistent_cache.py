@@ -0,0 +1,122 @@
+"""
+Persistent tier behind the shared snapshot cache.
+
+Serverless instances (Mangum handlers on Vercel/Netlify) start with an empty
+process and an empty /tmp. With a persistent tier the latest dashboard and
+recent option chains survive cold starts: a fresh instance restores them on
+first use, serves them immediately (stale-while-revalidate) and refreshes
+from TrueData in the background.
+
+Environment variables:
+    PERSIST_CACHE        "disk" or "mongo"; unset disables the tier
+    PERSIST_CACHE_DIR    directory for the disk tier (default <tmp>/truedata-persist)
+    PERSIST_MAX_STALE    oldest snapshot (seconds) worth serving on restore (default 900)
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# written_at (epoch seconds)
+HEADER = struct.Struct("<d")
+
+
+class DiskTier:
+    """One file per key on local disk"""
+
+    def __init__(self, directory: str, max_stale: float):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_stale = max_stale
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.bin"
+
+    def _load(self, key: str) -> Optional[Tuple[float, bytes]]:
+        try:
+            raw = self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+        if len(raw) < HEADER.size:
+            return None
+        return HEADER.unpack_from(raw)[0], raw[HEADER.size:]
+
+    def _save(self, key: str, written_at: float, payload: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(written_at))
+            f.write(payload)
+        os.replace(tmp_path, self._path(key))
+
+    async def load(self, key: str) -> Optional[Tuple[float, bytes]]:
+        return await asyncio.to_thread(self._load, key)
+
+    async def save(self, key: str, written_at: float, payload: bytes):
+        await asyncio.to_thread(self._save, key, written_at, payload)
+
+
+class MongoTier:
+    """Snapshots in the optional MongoDB, next to the tokens collection"""
+
+    def __init__(self, get_db: Callable, max_stale: float):
+        self.get_db = get_db
+        self.max_stale = max_stale
+        self._indexed = False
+
+    async def load(self, key: str) -> Optional[Tuple[float, bytes]]:
+        db = self.get_db()
+        if db is None:
+            return None
+        doc = await db.snapshot_cache.find_one({"_id": key})
+        if doc is None:
+            return None
+        written_at = doc["written_at"]
+        if written_at.tzinfo is None:
+            written_at = written_at.replace(tzinfo=timezone.utc)
+        return written_at.timestamp(), bytes(doc["payload"])
+
+    async def save(self, key: str, written_at: float, payload: bytes):
+        db = self.get_db()
+        if db is None:
+            return
+        if not self._indexed:
+            # Let MongoDB drop snapshots too old to be served on restore
+            await db.snapshot_cache.create_index(
+                "written_at", expireAfterSeconds=int(self.max_stale), name="written_at_ttl"
+            )
+            self._indexed = True
+        await db.snapshot_cache.replace_one(
+            {"_id": key},
+            {
+                "_id": key,
+                "written_at": datetime.fromtimestamp(written_at, timezone.utc),
+                "payload": payload
+            },
+            upsert=True
+        )
+
+
+def tier_from_env(get_db: Callable):
+    kind = os.environ.get("PERSIST_CACHE", "").lower()
+    if not kind:
+        return None
+    max_stale = float(os.environ.get("PERSIST_MAX_STALE", "900"))
+    try:
+        if kind == "disk":
+            return DiskTier(
+                os.environ.get("PERSIST_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "truedata-persist"),
+                max_stale
+            )
+        if kind == "mongo":
+            return MongoTier(get_db, max_stale)
+        logger.warning(f"Unknown PERSIST_CACHE value: {kind}")
+    except Exception as e:
+        logger.warning(f"Persistent cache tier disabled: {str(e)}")
+    return None
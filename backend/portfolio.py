@@ -0,0 +1,286 @@
+"""
+Portfolio Greeks and scenario P&L for option positions.
+
+Legs are held column-wise: spot, strike, years to expiry, IV, call/put and
+signed quantity, one NumPy array each. Each leg is marked at the mid of
+its strike in the cached option chain. IV is backed out of that mark with
+the vectorized solver; a strike with no usable quote takes the fitted smile
+(see vol_surface.py) instead.
+
+Greeks come from one Black-Scholes pass over all legs. The scenario grid
+revalues every leg under every (spot shock, vol shock) pair in a single
+broadcast: spot shocks are percent moves applied to every underlying, vol
+shocks are IV points. P&L is measured against the current marks, and
+quantities are in units of the underlying (lots x lot size), negative for
+short legs.
+
+In the server, chain parsing, smile fits and portfolio_report (pricing,
+Greeks and the grid) run in the analytics pool; only the cache lookups and
+chains_needing_fits stay on the event loop.
+
+Run ``python portfolio.py [legs] [grid steps]`` for a timing benchmark.
+"""
+import math
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from iv_history import bs_price, implied_volatility, norm_cdf
+from vol_surface import greeks, years_to_expiry
+
+DEFAULT_SHOCKS = tuple(float(v) for v in np.linspace(-10.0, 10.0, 21))
+MIN_IV = 1e-4
+
+
+class ChainMarks:
+    """Strike-sorted call / put mids per chain, parsed once per payload digest"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]]" = OrderedDict()
+
+    def lookup(self, symbol: str, expiry: str, digest: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Quotes parsed from this payload, or None if they need (re)parsing"""
+        key = (symbol, expiry)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != digest:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def store(self, symbol: str, expiry: str, digest: str, quotes: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        key = (symbol, expiry)
+        self._entries[key] = (digest, quotes)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def lookup_marks(quotes: Tuple[np.ndarray, np.ndarray, np.ndarray], strikes: np.ndarray, is_call: np.ndarray) -> np.ndarray:
+    """Chain mid for each (strike, side); NaN where the strike isn't quoted"""
+    chain_strikes, call, put = quotes
+    if not len(chain_strikes):
+        return np.full(len(strikes), np.nan)
+    position = np.minimum(np.searchsorted(chain_strikes, strikes), len(chain_strikes) - 1)
+    found = chain_strikes[position] == strikes
+    marks = np.where(is_call, call[position], put[position])
+    return np.where(found, marks, np.nan)
+
+
+class Book:
+    """Priced legs of a portfolio, column-wise"""
+
+    def __init__(
+        self,
+        symbol: Sequence[str],
+        spot: np.ndarray,
+        strike: np.ndarray,
+        years: np.ndarray,
+        iv: np.ndarray,
+        is_call: np.ndarray,
+        qty: np.ndarray,
+        mark: np.ndarray,
+        rate: float
+    ):
+        self.symbol = np.asarray(symbol)
+        self.spot = spot
+        self.strike = strike
+        self.years = years
+        self.iv = iv
+        self.is_call = is_call
+        self.qty = qty
+        self.mark = mark
+        self.rate = rate
+
+    def __len__(self) -> int:
+        return len(self.qty)
+
+    def greeks(self) -> Dict[str, np.ndarray]:
+        """Per-leg position Greeks (already multiplied by quantity)"""
+        g = greeks(self.spot, self.strike, self.years, self.rate, self.iv)
+        delta = np.where(self.is_call, g["call_delta"], g["put_delta"])
+        return {
+            "value": self.qty * self.mark,
+            "delta": self.qty * delta,
+            "delta_value": self.qty * delta * self.spot,
+            "gamma": self.qty * g["gamma"],
+            "vega": self.qty * g["vega"],
+            "theta": self.qty * np.where(self.is_call, g["call_theta"], g["put_theta"]),
+        }
+
+    def aggregate(self) -> Dict[str, Any]:
+        legs = self.greeks()
+        totals = {name: round(float(values.sum()), 4) for name, values in legs.items()}
+        by_symbol = {}
+        symbols, inverse = np.unique(self.symbol, return_inverse=True)
+        for name, values in legs.items():
+            sums = np.bincount(inverse, weights=values, minlength=len(symbols))
+            for symbol, total in zip(symbols.tolist(), sums.tolist()):
+                by_symbol.setdefault(symbol, {})[name] = round(total, 4)
+        return {"totals": totals, "by_symbol": by_symbol}
+
+    def scenario_pnl(self, spot_shocks: Sequence[float], vol_shocks: Sequence[float]) -> np.ndarray:
+        """P&L grid, rows = spot shocks (%), columns = vol shocks (IV points)"""
+        growth = 1.0 + np.asarray(spot_shocks, dtype=np.float64) / 100.0
+        vol = np.maximum(self.iv[None, :] + np.asarray(vol_shocks, dtype=np.float64)[:, None] / 100.0, MIN_IV)
+        # The vol terms don't depend on spot and a spot shock only shifts
+        # log-moneyness, so each spot row is one add and divide on a (vol, leg)
+        # block; row-by-row keeps the temporaries cache-sized
+        vol_sqrt_t = vol * np.sqrt(self.years)
+        drift = (self.rate + 0.5 * vol * vol) * self.years
+        discount = self.strike * np.exp(-self.rate * self.years)
+        log_moneyness = np.log(self.spot / self.strike)
+        # Put-call parity: put = call - spot + discount; P&L = sum of qty * (price - mark)
+        put_qty = np.where(self.is_call, 0.0, self.qty)
+        constant = (np.where(self.is_call, 0.0, discount) - self.mark) @ self.qty
+        put_spot = self.spot @ put_qty
+        grid = np.empty((len(growth), vol.shape[0]))
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            for row, g in enumerate(growth):
+                d1 = (log_moneyness + math.log(g) + drift) / vol_sqrt_t
+                call = (self.spot * g) * norm_cdf(d1) - discount * norm_cdf(d1 - vol_sqrt_t)
+                grid[row] = call @ self.qty - g * put_spot + constant
+        return grid
+
+
+def build_book(
+    positions: Sequence[Dict[str, Any]],
+    spots: Dict[str, float],
+    marks_for,
+    fitted_iv_for,
+    rate: float
+) -> Tuple[Book, List[Dict[str, Any]]]:
+    """Price positions into a Book; returns it and the legs that couldn't be priced
+
+    marks_for(symbol, expiry) returns chain quotes (or None); fitted_iv_for(symbol,
+    expiry, strikes) returns fitted IVs as fractions (or None).
+    """
+    n = len(positions)
+    symbol = [p["symbol"] for p in positions]
+    strike = np.array([p["strike"] for p in positions], dtype=np.float64)
+    is_call = np.array([p["type"] == "CE" for p in positions])
+    qty = np.array([p["qty"] for p in positions], dtype=np.float64)
+    spot = np.array([spots.get(s) or np.nan for s in symbol], dtype=np.float64)
+    years = np.empty(n)
+    mark = np.full(n, np.nan)
+    fitted = np.full(n, np.nan)
+
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for i, p in enumerate(positions):
+        groups.setdefault((p["symbol"], p["expiry"]), []).append(i)
+    for (sym, expiry), indices in groups.items():
+        index = np.array(indices)
+        years[index] = years_to_expiry(expiry)
+        quotes = marks_for(sym, expiry)
+        if quotes is not None:
+            mark[index] = lookup_marks(quotes, strike[index], is_call[index])
+        missing = index[np.isnan(mark[index])]
+        if len(missing):
+            iv = fitted_iv_for(sym, expiry, strike[missing])
+            if iv is not None:
+                fitted[missing] = iv
+
+    with np.errstate(invalid="ignore"):
+        iv = implied_volatility(mark, spot, strike, years, rate, is_call)
+    # Unquoted strikes, or quotes outside no-arbitrage bounds: use the fitted smile
+    iv = np.where(np.isnan(iv), fitted, iv)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        model = bs_price(spot, strike, np.where(years > 0, years, 1.0), rate, np.where(np.isnan(iv), 1.0, iv), is_call)
+    mark = np.where(np.isnan(mark), model, mark)
+
+    errors = []
+    for i in range(n):
+        if math.isnan(spot[i]):
+            errors.append({"index": i, "error": f"No spot price for {symbol[i]}"})
+        elif years[i] <= 0:
+            errors.append({"index": i, "error": "Expiry has passed"})
+        elif math.isnan(iv[i]):
+            errors.append({"index": i, "error": "No usable quote or fitted smile for this strike"})
+    ok = np.ones(n, dtype=bool)
+    ok[[e["index"] for e in errors]] = False
+    book = Book(
+        [s for s, keep in zip(symbol, ok) if keep], spot[ok], strike[ok], years[ok], iv[ok],
+        is_call[ok], qty[ok], mark[ok], rate
+    )
+    return book, errors
+
+
+def chains_needing_fits(
+    positions: Sequence[Dict[str, Any]],
+    quotes: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray, np.ndarray]]
+) -> List[Tuple[str, str]]:
+    """Chains with a leg whose strike has no quoted mid, so build_book will ask for the fitted smile"""
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for p in positions:
+        groups.setdefault((p["symbol"], p["expiry"]), []).append(p)
+    needed = []
+    for key, legs in groups.items():
+        chain = quotes.get(key)
+        if chain is None:
+            continue
+        strikes = np.array([p["strike"] for p in legs], dtype=np.float64)
+        is_call = np.array([p["type"] == "CE" for p in legs])
+        if np.isnan(lookup_marks(chain, strikes, is_call)).any():
+            needed.append(key)
+    return needed
+
+
+def portfolio_report(
+    positions: Sequence[Dict[str, Any]],
+    spots: Dict[str, Optional[float]],
+    quotes: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    fits: Dict[Tuple[str, str], Any],
+    rate: float,
+    spot_shocks: Sequence[float],
+    vol_shocks: Sequence[float]
+) -> Dict[str, Any]:
+    """Book totals, per-symbol Greeks and the scenario grid, for the analytics pool
+
+    quotes holds each chain's parsed quotes and fits its SmileFit (or None).
+    """
+    def fitted_iv_for(symbol, expiry, strikes):
+        fit = fits.get((symbol, expiry))
+        return fit.iv(strikes) if fit is not None else None
+
+    book, errors = build_book(positions, spots, lambda symbol, expiry: quotes.get((symbol, expiry)), fitted_iv_for, rate)
+    result = {"success": len(book) > 0, "legs": len(book), "errors": errors}
+    if len(book):
+        result.update(book.aggregate())
+        grid = book.scenario_pnl(spot_shocks, vol_shocks).tolist()
+        result["pnl"] = [[round(v, 2) for v in row] for row in grid]
+    return result
+
+
+def _benchmark(legs: int, steps: int, repeat: int = 20):
+    rng = np.random.default_rng(3)
+    spot = rng.uniform(200, 25000, legs)
+    book = Book(
+        [f"SYM{i % 20}" for i in range(legs)],
+        spot,
+        np.round(spot * rng.uniform(0.9, 1.1, legs)),
+        rng.uniform(5, 60, legs) / 365.0,
+        rng.uniform(0.12, 0.45, legs),
+        rng.random(legs) < 0.5,
+        rng.choice([-1, 1], legs) * rng.integers(1, 10, legs) * 50.0,
+        np.zeros(legs),
+        0.065,
+    )
+    book.mark = bs_price(book.spot, book.strike, book.years, book.rate, book.iv, book.is_call)
+    shocks = np.linspace(-10, 10, steps)
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat * 1000
+
+    print(f"{legs} legs, {steps}x{steps} grid")
+    print(f"greeks     {timed(book.aggregate):8.2f} ms")
+    print(f"scenarios  {timed(lambda: book.scenario_pnl(shocks, shocks)):8.2f} ms")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 21)
@@ -0,0 +1,231 @@
+"""
+Opt-in statistical profiling of individual requests.
+
+A request is profiled only when it carries the admin token, either in the
+``X-Profile`` header or the ``__profile`` query parameter. While it runs, a
+sampler thread snapshots the event loop thread's stack every few
+milliseconds and counts collapsed stacks ("frame;frame;frame count"), the
+format flamegraph.pl and speedscope read directly.
+
+The result is written to PROFILE_DIR and, with ``X-Profile-Inline: 1`` (or
+``__profile_inline=1``), returned in place of the normal response body. The
+N slowest profiles are kept in memory for the admin routes.
+
+Because the loop is shared, samples include any other request that was
+running concurrently; profile on a quiet worker for clean stacks.
+
+Environment variables:
+    PROFILE_ADMIN_TOKEN      enables profiling; the value clients must send
+    PROFILE_DIR              output directory (default <tmp>/truedata-profiles)
+    PROFILE_INTERVAL_MS      sampling interval (default 2)
+    PROFILE_KEEP_SLOWEST     profiles kept in memory (default 20)
+    PROFILE_MAX_FILES        profile files kept in PROFILE_DIR, oldest deleted first (default 200)
+"""
+import heapq
+import hmac
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+INLINE_HEADER = b"x-profile-inline"
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval"""
+
+    def __init__(self, target_thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    """Runs at most one sampler at a time and keeps the slowest results"""
+
+    def __init__(self, admin_token: str, directory: str, interval_ms: float, keep: int, max_files: int = 200):
+        self.admin_token = admin_token.encode("utf-8")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.interval = interval_ms / 1000.0
+        self.keep = keep
+        self.max_files = max(1, max_files)
+        self._busy = threading.Lock()
+        # Min-heap of (duration, id) so the fastest kept profile is evicted first
+        self._slowest: List[tuple] = []
+        self._profiles: Dict[str, dict] = {}
+
+    def authorized(self, value: Optional[bytes]) -> bool:
+        # Raw header bytes: compare_digest raises on str with non-ASCII characters
+        return bool(value) and hmac.compare_digest(value, self.admin_token)
+
+    def start(self) -> Optional[StackSampler]:
+        if not self._busy.acquire(blocking=False):
+            return None
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        return sampler
+
+    def finish(self, sampler: StackSampler, profile_id: str, method: str, path: str, duration: float) -> dict:
+        try:
+            stacks = sampler.stop()
+        finally:
+            self._busy.release()
+
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        profile = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "duration_ms": round(duration * 1000, 2),
+            "samples": sum(stacks.values()),
+            "created_at": time.time(),
+            "collapsed": collapsed,
+        }
+
+        try:
+            (self.directory / f"{profile_id}.collapsed").write_text(collapsed)
+            self._prune_files()
+        except OSError as e:
+            logger.warning(f"Could not save profile {profile_id}: {str(e)}")
+
+        heapq.heappush(self._slowest, (duration, profile_id))
+        self._profiles[profile_id] = profile
+        if len(self._slowest) > self.keep:
+            _, evicted = heapq.heappop(self._slowest)
+            self._profiles.pop(evicted, None)
+
+        logger.info(f"Profiled {method} {path} in {profile['duration_ms']} ms ({profile['samples']} samples)")
+        return profile
+
+    def _prune_files(self):
+        """Delete the oldest saved profiles beyond max_files"""
+        files = []
+        for path in self.directory.glob("*.collapsed"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_files)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def slowest(self) -> List[dict]:
+        """Kept profiles, slowest first, without the stack payload"""
+        return [
+            {k: v for k, v in self._profiles[pid].items() if k != "collapsed"}
+            for _, pid in sorted(self._slowest, reverse=True)
+        ]
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        return self._profiles.get(profile_id)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware; requests without the profile flag pass straight through"""
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        # Admin routes reuse the X-Profile header for auth; don't profile them
+        if scope["type"] != "http" or scope["path"].startswith("/api/admin/"):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        token = headers.get(PROFILE_HEADER)
+        inline = headers.get(INLINE_HEADER) == b"1"
+        if token is None and b"__profile" in scope.get("query_string", b""):
+            query = parse_qs(scope["query_string"].decode("latin-1"))
+            token = query.get("__profile", [""])[0].encode("latin-1")
+            inline = inline or query.get("__profile_inline", [""])[0] == "1"
+
+        if token is None or not self.profiler.authorized(token):
+            return await self.app(scope, receive, send)
+
+        sampler = self.profiler.start()
+        if sampler is None:
+            # Another request is being profiled on this worker
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex[:12]
+        started = time.perf_counter()
+
+        async def capture(message):
+            # With inline output the original response is swallowed
+            if inline:
+                return
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            profile = self.profiler.finish(
+                sampler, profile_id, scope["method"], scope["path"], time.perf_counter() - started
+            )
+
+        if inline:
+            body = profile["collapsed"].encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-profile-id", profile_id.encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+
+def profiler_from_env() -> Optional[RequestProfiler]:
+    admin_token = os.environ.get("PROFILE_ADMIN_TOKEN")
+    if not admin_token:
+        return None
+    try:
+        return RequestProfiler(
+            admin_token,
+            os.environ.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "truedata-profiles"),
+            float(os.environ.get("PROFILE_INTERVAL_MS", "2")),
+            int(os.environ.get("PROFILE_KEEP_SLOWEST", "20")),
+            int(os.environ.get("PROFILE_MAX_FILES", "200"))
+        )
+    except Exception as e:
+        logger.warning(f"Request profiling disabled: {str(e)}")
+        return None
@@ -0,0 +1,238 @@
+"""
+Sector and index rollups for the dashboard heatmap.
+
+Each symbol belongs to one sector and any number of indices. Every group
+keeps running totals: turnover-weighted change (weight = spot * volume),
+advancers / decliners / unchanged, and the IV sum and count. When a symbol's
+row changes, its old contribution is subtracted and the new one added, so
+an update costs O(groups the symbol is in) and reading the heatmap is a
+walk over the groups with no recomputation.
+
+The membership map below covers TOP_20_STOCKS. SECTOR_MAP_FILE can point to
+a JSON file {"sectors": {symbol: sector}, "indices": {name: [symbols]},
+"benchmarks": {index name: index symbol}} that replaces it.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from market_snapshot import timestamp_json
+
+logger = logging.getLogger(__name__)
+
+SECTORS = {
+    "RELIANCE": "Oil & Gas",
+    "TCS": "IT",
+    "INFY": "IT",
+    "HCLTECH": "IT",
+    "HDFCBANK": "Banks",
+    "ICICIBANK": "Banks",
+    "SBIN": "Banks",
+    "KOTAKBANK": "Banks",
+    "AXISBANK": "Banks",
+    "HINDUNILVR": "FMCG",
+    "ITC": "FMCG",
+    "BHARTIARTL": "Telecom",
+    "LT": "Construction",
+    "ASIANPAINT": "Consumer",
+    "TITAN": "Consumer",
+    "MARUTI": "Auto",
+    "SUNPHARMA": "Pharma",
+    "ULTRACEMCO": "Cement",
+}
+
+INDICES = {
+    "NIFTY 50": list(SECTORS),
+    "NIFTY BANK": ["HDFCBANK", "ICICIBANK", "SBIN", "KOTAKBANK", "AXISBANK"],
+    "NIFTY IT": ["TCS", "INFY", "HCLTECH"],
+}
+
+# Index -> the dashboard symbol quoting the index itself
+BENCHMARKS = {
+    "NIFTY 50": "NIFTY",
+    "NIFTY BANK": "BANKNIFTY",
+}
+
+# Full recompute after this many incremental updates, to shed float drift
+RESYNC_EVERY = 10000
+
+# (weight, weighted change, direction, iv) a symbol adds to its groups
+Contribution = Tuple[float, float, int, Optional[float]]
+
+
+class GroupRollup:
+    """Running totals for one sector or index"""
+
+    __slots__ = ("kind", "name", "members", "weight", "weighted_change", "advancers",
+                 "decliners", "unchanged", "iv_sum", "iv_count")
+
+    def __init__(self, kind: str, name: str, members: List[str]):
+        self.kind = kind
+        self.name = name
+        self.members = members
+        self.reset()
+
+    def reset(self):
+        self.weight = 0.0
+        self.weighted_change = 0.0
+        self.advancers = 0
+        self.decliners = 0
+        self.unchanged = 0
+        self.iv_sum = 0.0
+        self.iv_count = 0
+
+    def apply(self, contribution: Contribution, sign: int):
+        weight, weighted_change, direction, iv = contribution
+        self.weight += sign * weight
+        self.weighted_change += sign * weighted_change
+        if direction > 0:
+            self.advancers += sign
+        elif direction < 0:
+            self.decliners += sign
+        else:
+            self.unchanged += sign
+        if iv is not None:
+            self.iv_sum += sign * iv
+            self.iv_count += sign
+
+    def summary(self) -> Dict[str, Any]:
+        reported = self.advancers + self.decliners + self.unchanged
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "members": len(self.members),
+            "reported": reported,
+            "change_percent": round(self.weighted_change / self.weight, 2) if self.weight > 0 else None,
+            "advancers": self.advancers,
+            "decliners": self.decliners,
+            "unchanged": self.unchanged,
+            "breadth": round((self.advancers - self.decliners) / reported, 2) if reported else None,
+            "avg_iv": round(self.iv_sum / self.iv_count, 2) if self.iv_count else None,
+        }
+
+
+class SectorRollups:
+    """Incrementally maintained sector / index aggregates plus per-symbol tiles"""
+
+    def __init__(
+        self,
+        sectors: Dict[str, str],
+        indices: Dict[str, List[str]],
+        benchmarks: Optional[Dict[str, str]] = None
+    ):
+        self.sectors = dict(sectors)
+        self.benchmarks = dict(benchmarks or {})
+        self.groups: List[GroupRollup] = []
+        self._groups_of: Dict[str, List[GroupRollup]] = {}
+
+        by_sector: Dict[str, List[str]] = {}
+        for symbol, sector in self.sectors.items():
+            by_sector.setdefault(sector, []).append(symbol)
+        for kind, groups in (("sector", by_sector), ("index", indices)):
+            for name, members in groups.items():
+                group = GroupRollup(kind, name, list(members))
+                self.groups.append(group)
+                for symbol in group.members:
+                    self._groups_of.setdefault(symbol, []).append(group)
+
+        self._contributions: Dict[str, Contribution] = {}
+        # symbol -> latest row, for tiles and index benchmarks
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._updates = 0
+        self.version = 0
+        self._cached: Optional[Tuple[int, str, bytes]] = None
+
+    def update(
+        self,
+        symbol: str,
+        spot: Optional[float],
+        change_percent: Optional[float],
+        volume: Optional[int],
+        iv: Optional[float]
+    ) -> bool:
+        """Apply one symbol's latest values; returns False if nothing changed"""
+        row = {"spot": spot, "change_percent": change_percent, "volume": volume, "iv": iv}
+        if self._rows.get(symbol) == row:
+            return False
+        self._rows[symbol] = row
+        self.version += 1
+
+        groups = self._groups_of.get(symbol)
+        if not groups:
+            return True  # e.g. an index quote: tile / benchmark only
+        old = self._contributions.pop(symbol, None)
+        new = None
+        if change_percent is not None:
+            weight = spot * volume if spot and volume and volume > 0 else 0.0
+            direction = (change_percent > 0) - (change_percent < 0)
+            new = (weight, weight * change_percent, direction, iv)
+            self._contributions[symbol] = new
+        for group in groups:
+            if old is not None:
+                group.apply(old, -1)
+            if new is not None:
+                group.apply(new, 1)
+
+        self._updates += 1
+        if self._updates >= RESYNC_EVERY:
+            self.resync()
+        return True
+
+    def update_rows(self, rows: Iterable[Dict[str, Any]]):
+        """Apply StockData-shaped rows; rows with an error keep the last good values"""
+        for row in rows:
+            if row.get("error") or row.get("spot") is None:
+                continue
+            self.update(row["symbol"], row["spot"], row.get("change_percent"), row.get("volume"), row.get("iv"))
+
+    def resync(self):
+        """Recompute every group from the stored contributions"""
+        for group in self.groups:
+            group.reset()
+        for symbol, contribution in self._contributions.items():
+            for group in self._groups_of.get(symbol, ()):
+                group.apply(contribution, 1)
+        self._updates = 0
+
+    def heatmap(self) -> Dict[str, Any]:
+        groups = []
+        for group in self.groups:
+            summary = group.summary()
+            benchmark = self.benchmarks.get(group.name)
+            if benchmark is not None:
+                summary["benchmark"] = benchmark
+                summary["benchmark_change_percent"] = (self._rows.get(benchmark) or {}).get("change_percent")
+            groups.append(summary)
+        tiles = [
+            {"symbol": symbol, "sector": self.sectors.get(symbol), **row}
+            for symbol, row in self._rows.items()
+        ]
+        return {"groups": groups, "tiles": tiles}
+
+    def to_json(self, timestamp: datetime) -> bytes:
+        """Heatmap response body, re-serialized only when something changed"""
+        stamp = timestamp_json(timestamp)
+        if self._cached is not None and self._cached[:2] == (self.version, stamp):
+            return self._cached[2]
+        heatmap = self.heatmap()
+        body = (
+            f'{{"success":true,"groups":{json.dumps(heatmap["groups"], separators=(",", ":"))},'
+            f'"tiles":{json.dumps(heatmap["tiles"], separators=(",", ":"))},'
+            f'"timestamp":{stamp}}}'
+        ).encode()
+        self._cached = (self.version, stamp, body)
+        return body
+
+
+def rollups_from_env() -> SectorRollups:
+    path = os.environ.get("SECTOR_MAP_FILE")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                spec = json.load(f)
+            return SectorRollups(spec["sectors"], spec.get("indices", {}), spec.get("benchmarks", {}))
+        except Exception as e:
+            logger.warning(f"Could not load SECTOR_MAP_FILE {path}, using the built-in map: {str(e)}")
+    return SectorRollups(SECTORS, INDICES, BENCHMARKS)
@@ -1,19 +1,47 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Header, Query, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, confloat, field_validator
+from typing import List, Literal, Optional, Dict, Any, Set
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import httpx
 import asyncio
-import traceback
+import json
+import hashlib
+import re
+import time
+import numpy as np
+
+from market_recorder import recorder_from_env, replayer_from_env
+from shared_snapshot import store_from_env, trusted_tokens_from_env
+from persistent_cache import tier_from_env
+from log_setup import running_serverless, setup_logging
+from tracing import TracingMiddleware, setup_tracing, span
+from request_profiler import ProfilingMiddleware, profiler_from_env
+from admission_control import AdmissionMiddleware, controller_from_env
+from chain_prefetch import nearest_monthly_expiries, prefetcher_from_env
+from market_calendar import IST, OPEN, cadence_from_env
+from option_chain import NORMALIZED_FIELDS, SortedChainCache, normalized_rows
+from export_stream import EXPORT_FORMATS, RowEncoder, bounded_as_completed, parse_list
+from analytics_pool import pool_from_env
+from analytics import chain_oi_arrays, max_pain_from_payload
+from market_snapshot import MarketSnapshot
+from sector_rollups import rollups_from_env
+from volatility import ESTIMATORS, engine_from_env
+from iv_history import percentiles_from_env
+from alerts import DIRECTIONS, FIELDS as ALERT_FIELDS, alerts_from_env
+from vol_surface import fit_payload, quotes_from_payload, surface_from_env
+from portfolio import DEFAULT_SHOCKS, ChainMarks, chains_needing_fits, portfolio_report
+from chain_history import history_from_env
 
 
 ROOT_DIR = Path(__file__).parent
@@ -24,10 +52,9 @@ if env_file.exists():
 # For Vercel, environment variables are already set
 
 # Configure logging first (needed for MongoDB connection logging)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Records go through a queue to a background thread - see log_setup.py
+setup_logging()
+tracer = setup_tracing()
 logger = logging.getLogger(__name__)
 
 # MongoDB connection with better error handling (optional)
@@ -36,6 +63,15 @@ logger = logging.getLogger(__name__)
 client = None
 db = None
 
+# Motor connection pool sizing (tunable per deployment)
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '1'))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '20'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '60000'))
+
+# Set once the token indexes exist and the pool has been warmed
+mongodb_prepared = False
+mongodb_prepare_lock = asyncio.Lock()
+
 def init_mongodb():
     """Initialize MongoDB connection (non-blocking, called lazily)"""
     global client, db
@@ -53,24 +89,78 @@ def init_mongodb():
                 client = AsyncIOMotorClient(
                     mongo_url, 
                     serverSelectionTimeoutMS=2000,
-                    connectTimeoutMS=2000
+                    connectTimeoutMS=2000,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS
                 )
                 db = client[db_name]
                 logger.info("MongoDB initialized successfully")
             except Exception as e:
                 logger.warning(f"MongoDB connection failed (app will work without it): {str(e)}")
-                print(f"MongoDB warning: {str(e)}")  # Also print for Vercel logs
                 client = None
                 db = None
         else:
             logger.info("MongoDB not configured - app will run without database")
-            print("MongoDB not configured")
     except Exception as e:
         logger.error(f"Error initializing MongoDB: {str(e)}")
-        print(f"MongoDB error: {str(e)}")  # Also print for Vercel logs
         client = None
         db = None
 
+
+async def prepare_mongodb():
+    """Create token indexes and warm the connection pool (runs once per process)"""
+    global mongodb_prepared
+    if mongodb_prepared:
+        return
+    
+    async with mongodb_prepare_lock:
+        if mongodb_prepared:
+            return
+        
+        if client is None and db is None:
+            init_mongodb()
+        if db is None:
+            return
+        
+        try:
+            # Pre-warm: open a pooled connection before the first login needs it
+            await client.admin.command('ping')
+            
+            # Migrate tokens written with ISO string expiries to real dates,
+            # otherwise the TTL monitor never removes them
+            with span("mongodb tokens.update_many", kind="client", **{"db.system": "mongodb"}):
+                await db.tokens.update_many(
+                    {"expires_at": {"$type": "string"}},
+                    [{"$set": {
+                        "expires_at": {"$toDate": "$expires_at"},
+                        "created_at": {"$toDate": "$created_at"}
+                    }}]
+                )
+            
+            with span("mongodb tokens.create_index", kind="client", **{"db.system": "mongodb"}):
+                # TTL index lets MongoDB delete tokens once expires_at has passed
+                await db.tokens.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+                # Token checks (cache access, alerts) look tokens up directly
+                await db.tokens.create_index("access_token", name="access_token")
+                try:
+                    # Unique index keeps the login upsert an index lookup
+                    await db.tokens.create_index("username", unique=True, name="username_unique")
+                except OperationFailure as e:
+                    if e.code != 11000:
+                        raise
+                    # Existing duplicate usernames: retrying on every login can't fix
+                    # that, so log it once and carry on without the unique index
+                    logger.error(
+                        "MongoDB tokens has duplicate usernames; username_unique not created "
+                        f"(remove the duplicates and restart): {str(e)}"
+                    )
+            
+            mongodb_prepared = True
+            logger.info("MongoDB token indexes ready")
+        except Exception as e:
+            logger.warning(f"MongoDB preparation failed (will retry on next use): {str(e)}")
+
 # Don't initialize MongoDB during import - do it lazily when needed
 # This prevents blocking during function initialization
 
@@ -84,6 +174,63 @@ api_router = APIRouter(prefix="/api")
 TRUEDATA_AUTH_URL = "https://auth.truedata.in/token"
 TRUEDATA_ANALYTICS_URL = "https://analytics.truedata.in/api"
 
+# Optional market data recording / offline replay (see market_recorder.py)
+market_recorder = recorder_from_env()
+market_replayer = replayer_from_env()
+
+
+def get_mongo_db():
+    """Lazily initialized MongoDB handle (None when not configured)"""
+    if client is None and db is None:
+        init_mongodb()
+    return db
+
+
+# Snapshot cache shared by all uvicorn workers (see shared_snapshot.py),
+# optionally backed by disk or MongoDB so cold starts begin warm
+shared_snapshot = store_from_env(tier_from_env(get_mongo_db))
+# Only tokens that recently worked upstream (or a stored login) read the cache
+trusted_tokens = trusted_tokens_from_env(shared_snapshot)
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', '5'))
+OPTION_CHAIN_CACHE_TTL = float(os.environ.get('OPTION_CHAIN_CACHE_TTL', '15'))
+
+# Stretches the TTLs above for calm symbols, pre-open and closed markets
+# (see market_calendar.py); recordings replay as if the market were open
+market_cadence = cadence_from_env(enabled=market_replayer is None)
+
+# Upstream fetches in flight per export request
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', '4'))
+
+# Chains in flight / chains allowed per batch option-chain request
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_CHAINS = int(os.environ.get('BATCH_MAX_CHAINS', '100'))
+
+# CPU-bound analytics run here instead of on the event loop (see analytics_pool.py)
+analytics_pool = pool_from_env()
+
+# Sector / index aggregates behind /api/market/heatmap (see sector_rollups.py)
+sector_rollups = rollups_from_env()
+
+# Daily bars and realized volatility / correlations (see volatility.py)
+volatility_engine = engine_from_env()
+
+# Backfilled daily ATM IV (see iv_history.py) replaces the mock IV columns
+iv_percentiles = percentiles_from_env(get_mongo_db)
+
+# SVI smile fits per symbol / expiry, warm-started on refresh (see vol_surface.py)
+vol_surface = surface_from_env()
+
+# Chain mids for portfolio marks, parsed once per payload (see portfolio.py)
+chain_marks = ChainMarks()
+PORTFOLIO_MAX_LEGS = int(os.environ.get('PORTFOLIO_MAX_LEGS', '2000'))
+
+# Delta-compressed intraday chain samples for OI change (see chain_history.py)
+chain_history = history_from_env(get_mongo_db)
+
+# Per-user alerts checked on every market update (see alerts.py)
+alert_engine = alerts_from_env(get_mongo_db)
+ALERTS_POLL_INTERVAL = float(os.environ.get('ALERTS_POLL_INTERVAL', '5'))
+
 # Top 20 F&O stocks
 TOP_20_STOCKS = [
     "NIFTY", "BANKNIFTY", "RELIANCE", "TCS", "HDFCBANK", 
@@ -112,6 +259,8 @@ class StockData(BaseModel):
     volume: Optional[int] = None
     iv: Optional[float] = None
     iv_percentile: Optional[float] = None
+    rv: Optional[float] = None
+    iv_rv_ratio: Optional[float] = None
     signal: Optional[str] = None
     error: Optional[str] = None
 
@@ -120,19 +269,202 @@ class DashboardResponse(BaseModel):
     data: List[StockData]
     timestamp: datetime
 
+class MaxPainResponse(BaseModel):
+    success: bool
+    symbol: str
+    expiry: str
+    max_pain: Optional[float] = None
+    total_call_oi: Optional[float] = None
+    total_put_oi: Optional[float] = None
+    pcr: Optional[float] = None
+    error: Optional[str] = None
+
 class OptionChainResponse(BaseModel):
     success: bool
     symbol: str
     expiry: str
     data: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    # Set on strike-window requests
+    spot: Optional[float] = None
+    atm_strike: Optional[float] = None
+    # format=columnar: NORMALIZED_FIELDS as parallel arrays instead of data
+    columns: Optional[Dict[str, List[Optional[float]]]] = None
+
+class ChainRef(BaseModel):
+    symbol: str
+    expiry: str
+
+class BatchOptionChainRequest(BaseModel):
+    token: str
+    chains: List[ChainRef] = Field(..., min_length=1, max_length=BATCH_MAX_CHAINS)
+    strikes_around_atm: Optional[int] = Field(None, ge=1)
+    # NDJSON, one chain per line as soon as it is ready
+    stream: bool = False
+
+class BatchChainResult(BaseModel):
+    success: bool
+    symbol: str
+    expiry: str
+    rows: List[Dict[str, Any]] = []
+    spot: Optional[float] = None
+    atm_strike: Optional[float] = None
+    error: Optional[str] = None
+
+class BatchOptionChainResponse(BaseModel):
+    success: bool
+    results: List[BatchChainResult]
+
+class AlertCreateRequest(BaseModel):
+    token: str
+    symbol: str
+    field: Literal[ALERT_FIELDS]
+    direction: Literal[DIRECTIONS]
+    threshold: float
+    # Re-arm after firing instead of switching off
+    repeat: bool = False
+
+class Alert(BaseModel):
+    id: str = Field(validation_alias="_id")
+    symbol: str
+    field: str
+    direction: str
+    threshold: float
+    repeat: bool
+    active: bool
+    created_at: datetime
+    last_triggered_at: Optional[datetime] = None
+    last_value: Optional[float] = None
+
+class AlertEvent(BaseModel):
+    id: str = Field(validation_alias="_id")
+    alert_id: str
+    symbol: str
+    field: str
+    direction: str
+    threshold: float
+    previous: float
+    value: float
+    triggered_at: datetime
+
+    @field_validator("id", mode="before")
+    @classmethod
+    def object_id_as_str(cls, value):
+        return str(value)
+
+class AlertListResponse(BaseModel):
+    success: bool
+    alerts: List[Alert]
+
+class AlertEventsResponse(BaseModel):
+    success: bool
+    events: List[AlertEvent]
+
+class PortfolioPosition(BaseModel):
+    symbol: str
+    # DD-MM-YYYY, as in the option chain routes
+    expiry: str
+    strike: float = Field(..., gt=0)
+    type: Literal["CE", "PE"]
+    # In units of the underlying (lots x lot size), negative for short legs
+    qty: float
+
+    @field_validator("expiry")
+    @classmethod
+    def expiry_date(cls, value):
+        if not EXPIRY_PATTERN.match(value):
+            raise ValueError("expiry must be DD-MM-YYYY")
+        datetime.strptime(value, "%d-%m-%Y")
+        return value
+
+class PortfolioRequest(BaseModel):
+    token: str
+    positions: List[PortfolioPosition] = Field(..., min_length=1, max_length=PORTFOLIO_MAX_LEGS)
+    # Scenario axes: spot moves in %, IV moves in vol points (default -10..+10 step 1)
+    spot_shocks: Optional[List[confloat(gt=-100)]] = Field(None, min_length=1, max_length=101)
+    vol_shocks: Optional[List[float]] = Field(None, min_length=1, max_length=101)
 
 
 # Helper functions
+async def truedata_get(
+    path: str,
+    token: str,
+    params: Dict[str, str],
+    timeout: float,
+    base_url: str = TRUEDATA_ANALYTICS_URL
+) -> httpx.Response:
+    """GET a TrueData analytics (or history) endpoint, recording or replaying it when enabled"""
+    with span(f"truedata {path}", kind="client", symbol=params.get("symbol", "")) as upstream_span:
+        if market_replayer is not None:
+            upstream_span.set_attribute("truedata.replay", True)
+            replayed = market_replayer.lookup(path, params)
+            if replayed is None:
+                return httpx.Response(404, text="No recorded response")
+            status_code, body = replayed
+            upstream_span.set_attribute("http.status_code", status_code)
+            if status_code == 200:
+                trusted_tokens.remember(token)
+            return httpx.Response(status_code, text=body)
+        
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.get(
+                f"{base_url}/{path}",
+                params=params,
+                headers={"Authorization": f"Bearer {token}"}
+            )
+        upstream_span.set_attribute("http.status_code", response.status_code)
+        if response.status_code == 200:
+            trusted_tokens.remember(token)
+        
+        if market_recorder is not None:
+            try:
+                market_recorder.record(path, params, response.status_code, response.text)
+            except Exception as e:
+                logger.error(f"Failed to record {path} response: {str(e)}")
+        return response
+
+
+# Cache keys are built from these, so anything else never reaches the cache
+SYMBOL_PATTERN = re.compile(r"^[A-Za-z0-9&_-]{1,32}$")
+EXPIRY_PATTERN = re.compile(r"^\d{2}-\d{2}-\d{4}$")
+
+
+def valid_symbol(symbol: str) -> bool:
+    return bool(SYMBOL_PATTERN.match(symbol))
+
+
+async def token_trusted(token: str) -> bool:
+    """Whether a token may read cached market data
+    
+    True when it worked upstream recently (any worker) or belongs to an
+    unexpired login in db.tokens.
+    """
+    if trusted_tokens.known(token):
+        return True
+    database = get_mongo_db()
+    if database is None or not token:
+        return False
+    try:
+        with span("mongodb tokens.find_one", kind="client", **{"db.system": "mongodb"}):
+            doc = await database.tokens.find_one(
+                {"access_token": token, "expires_at": {"$gt": datetime.now(timezone.utc)}}, {"_id": 1}
+            )
+    except Exception as e:
+        logger.warning(f"Token lookup failed: {str(e)}")
+        return False
+    if doc is not None:
+        trusted_tokens.remember(token)
+    return doc is not None
+
+
 async def get_truedata_token(username: str, password: str) -> Dict[str, Any]:
     """Authenticate with TrueData API and get access token"""
+    if market_replayer is not None:
+        # Replay runs offline - any credentials get a placeholder token
+        return {"access_token": "replay", "expires_in": 86400}
+    
     try:
-        logger.info(f"Attempting TrueData authentication for user: {username}")
+        logger.debug(f"Attempting TrueData authentication for user: {username}")
         
         # Prepare form data - httpx will automatically URL-encode special characters
         form_data = {
@@ -141,21 +473,23 @@ async def get_truedata_token(username: str, password: str) -> Dict[str, Any]:
             "grant_type": "password"
         }
         
-        logger.info(f"TrueData auth URL: {TRUEDATA_AUTH_URL}")
+        logger.debug(f"TrueData auth URL: {TRUEDATA_AUTH_URL}")
         
         async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
             # Send form data - httpx automatically URL-encodes special characters
-            response = await client.post(
-                TRUEDATA_AUTH_URL,
-                data=form_data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
+            with span("truedata auth", kind="client") as auth_span:
+                response = await client.post(
+                    TRUEDATA_AUTH_URL,
+                    data=form_data,
+                    headers={"Content-Type": "application/x-www-form-urlencoded"}
+                )
+                auth_span.set_attribute("http.status_code", response.status_code)
             
-            logger.info(f"TrueData auth response status: {response.status_code}")
+            logger.debug(f"TrueData auth response status: {response.status_code}")
             
             if response.status_code == 200:
                 result = response.json()
-                logger.info("TrueData authentication successful")
+                logger.debug("TrueData authentication successful")
                 return result
             else:
                 error_text = response.text
@@ -183,49 +517,153 @@ async def get_truedata_token(username: str, password: str) -> Dict[str, Any]:
         return {"error": f"Unexpected error: {str(e)}"}
 
 
+def parse_ltp_csv(text: str) -> Optional[float]:
+    """Parse a getLTPSpot CSV response (a "LTP" header line, then the value)"""
+    lines = text.strip().split('\n')
+    if len(lines) >= 2:
+        return float(lines[1])
+    return None
+
+
 async def fetch_ltp_spot(token: str, symbol: str, series: str = "EQ") -> Optional[float]:
     """Fetch LTP for spot/equity"""
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # TrueData API returns CSV format with just LTP value
-            response = await client.get(
-                f"{TRUEDATA_ANALYTICS_URL}/getLTPSpot",
-                params={"symbol": symbol, "series": series, "response": "csv"},
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            
-            if response.status_code == 200:
-                # Parse CSV response - format is "LTP\n<value>"
-                lines = response.text.strip().split('\n')
-                if len(lines) >= 2:
-                    return float(lines[1])
-                return None
-            else:
-                logger.error(f"Error fetching LTP for {symbol}: {response.status_code}")
-                return None
+        # TrueData API returns CSV format with just LTP value
+        response = await truedata_get(
+            "getLTPSpot",
+            token,
+            {"symbol": symbol, "series": series, "response": "csv"},
+            timeout=15.0
+        )
+        
+        if response.status_code == 200:
+            return parse_ltp_csv(response.text)
+        else:
+            logger.warning(f"Error fetching LTP for {symbol}: {response.status_code}", extra={"category": "upstream"})
+            return None
     except Exception as e:
-        logger.error(f"Exception fetching LTP for {symbol}: {str(e)}")
+        logger.warning(f"Exception fetching LTP for {symbol}: {str(e)}", extra={"category": "upstream"})
         return None
 
 
 async def fetch_option_chain(token: str, symbol: str, expiry: str) -> Optional[Dict[str, Any]]:
     """Fetch option chain data for a symbol"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{TRUEDATA_ANALYTICS_URL}/getoptionchain",
-                params={"symbol": symbol, "expiry": expiry, "response": "json"},
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"Error fetching option chain for {symbol}: {response.status_code}")
-                return None
+        response = await truedata_get(
+            "getoptionchain",
+            token,
+            {"symbol": symbol, "expiry": expiry, "response": "json"},
+            timeout=30.0
+        )
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"Error fetching option chain for {symbol}: {response.status_code}", extra={"category": "upstream"})
+            return None
     except Exception as e:
-        logger.error(f"Exception fetching option chain for {symbol}: {str(e)}")
+        logger.warning(f"Exception fetching option chain for {symbol}: {str(e)}", extra={"category": "upstream"})
+        return None
+
+
+async def get_option_chain_payload(token: str, symbol: str, expiry: str, max_age: Optional[float] = None) -> Optional[bytes]:
+    """Serialized option chain through the shared snapshot cache (one upstream fetch per TTL across workers)"""
+    if not valid_symbol(symbol) or not EXPIRY_PATTERN.match(expiry):
         return None
+    
+    async def refresh() -> Optional[bytes]:
+        data = await fetch_option_chain(token, symbol, expiry)
+        if data and alert_engine.watches(symbol, "oi_change_percent"):
+            await check_oi_alerts(symbol, expiry, data)
+        if (data and chain_history is not None and market_replayer is None and market_cadence.is_open()
+                and chain_history.due(symbol, expiry)):
+            if running_serverless():
+                # A frozen function would never finish a background task
+                await chain_history.record(symbol, expiry, data)
+            else:
+                chain_history.sample(symbol, expiry, data)
+        return json.dumps(data, separators=(",", ":")).encode() if data else None
+    
+    if shared_snapshot is None:
+        return await refresh()
+    return await shared_snapshot.get_or_refresh(
+        f"optionchain:{symbol}:{expiry}",
+        market_cadence.ttl(OPTION_CHAIN_CACHE_TTL, symbol) if max_age is None else max_age,
+        refresh,
+        persist=True,
+        trusted=lambda: token_trusted(token)
+    )
+
+
+async def check_oi_alerts(symbol: str, expiry: str, data: Dict[str, Any]):
+    """Feed a chain's total OI to the alert engine (which tracks its change per expiry)"""
+    try:
+        oi = chain_oi_arrays(data)
+        total = float(oi["call_oi"].sum() + oi["put_oi"].sum())
+        if alert_engine.update_open_interest(symbol, expiry, total):
+            await alert_engine.flush()
+    except Exception as e:
+        logger.error(f"OI alert check failed for {symbol}: {str(e)}")
+
+
+def option_chain_is_fresh(symbol: str, expiry: str, max_age: float) -> bool:
+    snapshot = shared_snapshot.read(f"optionchain:{symbol}:{expiry}") if shared_snapshot else None
+    return snapshot is not None and time.time() - snapshot[0] < max_age
+
+
+async def warm_option_chain(token: str, symbol: str, expiry: str, max_age: float) -> bool:
+    """Refresh a cached chain older than max_age; used by the prefetcher"""
+    return await get_option_chain_payload(token, symbol, expiry, max_age) is not None
+
+
+# Parsed, strike-sorted chains for strike-window requests (per worker)
+sorted_chains = SortedChainCache()
+
+
+# Background warming of likely-to-be-opened chains (needs the shared cache to warm)
+chain_prefetcher = (
+    prefetcher_from_env(
+        warm_option_chain,
+        option_chain_is_fresh,
+        lambda symbol: market_cadence.ttl(OPTION_CHAIN_CACHE_TTL, symbol),
+        market_cadence.is_open,
+        shared_snapshot
+    )
+    if shared_snapshot is not None else None
+)
+
+
+async def get_option_chain_data(token: str, symbol: str, expiry: str) -> Optional[Dict[str, Any]]:
+    """Option chain through the shared snapshot cache, parsed"""
+    payload = await get_option_chain_payload(token, symbol, expiry)
+    return json.loads(payload) if payload else None
+
+
+def make_etag(*parts: bytes) -> str:
+    """Strong ETag over the exact bytes that make up a response body"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, so W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def conditional_response(body_parts: List[bytes], if_none_match: Optional[str], max_age: float) -> Response:
+    """200 with ETag/Cache-Control, or an empty 304 when the client already has it"""
+    etag = make_etag(*body_parts)
+    headers = {"ETag": etag, "Cache-Control": f"max-age={int(max_age)}"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=b"".join(body_parts), media_type="application/json", headers=headers)
 
 
 def calculate_iv_metrics(option_chain_data: Dict[str, Any]) -> tuple:
@@ -245,64 +683,112 @@ def calculate_iv_metrics(option_chain_data: Dict[str, Any]) -> tuple:
         return None, None
 
 
-async def fetch_stock_data(token: str, symbol: str) -> StockData:
-    """Fetch comprehensive stock data for dashboard"""
-    try:
-        # Determine series based on symbol
-        if symbol in ["NIFTY", "BANKNIFTY"]:
-            series = "XX"  # Index
-        else:
-            series = "EQ"  # Equity
-        
-        # Fetch spot price data
-        ltp = await fetch_ltp_spot(token, symbol, series)
-        
-        if ltp is None:
-            return StockData(
-                symbol=symbol,
-                error="Failed to fetch data"
-            )
-        
-        # For demo purposes, generate realistic mock data based on LTP
-        # In production, you would fetch this from historical data or other endpoints
-        # Generate a random but consistent change for demo
-        import random
-        random.seed(hash(symbol) + int(ltp))
-        
-        change_percent = random.uniform(-3.0, 3.0)
-        volume = random.randint(1000000, 50000000)
-        
-        # Generate signal based on change
-        signal = None
-        if abs(change_percent) > 2.0:
-            signal = "High Volatility"
-        elif change_percent > 1.0:
-            signal = "Bullish"
-        elif change_percent < -1.0:
-            signal = "Bearish"
-        else:
-            signal = "Neutral"
-        
-        # Mock IV metrics (would need option chain data for real calculation)
-        iv = 20 + (hash(symbol) % 30)  # Mock IV between 20-50
-        iv_percentile = 30 + (hash(symbol) % 60)  # Mock percentile
-        
-        return StockData(
-            symbol=symbol,
-            spot=ltp,
-            change_percent=round(change_percent, 2),
-            volume=volume,
-            iv=round(iv, 2),
-            iv_percentile=round(iv_percentile, 2),
-            signal=signal
-        )
+def series_for(symbol: str) -> str:
+    """Determine series based on symbol"""
+    if symbol in ["NIFTY", "BANKNIFTY"]:
+        return "XX"  # Index
+    return "EQ"  # Equity
+
+
+async def get_spot(token: str, symbol: str) -> Optional[float]:
+    """Spot price through the shared snapshot cache"""
+    if not valid_symbol(symbol):
+        return None
     
-    except Exception as e:
-        logger.error(f"Error fetching data for {symbol}: {str(e)}")
-        return StockData(
-            symbol=symbol,
-            error=str(e)
-        )
+    async def refresh() -> Optional[bytes]:
+        ltp = await fetch_ltp_spot(token, symbol, series_for(symbol))
+        return repr(ltp).encode() if ltp is not None else None
+    
+    if shared_snapshot is None:
+        return await fetch_ltp_spot(token, symbol, series_for(symbol))
+    payload = await shared_snapshot.get_or_refresh(
+        f"ltp:{symbol}", market_cadence.ttl(DASHBOARD_CACHE_TTL, symbol), refresh,
+        trusted=lambda: token_trusted(token)
+    )
+    return float(payload) if payload else None
+
+
+def stock_metrics(symbol: str, ltp: float) -> Dict[str, Any]:
+    """Derived dashboard fields for a symbol at a given LTP"""
+    # For demo purposes, generate realistic mock data based on LTP
+    # In production, you would fetch this from historical data or other endpoints
+    # Generate a random but consistent change for demo
+    import random
+    random.seed(hash(symbol) + int(ltp))
+    
+    change_percent = random.uniform(-3.0, 3.0)
+    volume = random.randint(1000000, 50000000)
+    
+    # Generate signal based on change
+    signal = None
+    if abs(change_percent) > 2.0:
+        signal = "High Volatility"
+    elif change_percent > 1.0:
+        signal = "Bullish"
+    elif change_percent < -1.0:
+        signal = "Bearish"
+    else:
+        signal = "Neutral"
+    
+    # Mock IV metrics (would need option chain data for real calculation)
+    iv = 20 + (hash(symbol) % 30)  # Mock IV between 20-50
+    iv_percentile = 30 + (hash(symbol) % 60)  # Mock percentile
+    
+    return {
+        "change_percent": round(change_percent, 2),
+        "volume": volume,
+        "iv": round(iv, 2),
+        "iv_percentile": round(iv_percentile, 2),
+        "signal": signal
+    }
+
+
+async def fetch_stock_into(token: str, snapshot: MarketSnapshot, index: int, track: bool = True):
+    """Fetch one symbol's dashboard data into a snapshot row
+    
+    track=False leaves the RV history, alerts and rollups alone (one-off reads like exports).
+    """
+    symbol = snapshot.symbols[index]
+    with span("dashboard symbol", symbol=symbol) as symbol_span:
+        try:
+            # Fetch spot price data
+            ltp = await fetch_ltp_spot(token, symbol, series_for(symbol))
+            
+            if ltp is None:
+                symbol_span.set_attribute("error", "Failed to fetch data")
+                snapshot.set_error(index, "Failed to fetch data")
+                return
+            
+            metrics = stock_metrics(symbol, ltp)
+            backfilled = iv_percentiles.get(symbol)
+            if backfilled is not None:
+                metrics["iv"], metrics["iv_percentile"] = backfilled
+            # Live ticks build today's bar; replayed ones would pollute it
+            if track and market_replayer is None and market_cadence.is_open():
+                volatility_engine.history.record_tick(symbol, ltp)
+            rv = volatility_engine.rv(symbol)
+            iv_rv_ratio = round(metrics["iv"] / rv, 2) if rv else None
+            snapshot.set_row(index, spot=ltp, rv=rv, iv_rv_ratio=iv_rv_ratio, **metrics)
+            if not track:
+                return
+            alert_engine.update(symbol, {
+                "spot": ltp,
+                "change_percent": metrics["change_percent"],
+                "iv_percentile": metrics["iv_percentile"]
+            })
+            sector_rollups.update(symbol, ltp, metrics["change_percent"], metrics["volume"], metrics["iv"])
+        
+        except Exception as e:
+            logger.error(f"Error fetching data for {symbol}: {str(e)}")
+            symbol_span.set_attribute("error", str(e))
+            snapshot.set_error(index, str(e))
+
+
+async def fetch_stock_data(token: str, symbol: str, track: bool = True) -> StockData:
+    """Fetch comprehensive stock data for one symbol"""
+    snapshot = MarketSnapshot([symbol])
+    await fetch_stock_into(token, snapshot, 0, track)
+    return StockData(**snapshot.row(0))
 
 
 # Routes
@@ -310,7 +796,7 @@ async def fetch_stock_data(token: str, symbol: str) -> StockData:
 async def login(request: LoginRequest):
     """Authenticate user with TrueData credentials"""
     try:
-        logger.info(f"Login attempt for username: {request.username}")
+        logger.debug(f"Login attempt for username: {request.username}")
         result = await get_truedata_token(request.username, request.password)
         
         if "error" in result:
@@ -322,18 +808,21 @@ async def login(request: LoginRequest):
             )
         
         # Store token in database for session management
+        # Dates are stored as BSON dates so the TTL index can expire them
+        now = datetime.now(timezone.utc)
         token_doc = {
             "username": request.username,
             "access_token": result.get("access_token"),
             "expires_in": result.get("expires_in"),
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "expires_at": (datetime.now(timezone.utc) + timedelta(seconds=result.get("expires_in", 3600))).isoformat()
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=result.get("expires_in") or 3600)
         }
         
         # Upsert token (MongoDB is optional - app works without it)
         # Try to initialize MongoDB if not already done
         if client is None and db is None:
             init_mongodb()
+        await prepare_mongodb()
         
         if db is None:
             logger.warning("MongoDB not initialized - cannot store token (tokens will be stored in frontend localStorage)")
@@ -341,17 +830,19 @@ async def login(request: LoginRequest):
         else:
             try:
                 # Use 'tokens' collection (will be created automatically if it doesn't exist)
-                await db.tokens.update_one(
-                    {"username": request.username},
-                    {"$set": token_doc},
-                    upsert=True
-                )
-                logger.info(f"Token stored in MongoDB for {request.username}")
+                with span("mongodb tokens.update_one", kind="client", **{"db.system": "mongodb"}):
+                    await db.tokens.update_one(
+                        {"username": request.username},
+                        {"$set": token_doc},
+                        upsert=True
+                    )
+                logger.debug(f"Token stored in MongoDB for {request.username}")
             except Exception as e:
                 # Don't fail login if MongoDB storage fails
                 logger.warning(f"Failed to store token in MongoDB (non-critical): {str(e)}")
                 # Continue - token will be stored in frontend localStorage
         
+        trusted_tokens.remember(result.get("access_token"))
         logger.info(f"Login successful for {request.username}")
         return LoginResponse(
             success=True,
@@ -371,19 +862,81 @@ async def login(request: LoginRequest):
         )
 
 
+async def build_dashboard(token: str) -> MarketSnapshot:
+    """Fetch data for all stocks concurrently into one columnar snapshot"""
+    snapshot = MarketSnapshot(TOP_20_STOCKS)
+    # Picks up other workers' bars; recomputes only when a bar has completed since the last build
+    await volatility_engine.history.sync()
+    volatility_engine.latest()
+    await iv_percentiles.refresh_if_stale()
+    await alert_engine.reload_if_stale()
+    await asyncio.gather(*(fetch_stock_into(token, snapshot, i) for i in range(len(snapshot))))
+    await alert_engine.flush()
+    # Only the worker refreshing the dashboard records ticks, so it's the one that saves them
+    await volatility_engine.history.sync()
+    return snapshot
+
+
+async def dashboard_payload(token: str, ttl: float) -> bytes:
+    """Serialized DashboardResponse through the shared snapshot cache"""
+    if shared_snapshot is None:
+        snapshot = await build_dashboard(token)
+        market_cadence.note_volatile(snapshot.symbols_with_signal("High Volatility"))
+        return snapshot.to_json(datetime.now(timezone.utc))
+    
+    built = None
+    
+    async def refresh() -> Optional[bytes]:
+        nonlocal built
+        snapshot = await build_dashboard(token)
+        timestamp = datetime.now(timezone.utc)
+        built = snapshot.to_json(timestamp)
+        volatile = snapshot.symbols_with_signal("High Volatility")
+        market_cadence.note_volatile(volatile)
+        if chain_prefetcher is not None:
+            chain_prefetcher.note_dashboard(token, volatile)
+        # Don't publish a snapshot where every symbol failed (e.g. bad token)
+        if snapshot.all_failed():
+            return None
+        publish_heatmap(built, sector_rollups.to_json(timestamp))
+        return built
+    
+    payload = await shared_snapshot.get_or_refresh(
+        "dashboard", ttl, refresh, persist=True, trusted=lambda: token_trusted(token)
+    )
+    return built if payload is None else payload
+
+
+def publish_heatmap(dashboard: bytes, heatmap: bytes):
+    """Share a heatmap body tagged with the ETag of the dashboard it was built from"""
+    if shared_snapshot is not None:
+        shared_snapshot.write("heatmap", make_etag(dashboard).encode() + b"\n" + heatmap)
+
+
+def heatmap_payload(dashboard: bytes) -> bytes:
+    """Heatmap body matching a dashboard payload; rebuilt only if no worker published it"""
+    tag = make_etag(dashboard).encode() + b"\n"
+    cached = shared_snapshot.read("heatmap") if shared_snapshot is not None else None
+    if cached is not None and cached[1].startswith(tag):
+        return cached[1][len(tag):]
+    
+    # e.g. dashboard restored from the persistent tier - fold its rows in once
+    parsed = json.loads(dashboard)
+    sector_rollups.update_rows(parsed["data"])
+    heatmap = sector_rollups.to_json(datetime.fromisoformat(parsed["timestamp"].replace("Z", "+00:00")))
+    publish_heatmap(dashboard, heatmap)
+    return heatmap
+
+
 @api_router.get("/market/dashboard", response_model=DashboardResponse)
-async def get_dashboard_data(token: str):
+async def get_dashboard_data(token: str, if_none_match: Optional[str] = Header(None)):
     """Fetch dashboard data for top 20 F&O stocks"""
     try:
-        # Fetch data for all stocks concurrently
-        tasks = [fetch_stock_data(token, symbol) for symbol in TOP_20_STOCKS]
-        stocks_data = await asyncio.gather(*tasks)
+        ttl = market_cadence.ttl(DASHBOARD_CACHE_TTL)
+        payload = await dashboard_payload(token, ttl)
         
-        return DashboardResponse(
-            success=True,
-            data=list(stocks_data),
-            timestamp=datetime.now(timezone.utc)
-        )
+        # Serialized straight from the snapshot columns - no per-row models
+        return conditional_response([payload], if_none_match, min(ttl, market_cadence.client_refresh_after()))
     
     except Exception as e:
         logger.error(f"Dashboard data error: {str(e)}")
@@ -393,13 +946,93 @@ async def get_dashboard_data(token: str):
         )
 
 
+@api_router.get("/market/heatmap")
+async def get_market_heatmap(token: str, if_none_match: Optional[str] = Header(None)):
+    """Sector / index rollups (weighted change, breadth, average IV) and per-symbol tiles"""
+    try:
+        ttl = market_cadence.ttl(DASHBOARD_CACHE_TTL)
+        dashboard = await dashboard_payload(token, ttl)
+        return conditional_response(
+            [heatmap_payload(dashboard)], if_none_match, min(ttl, market_cadence.client_refresh_after())
+        )
+    
+    except Exception as e:
+        logger.error(f"Heatmap error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.get("/market/volatility")
+async def get_realized_volatility(symbols: Optional[str] = None):
+    """Latest realized volatility per symbol for each estimator, from completed daily bars"""
+    try:
+        await volatility_engine.history.sync()
+        latest = volatility_engine.latest()
+        selected = parse_list(symbols) or TOP_20_STOCKS
+        history = volatility_engine.history
+        completed = volatility_engine.completed_columns()
+        return {
+            "success": True,
+            "window": volatility_engine.window,
+            "estimators": list(ESTIMATORS),
+            "as_of": history.dates[completed - 1].isoformat() if completed else None,
+            "data": {symbol: latest.get(symbol) for symbol in selected},
+        }
+    
+    except Exception as e:
+        logger.error(f"Realized volatility error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.get("/market/correlation")
+async def get_correlation_matrix(symbols: Optional[str] = None):
+    """Correlation of daily returns between symbols over VOL_CORR_WINDOW bars"""
+    try:
+        await volatility_engine.history.sync()
+        return {"success": True, **volatility_engine.correlations(parse_list(symbols) or None)}
+    
+    except Exception as e:
+        logger.error(f"Correlation error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.get("/market/status")
+async def get_market_status():
+    """Trading session phase and the recommended dashboard refresh interval"""
+    return market_cadence.status()
+
+
 @api_router.get("/market/optionchain/{symbol}", response_model=OptionChainResponse)
-async def get_option_chain(symbol: str, expiry: str, token: str):
-    """Fetch option chain for a specific symbol and expiry"""
+async def get_option_chain(
+    symbol: str,
+    expiry: str,
+    token: str,
+    strikes_around_atm: Optional[int] = Query(None, ge=1),
+    min_strike: Optional[float] = None,
+    max_strike: Optional[float] = None,
+    fmt: str = Query("raw", alias="format", pattern="^(raw|columnar)$"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Fetch option chain for a specific symbol and expiry
+    
+    strikes_around_atm=N returns the ATM strike plus N strikes either side of
+    the current spot; min_strike/max_strike return an inclusive strike range.
+    format=columnar returns strike-sorted parallel arrays per field, one
+    entry per strike (duplicate rows merged, null where missing), in place
+    of the raw Records.
+    """
     try:
-        data = await fetch_option_chain(token, symbol, expiry)
+        payload = await get_option_chain_payload(token, symbol, expiry)
         
-        if not data:
+        if not payload:
             return OptionChainResponse(
                 success=False,
                 symbol=symbol,
@@ -407,11 +1040,61 @@ async def get_option_chain(symbol: str, expiry: str, token: str):
                 error="Failed to fetch option chain data"
             )
         
-        return OptionChainResponse(
-            success=True,
-            symbol=symbol,
-            expiry=expiry,
-            data=data
+        # Only chains that exist count towards popularity
+        if chain_prefetcher is not None:
+            chain_prefetcher.note_chain_request(token, symbol, expiry)
+        
+        if fmt == "columnar":
+            chain = sorted_chains.get(symbol, expiry, make_etag(payload), lambda: json.loads(payload))
+            spot = atm_strike = None
+            if strikes_around_atm is not None:
+                spot = await get_spot(token, symbol)
+                min_strike, max_strike, atm_strike = chain.window(spot, strikes_around_atm)
+            columnar = OptionChainResponse(
+                success=True,
+                symbol=symbol,
+                expiry=expiry,
+                spot=spot,
+                atm_strike=atm_strike,
+                columns=chain.columns(min_strike, max_strike)
+            )
+            return conditional_response(
+                [columnar.model_dump_json().encode()], if_none_match, OPTION_CHAIN_CACHE_TTL
+            )
+        
+        if strikes_around_atm is not None or min_strike is not None or max_strike is not None:
+            digest = make_etag(payload)
+            chain = sorted_chains.get(symbol, expiry, digest, lambda: json.loads(payload))
+            spot = atm_strike = None
+            if strikes_around_atm is not None:
+                spot = await get_spot(token, symbol)
+                records, atm_strike = chain.around(spot, strikes_around_atm)
+            else:
+                records = chain.between(min_strike, max_strike)
+            
+            sliced = OptionChainResponse(
+                success=True,
+                symbol=symbol,
+                expiry=expiry,
+                data={**chain.extra, "Records": records},
+                spot=spot,
+                atm_strike=atm_strike
+            )
+            return conditional_response(
+                [sliced.model_dump_json().encode()], if_none_match, OPTION_CHAIN_CACHE_TTL
+            )
+        
+        # Splice the cached chain bytes into the OptionChainResponse shape
+        # instead of parsing and re-serializing them
+        return conditional_response(
+            [
+                b'{"success":true,"symbol":', json.dumps(symbol).encode(),
+                b',"expiry":', json.dumps(expiry).encode(),
+                b',"data":', payload,
+                b',"error":null}'
+            ],
+            if_none_match,
+            OPTION_CHAIN_CACHE_TTL
         )
     
     except Exception as e:
@@ -422,6 +1105,550 @@ async def get_option_chain(symbol: str, expiry: str, token: str):
         )
 
 
+async def batch_chain_result(token: str, ref: ChainRef, strikes_around_atm: Optional[int]) -> BatchChainResult:
+    """One chain of a batch request, normalized and optionally sliced around ATM"""
+    try:
+        payload = await get_option_chain_payload(token, ref.symbol, ref.expiry)
+        if not payload:
+            return BatchChainResult(
+                success=False,
+                symbol=ref.symbol,
+                expiry=ref.expiry,
+                error="Failed to fetch option chain data"
+            )
+        
+        chain = sorted_chains.get(ref.symbol, ref.expiry, make_etag(payload), lambda: json.loads(payload))
+        spot = atm_strike = None
+        if strikes_around_atm is not None:
+            spot = await get_spot(token, ref.symbol)
+            records, atm_strike = chain.around(spot, strikes_around_atm)
+        else:
+            records = chain.records
+        
+        return BatchChainResult(
+            success=True,
+            symbol=ref.symbol,
+            expiry=ref.expiry,
+            rows=list(normalized_rows({"Records": records})),
+            spot=spot,
+            atm_strike=atm_strike
+        )
+    except Exception as e:
+        logger.error(f"Batch option chain error for {ref.symbol} {ref.expiry}: {str(e)}")
+        return BatchChainResult(success=False, symbol=ref.symbol, expiry=ref.expiry, error=str(e))
+
+
+@api_router.post("/market/optionchains/batch", response_model=BatchOptionChainResponse)
+async def get_option_chains_batch(request: BatchOptionChainRequest):
+    """Fetch many (symbol, expiry) chains in one call, normalized and strike-sorted
+    
+    Chains are fetched concurrently (at most BATCH_CONCURRENCY at a time)
+    through the shared snapshot cache. With stream=true the response is
+    NDJSON with one result per line in completion order, so a slow chain
+    doesn't hold back the others; otherwise results follow request order.
+    """
+    # Duplicate pairs are fetched once
+    refs = list({(ref.symbol, ref.expiry): ref for ref in request.chains}.values())
+    jobs = (
+        lambda ref=ref: batch_chain_result(request.token, ref, request.strikes_around_atm)
+        for ref in refs
+    )
+    
+    if request.stream:
+        async def lines():
+            async for result in bounded_as_completed(jobs, BATCH_CONCURRENCY):
+                yield result.model_dump_json() + "\n"
+        
+        return StreamingResponse(lines(), media_type=EXPORT_FORMATS["ndjson"])
+    
+    results = {}
+    async for result in bounded_as_completed(jobs, BATCH_CONCURRENCY):
+        results[(result.symbol, result.expiry)] = result
+    ordered = [results[(ref.symbol, ref.expiry)] for ref in refs]
+    return BatchOptionChainResponse(success=any(r.success for r in ordered), results=ordered)
+
+
+@api_router.get("/market/maxpain/{symbol}", response_model=MaxPainResponse)
+async def get_max_pain(symbol: str, expiry: str, token: str):
+    """Max pain strike and put/call OI ratio for a symbol and expiry"""
+    try:
+        payload = await get_option_chain_payload(token, symbol, expiry)
+        if not payload:
+            return MaxPainResponse(
+                success=False,
+                symbol=symbol,
+                expiry=expiry,
+                error="Failed to fetch option chain data"
+            )
+        
+        # The raw body goes to the pool; parsing it there keeps the loop free
+        result = await analytics_pool.run(
+            max_pain_from_payload, arrays={"payload": np.frombuffer(payload, dtype=np.uint8)}
+        )
+        return MaxPainResponse(success=True, symbol=symbol, expiry=expiry, **result)
+    
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Analytics job timed out"
+        )
+    except Exception as e:
+        logger.error(f"Max pain error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.get("/market/optionchain/{symbol}/changes")
+async def get_option_chain_changes(
+    symbol: str,
+    expiry: str,
+    token: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Per-strike OI, volume and LTP at `end` and their change since `start`
+    
+    Both times snap to the latest stored sample at or before them. start
+    defaults to today's open, which gives the change since the previous
+    session's last sample; end defaults to now, after refreshing the chain.
+    """
+    if chain_history is None or get_mongo_db() is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Option chain history is not available"
+        )
+    try:
+        # Stored history is licensed data too: an unknown token has to work upstream first
+        if end is None or not await token_trusted(token):
+            await get_option_chain_payload(token, symbol, expiry)
+        if not await token_trusted(token):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+        end = end or datetime.now(timezone.utc)
+        start = start or datetime.combine(datetime.now(IST).date(), OPEN, IST)
+        start, end = (t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t for t in (start, end))
+        if start > end:
+            raise ValueError("start must not be after end")
+        
+        changes = await chain_history.changes(symbol, expiry, start, end)
+        if changes is None:
+            return {"success": False, "symbol": symbol, "expiry": expiry, "error": "No chain history recorded yet"}
+        return {"success": True, "symbol": symbol, "expiry": expiry, **changes}
+    
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Option chain changes error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+async def fitted_slice(symbol: str, expiry: str, payload: bytes, spot: float):
+    """Smile fit for a chain payload; a refit (parse, IV inversion, LM) runs in the analytics pool"""
+    digest = make_etag(payload)
+    current, previous = vol_surface.lookup(symbol, expiry, digest)
+    if current:
+        return previous
+    fit = await analytics_pool.run(
+        fit_payload,
+        arrays={"payload": np.frombuffer(payload, dtype=np.uint8)},
+        expiry=expiry,
+        spot=spot,
+        rate=vol_surface.rate,
+        previous=previous,
+        max_iterations=vol_surface.max_iterations
+    )
+    return vol_surface.store(symbol, expiry, digest, fit, previous)
+
+
+@api_router.get("/market/volsurface/{symbol}")
+async def get_vol_surface(
+    symbol: str,
+    token: str,
+    expiries: Optional[str] = None,
+    strikes: Optional[str] = None,
+    days: Optional[float] = Query(None, gt=0)
+):
+    """Fitted smile per expiry, with IV and Greeks at the requested strikes
+    
+    Each expiry is refitted, in the analytics pool, only when its cached
+    chain changes. strikes defaults to the chain's own strikes; days=N also
+    returns the surface interpolated to N calendar days out.
+    """
+    try:
+        selected = parse_list(expiries) or nearest_monthly_expiries(date.today())
+        requested = [float(s) for s in parse_list(strikes)]
+        spot = await get_spot(token, symbol)
+        if spot is None:
+            return {"success": False, "symbol": symbol, "error": "Failed to fetch spot price"}
+        
+        slices = []
+        fits = []
+        for expiry in selected:
+            payload = await get_option_chain_payload(token, symbol, expiry)
+            if not payload:
+                slices.append({"expiry": expiry, "error": "Failed to fetch option chain data"})
+                continue
+            fit = await fitted_slice(symbol, expiry, payload, spot)
+            if fit is None:
+                slices.append({"expiry": expiry, "error": "Not enough quotes to fit a smile"})
+                continue
+            at = requested or fit.strikes
+            slices.append({**fit.summary(), "points": vol_surface.evaluate(fit, at, spot)})
+            fits.append(fit)
+        
+        result = {"success": bool(fits), "symbol": symbol, "spot": spot, "slices": slices}
+        if days is not None:
+            at = requested or [spot]
+            result["interpolated"] = {
+                "days": days,
+                "points": vol_surface.interpolate(sorted(fits, key=lambda f: f.years), days / 365.0, at, spot)
+            }
+        return result
+    
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Analytics job timed out"
+        )
+    except Exception as e:
+        logger.error(f"Vol surface error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.post("/portfolio/greeks")
+async def get_portfolio_greeks(request: PortfolioRequest):
+    """Aggregate Greeks and a spot x vol scenario P&L grid for option positions
+    
+    Legs are marked at their chain's mid through the shared snapshot cache,
+    with IV backed out of the mark; strikes without a usable quote take the
+    fitted smile. Legs that can't be priced are listed under errors and left
+    out of the totals.
+    """
+    try:
+        positions = [p.model_dump() for p in request.positions]
+        symbols = list(dict.fromkeys(p["symbol"] for p in positions))
+        chains = list(dict.fromkeys((p["symbol"], p["expiry"]) for p in positions))
+        
+        async def fetch_spot(symbol):
+            return symbol, await get_spot(request.token, symbol)
+        
+        async def fetch_chain(symbol, expiry):
+            return (symbol, expiry), await get_option_chain_payload(request.token, symbol, expiry)
+        
+        spots: Dict[str, Optional[float]] = {}
+        payloads: Dict[tuple, Optional[bytes]] = {}
+        async for symbol, spot in bounded_as_completed(
+            (lambda symbol=symbol: fetch_spot(symbol) for symbol in symbols), BATCH_CONCURRENCY
+        ):
+            spots[symbol] = spot
+        async for key, payload in bounded_as_completed(
+            (lambda key=key: fetch_chain(*key) for key in chains), BATCH_CONCURRENCY
+        ):
+            payloads[key] = payload
+        
+        # Parsing, fits and the revaluation all run in the analytics pool
+        async def quotes_for(key):
+            payload = payloads.get(key)
+            if not payload:
+                return key, None
+            digest = make_etag(payload)
+            quotes = chain_marks.lookup(*key, digest)
+            if quotes is None:
+                quotes = await analytics_pool.run(
+                    quotes_from_payload, arrays={"payload": np.frombuffer(payload, dtype=np.uint8)}
+                )
+                chain_marks.store(*key, digest, quotes)
+            return key, quotes
+        
+        quotes = {key: q for key, q in await asyncio.gather(*(quotes_for(key) for key in chains)) if q is not None}
+        needed = [key for key in chains_needing_fits(positions, quotes) if spots.get(key[0])]
+        fitted = await asyncio.gather(*(
+            fitted_slice(symbol, expiry, payloads[(symbol, expiry)], spots[symbol]) for symbol, expiry in needed
+        ))
+        
+        spot_shocks = request.spot_shocks or list(DEFAULT_SHOCKS)
+        vol_shocks = request.vol_shocks or list(DEFAULT_SHOCKS)
+        report = await analytics_pool.run(
+            portfolio_report,
+            positions=positions,
+            spots=spots,
+            quotes=quotes,
+            fits=dict(zip(needed, fitted)),
+            rate=vol_surface.rate,
+            spot_shocks=spot_shocks,
+            vol_shocks=vol_shocks
+        )
+        return {
+            "success": report.pop("success"),
+            "legs": report.pop("legs"),
+            "errors": report.pop("errors"),
+            "spots": spots,
+            "spot_shocks": spot_shocks,
+            "vol_shocks": vol_shocks,
+            **report,
+        }
+    
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Analytics job timed out"
+        )
+    except Exception as e:
+        logger.error(f"Portfolio Greeks error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.get("/admission")
+async def admission_metrics():
+    """Admission control counters and event-loop lag"""
+    if admission_controller is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission_controller.snapshot()}
+
+
+@api_router.get("/analytics/pool")
+async def analytics_pool_metrics():
+    """Analytics executor counters"""
+    return analytics_pool.snapshot()
+
+
+def export_response(rows, fmt: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        rows,
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'}
+    )
+
+
+async def fresh_dashboard_rows(token: str) -> Dict[str, Dict[str, Any]]:
+    """Rows of the cached dashboard snapshot by symbol, if it is fresh and the token may read it"""
+    snapshot = shared_snapshot.read("dashboard") if shared_snapshot is not None else None
+    if snapshot is None or time.time() - snapshot[0] >= market_cadence.ttl(DASHBOARD_CACHE_TTL):
+        return {}
+    if not await token_trusted(token):
+        return {}
+    return {row["symbol"]: row for row in json.loads(snapshot[1])["data"] if not row.get("error")}
+
+
+@api_router.get("/export/dashboard")
+async def export_dashboard(
+    token: str,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    symbols: Optional[str] = None
+):
+    """Stream dashboard rows as NDJSON or CSV, one row per symbol as it arrives
+    
+    Rows come from the cached dashboard snapshot while it is fresh; other
+    symbols are fetched (without feeding alerts or the RV history), and a
+    symbol that fails is skipped rather than ending the stream.
+    """
+    selected = parse_list(symbols) or TOP_20_STOCKS
+    invalid = [symbol for symbol in selected if not valid_symbol(symbol)]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid symbols: {', '.join(invalid[:10])}"
+        )
+    encoder = RowEncoder(fmt, StockData.model_fields)
+    cached = await fresh_dashboard_rows(token)
+    
+    async def fetch(symbol: str) -> Optional[Dict[str, Any]]:
+        try:
+            return (await fetch_stock_data(token, symbol, track=False)).model_dump()
+        except Exception as e:
+            logger.warning(f"Export skipped {symbol}: {str(e)}", extra={"category": "upstream"})
+            return None
+    
+    async def rows():
+        header = encoder.header()
+        if header:
+            yield header
+        for symbol in selected:
+            if symbol in cached:
+                yield encoder.encode(cached[symbol])
+        jobs = (lambda symbol=symbol: fetch(symbol) for symbol in selected if symbol not in cached)
+        async for row in bounded_as_completed(jobs, EXPORT_CONCURRENCY):
+            if row is not None:
+                yield encoder.encode(row)
+    
+    return export_response(rows(), fmt, "dashboard")
+
+
+@api_router.get("/export/optionchains")
+async def export_option_chains(
+    token: str,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    symbols: Optional[str] = None,
+    expiries: Optional[str] = None
+):
+    """Stream normalized option-chain rows for many symbols and expiries
+    
+    Defaults to every dashboard symbol and the two nearest monthly expiries.
+    At most EXPORT_CONCURRENCY chains are held in memory at a time.
+    """
+    selected = parse_list(symbols) or TOP_20_STOCKS
+    selected_expiries = parse_list(expiries) or nearest_monthly_expiries(date.today())
+    encoder = RowEncoder(fmt, ("symbol", "expiry") + NORMALIZED_FIELDS)
+    
+    async def fetch(symbol: str, expiry: str):
+        return symbol, expiry, await get_option_chain_data(token, symbol, expiry)
+    
+    async def rows():
+        header = encoder.header()
+        if header:
+            yield header
+        jobs = (
+            lambda symbol=symbol, expiry=expiry: fetch(symbol, expiry)
+            for symbol in selected for expiry in selected_expiries
+        )
+        async for symbol, expiry, data in bounded_as_completed(jobs, EXPORT_CONCURRENCY):
+            if not data:
+                logger.warning(f"Export skipped {symbol} {expiry}: no option chain data", extra={"category": "upstream"})
+                continue
+            for row in normalized_rows(data):
+                yield encoder.encode({"symbol": symbol, "expiry": expiry, **row})
+    
+    return export_response(rows(), fmt, "optionchains")
+
+
+async def alert_username(token: str) -> str:
+    """Username behind a login token; alerts are stored per username"""
+    db = get_mongo_db()
+    if db is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Alerts need MongoDB (MONGO_URL / DB_NAME)"
+        )
+    with span("mongodb tokens.find_one", kind="client", **{"db.system": "mongodb"}):
+        doc = await db.tokens.find_one({"access_token": token}, {"username": 1})
+    if doc is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unknown or expired session")
+    return doc["username"]
+
+
+@api_router.post("/alerts", response_model=Alert)
+async def create_alert(request: AlertCreateRequest):
+    """Create an alert that fires when the symbol's field crosses the threshold"""
+    username = await alert_username(request.token)
+    try:
+        return await alert_engine.create(
+            username, request.symbol, request.field, request.direction, request.threshold, request.repeat
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Create alert error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.get("/alerts", response_model=AlertListResponse)
+async def list_alerts(token: str):
+    username = await alert_username(token)
+    try:
+        return AlertListResponse(success=True, alerts=await alert_engine.list(username))
+    except Exception as e:
+        logger.error(f"List alerts error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@api_router.delete("/alerts/{alert_id}")
+async def delete_alert(alert_id: str, token: str):
+    username = await alert_username(token)
+    if not await alert_engine.delete(username, alert_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alert not found")
+    return {"success": True}
+
+
+@api_router.get("/alerts/events", response_model=AlertEventsResponse)
+async def list_alert_events(token: str, since: Optional[datetime] = None, after: Optional[str] = None):
+    """Fired alerts after `since` (default: the last hour), oldest first
+    
+    For polling, pass the last event id seen as `after` instead: events are
+    then returned in insertion order, including ones another worker stored
+    late. They may repeat events from just before `after`; drop known ids.
+    """
+    username = await alert_username(token)
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid event id")
+        return AlertEventsResponse(success=True, events=await alert_engine.events_after(username, ObjectId(after)))
+    since = since or datetime.now(timezone.utc) - timedelta(hours=1)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return AlertEventsResponse(success=True, events=await alert_engine.events_since(username, since))
+
+
+@api_router.get("/alerts/stream")
+async def stream_alert_events(token: str):
+    """Server-sent events, one per fired alert
+    
+    Events fired in this worker arrive immediately; ones fired by other
+    workers are picked up from MongoDB every ALERTS_POLL_INTERVAL seconds.
+    Serverless runtimes buffer responses and cap their duration, so there
+    the stream answers 204 (which stops EventSource from reconnecting) and
+    clients poll /alerts/events instead.
+    """
+    if running_serverless():
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    username = await alert_username(token)
+    
+    async def events():
+        queue = alert_engine.hub.subscribe(username)
+        # Newest event id delivered; polls re-read an overlap before it
+        cursor = ObjectId()
+        seen: Set[ObjectId] = set()
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    batch = [await asyncio.wait_for(queue.get(), ALERTS_POLL_INTERVAL)]
+                except asyncio.TimeoutError:
+                    batch = [event for event in await alert_engine.events_after(username, cursor)
+                             if event["_id"] not in seen]
+                    if not batch:
+                        yield ": keep-alive\n\n"
+                        continue
+                for event in batch:
+                    if event["_id"] in seen:
+                        continue
+                    seen.add(event["_id"])
+                    cursor = max(cursor, event["_id"])
+                    yield f"event: alert\ndata: {AlertEvent(**event).model_dump_json()}\n\n"
+                # Only ids a poll can still return need remembering
+                horizon = cursor.generation_time - timedelta(seconds=alert_engine.poll_overlap + 1)
+                seen = {event_id for event_id in seen if event_id.generation_time >= horizon}
+        finally:
+            alert_engine.hub.unsubscribe(username, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @api_router.get("/")
 async def root():
     return {"message": "TrueData Analytics API"}
@@ -457,6 +1684,31 @@ async def test_db():
             "error_type": type(e).__name__
         }
 
+def require_profiler(admin_token: Optional[str]):
+    # Starlette decodes headers as latin-1; compare the original bytes
+    token = admin_token.encode("latin-1") if admin_token else None
+    if request_profiler is None or not request_profiler.authorized(token):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return request_profiler
+
+
+@api_router.get("/admin/profiles")
+async def list_profiles(admin_token: Optional[str] = Header(None, alias="X-Profile")):
+    """Slowest profiled requests kept on this worker"""
+    profiler = require_profiler(admin_token)
+    return {"profiles": profiler.slowest()}
+
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, admin_token: Optional[str] = Header(None, alias="X-Profile")):
+    """Collapsed stacks for one profiled request"""
+    profiler = require_profiler(admin_token)
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return Response(content=profile["collapsed"], media_type="text/plain")
+
+
 @api_router.get("/health")
 async def health_check():
     """Simple health check endpoint"""
@@ -469,6 +1721,21 @@ async def health_check():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Opt-in per-request profiling; not installed at all unless PROFILE_ADMIN_TOKEN is set
+request_profiler = profiler_from_env()
+if request_profiler is not None:
+    app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+
+# Bounded per-route-class queues; sheds with 503 + Retry-After under overload.
+# Added before CORS so shed responses still carry CORS headers.
+admission_controller = controller_from_env()
+if admission_controller is not None:
+    app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
+# Span per request, continuing incoming traceparent headers (see tracing.py)
+if tracer is not None:
+    app.add_middleware(TracingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -495,11 +1762,13 @@ async def http_exception_handler(request, exc):
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Global exception handler to catch all unhandled exceptions"""
-    error_trace = traceback.format_exc()
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
-    logger.error(f"Traceback: {error_trace}")
-    print(f"ERROR: {str(exc)}")  # Also print for Vercel logs
-    print(error_trace)  # Print traceback for Vercel logs
+    # Logged once; the traceback is rendered a single time by the log handler
+    # and stderr already reaches the Vercel/Netlify function logs
+    logger.error(
+        f"Unhandled exception: {str(exc)}",
+        exc_info=(type(exc), exc, exc.__traceback__),
+        extra={"path": request.url.path}
+    )
     
     # Return proper error response
     return JSONResponse(
@@ -514,7 +1783,24 @@ async def global_exception_handler(request, exc):
     )
 
 
+@app.on_event("startup")
+async def startup_db_client():
+    # Long-running servers warm MongoDB up front; serverless handlers
+    # run with lifespan="off" and prepare lazily on first login instead
+    await prepare_mongodb()
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await volatility_engine.history.sync(force=True)
+    if chain_history is not None:
+        await chain_history.drain()
     if client:
         client.close()
+    if market_recorder is not None:
+        market_recorder.close()
+    if chain_prefetcher is not None:
+        chain_prefetcher.stop()
+    if admission_controller is not None:
+        admission_controller.monitor.stop()
+    analytics_pool.shutdown()
@@ -0,0 +1,333 @@
+"""
+Cross-process snapshot cache shared by all uvicorn workers.
+
+Each cache key is a small file under SHARED_CACHE_DIR (tmpfs /dev/shm by
+default) holding a header and the serialized payload. Workers map the file
+into memory and read it without a round trip to TrueData. Writers replace the
+file atomically, so readers always see a complete snapshot.
+
+Only one process refreshes a given key at a time: the refresher is elected by
+a non-blocking flock on the key's lock file. Other workers keep serving the
+previous snapshot (or wait briefly for the first one), so upstream load stays
+flat as the worker count grows.
+
+Keys refreshed with persist=True are also saved to an optional persistent
+tier (see persistent_cache.py). A process that finds no snapshot restores it
+from there, serves it right away and refreshes in the background.
+
+Snapshots hold licensed market data, so callers pass trusted() to
+get_or_refresh: a request whose token hasn't recently worked upstream (see
+TrustedTokens) skips the cache and fetches with its own credentials.
+
+Lock files are striped over LOCK_STRIPES files and at most
+SHARED_CACHE_MAX_MAPS snapshots stay mapped per process, so arbitrary keys
+can't pile up open descriptors or lock files.
+
+Environment variables:
+    SHARED_CACHE_DIR         directory for snapshot files
+    SHARED_CACHE_WAIT_MS     how long a worker waits for another worker's
+                             refresh before fetching itself (default 2000)
+    SHARED_CACHE_MAX_MAPS    snapshot files kept mapped per process (default 256)
+    TRUSTED_TOKEN_TTL        seconds a token that worked upstream may read
+                             cached snapshots (default 900)
+"""
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows - every worker refreshes for itself
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# written_at (epoch seconds), payload length
+HEADER = struct.Struct("<dQ")
+
+# Keys share this many lock files (an occasional collision only makes a
+# worker serve stale data or wait, as if another worker were refreshing)
+LOCK_STRIPES = 1024
+
+
+def default_cache_dir() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "truedata-cache")
+
+
+class SharedSnapshotStore:
+    """Memory-mapped snapshot files with single-refresher election"""
+
+    def __init__(self, directory: str, wait_ms: int = 2000, persistent=None, max_maps: int = 256):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.wait_seconds = wait_ms / 1000.0
+        self.persistent = persistent
+        self.max_maps = max(1, max_maps)
+        # key -> (inode, mapping) so unchanged snapshots are not re-mapped; LRU
+        self._maps: "OrderedDict[str, Tuple[int, mmap.mmap]]" = OrderedDict()
+        self._background: Set[asyncio.Task] = set()
+        self._revalidating: Set[str] = set()
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}.snap"
+
+    def _lock_path(self, key: str) -> Path:
+        stripe = int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) % LOCK_STRIPES
+        return self.directory / f"stripe-{stripe:04d}.lock"
+
+    def read(self, key: str) -> Optional[Tuple[float, bytes]]:
+        """Return (written_at, payload) for a key, or None if never written"""
+        path = self._path(key)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return None
+
+        cached = self._maps.get(key)
+        if cached is None or cached[0] != inode:
+            try:
+                with open(path, "rb") as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return None
+            if cached is not None:
+                cached[1].close()
+            self._maps[key] = cached = (inode, mapping)
+            while len(self._maps) > self.max_maps:
+                self._maps.popitem(last=False)[1][1].close()
+        self._maps.move_to_end(key)
+
+        mapping = cached[1]
+        written_at, length = HEADER.unpack_from(mapping, 0)
+        return written_at, mapping[HEADER.size:HEADER.size + length]
+
+    def write(self, key: str, payload: bytes, written_at: Optional[float] = None):
+        """Atomically publish a new snapshot for a key"""
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(time.time() if written_at is None else written_at, len(payload)))
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @contextmanager
+    def refresh_lease(self, key: str):
+        """Yield True if this process won the right to refresh the key"""
+        if fcntl is None:
+            yield True
+            return
+        lock_path = self._lock_path(key)
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _save_persistent(self, key: str, written_at: float, payload: bytes):
+        try:
+            await self.persistent.save(key, written_at, payload)
+        except Exception as e:
+            logger.warning(f"Persisting snapshot {key} failed: {str(e)}")
+
+    async def _restore(self, key: str) -> Optional[Tuple[float, bytes]]:
+        """Copy a snapshot from the persistent tier into the shared cache"""
+        try:
+            restored = await self.persistent.load(key)
+        except Exception as e:
+            logger.warning(f"Restoring snapshot {key} failed: {str(e)}")
+            return None
+        if restored is None or time.time() - restored[0] > self.persistent.max_stale:
+            return None
+        self.write(key, restored[1], written_at=restored[0])
+        logger.info(f"Restored snapshot {key} from persistent cache")
+        return restored
+
+    async def _refresh_elected(
+        self,
+        key: str,
+        refresh: Callable[[], Awaitable[Optional[bytes]]],
+        persist: bool
+    ) -> Tuple[bool, Optional[bytes]]:
+        """(elected, payload) - payload is None if not elected or the fetch failed"""
+        with self.refresh_lease(key) as elected:
+            if not elected:
+                return False, None
+            payload = await refresh()
+            if payload is not None:
+                self._publish(key, payload, persist)
+            return True, payload
+
+    def _publish(self, key: str, payload: bytes, persist: bool):
+        written_at = time.time()
+        self.write(key, payload, written_at=written_at)
+        if persist and self.persistent is not None:
+            self._spawn(self._save_persistent(key, written_at, payload))
+
+    async def _revalidate(self, key: str, refresh, persist: bool):
+        try:
+            await self._refresh_elected(key, refresh, persist)
+        except Exception as e:
+            logger.warning(f"Background refresh of {key} failed: {str(e)}")
+        finally:
+            self._revalidating.discard(key)
+
+    async def get_or_refresh(
+        self,
+        key: str,
+        ttl: float,
+        refresh: Callable[[], Awaitable[Optional[bytes]]],
+        persist: bool = False,
+        trusted: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> Optional[bytes]:
+        """Serve a fresh snapshot, refreshing it if this worker is elected
+
+        refresh() returns the new payload, or None when the upstream fetch
+        failed (in which case nothing is published). With persist=True the
+        key is also saved to, and restored from, the persistent tier. When
+        trusted() is false nothing cached is served: the caller's refresh()
+        runs instead, so upstream still decides whether its token is good (a
+        payload it does get is published as usual).
+        """
+        with span("cache get_or_refresh", key=key) as cache_span:
+            if trusted is not None and not await trusted():
+                cache_span.set_attribute("cache.result", "untrusted")
+                payload = await refresh()
+                if payload is not None:
+                    self._publish(key, payload, persist)
+                return payload
+
+            snapshot = self.read(key)
+            if snapshot is not None and time.time() - snapshot[0] < ttl:
+                cache_span.set_attribute("cache.result", "hit")
+                return snapshot[1]
+
+            if snapshot is None and persist and self.persistent is not None:
+                restored = await self._restore(key)
+                if restored is not None:
+                    # Stale-while-revalidate: answer now, refresh behind the response
+                    if key not in self._revalidating:
+                        self._revalidating.add(key)
+                        self._spawn(self._revalidate(key, refresh, persist))
+                    cache_span.set_attribute("cache.result", "restored")
+                    return restored[1]
+
+            elected, payload = await self._refresh_elected(key, refresh, persist)
+            if elected:
+                cache_span.set_attribute("cache.result", "refreshed" if payload is not None else "refresh_failed")
+                if payload is not None:
+                    return payload
+                return snapshot[1] if snapshot is not None else None
+
+            # Another worker is refreshing: serve stale data if we have it
+            if snapshot is not None:
+                cache_span.set_attribute("cache.result", "stale")
+                return snapshot[1]
+
+            deadline = time.monotonic() + self.wait_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                snapshot = self.read(key)
+                if snapshot is not None:
+                    cache_span.set_attribute("cache.result", "waited")
+                    return snapshot[1]
+
+            # The elected worker is too slow; fetch without publishing
+            cache_span.set_attribute("cache.result", "unpublished")
+            return await refresh()
+
+
+class TrustedTokens:
+    """Tokens that recently worked upstream, shared across workers through the store"""
+
+    def __init__(self, store: Optional[SharedSnapshotStore], ttl: float = 900.0, max_entries: int = 1024):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # token digest -> time.time() it was last confirmed, in this process
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _note(self, digest: str, confirmed_at: float):
+        self._seen[digest] = confirmed_at
+        self._seen.move_to_end(digest)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+    def remember(self, token: str):
+        """Record that upstream just accepted this token"""
+        if not token:
+            return
+        digest = self._digest(token)
+        now = time.time()
+        # Rewriting the shared marker on every success would be a file per call
+        if now - self._seen.get(digest, 0.0) < self.ttl / 2:
+            return
+        self._note(digest, now)
+        if self.store is not None:
+            try:
+                self.store.write(f"token:{digest}", b"", written_at=now)
+            except OSError as e:
+                logger.warning(f"Could not share trusted token: {str(e)}")
+
+    def known(self, token: str) -> bool:
+        if not token:
+            return False
+        digest = self._digest(token)
+        confirmed_at = self._seen.get(digest)
+        if confirmed_at is None and self.store is not None:
+            marker = self.store.read(f"token:{digest}")
+            if marker is not None:
+                confirmed_at = marker[0]
+                self._note(digest, confirmed_at)
+        return confirmed_at is not None and time.time() - confirmed_at < self.ttl
+
+
+def store_from_env(persistent=None) -> Optional[SharedSnapshotStore]:
+    try:
+        return SharedSnapshotStore(
+            os.environ.get("SHARED_CACHE_DIR") or default_cache_dir(),
+            int(os.environ.get("SHARED_CACHE_WAIT_MS", "2000")),
+            persistent,
+            int(os.environ.get("SHARED_CACHE_MAX_MAPS", "256"))
+        )
+    except Exception as e:
+        logger.warning(f"Shared snapshot cache disabled: {str(e)}")
+        return None
+
+
+def trusted_tokens_from_env(store: Optional[SharedSnapshotStore]) -> TrustedTokens:
+    return TrustedTokens(store, ttl=float(os.environ.get("TRUSTED_TOKEN_TTL", "900")))
@@ -0,0 +1,350 @@
+"""
+Lightweight request tracing.
+
+Spans cover each inbound request (TracingMiddleware), each dashboard symbol
+task, every TrueData call, the shared cache and MongoDB token operations.
+The current span lives in a ContextVar; asyncio.gather / create_task copy
+the context into each task, so fan-out children attach to the request span
+without passing anything around.
+
+Finished spans are batched on a background thread and written as JSON
+lines (one span per line, OTLP field names) or POSTed as OTLP/HTTP JSON to a
+collector. Incoming W3C ``traceparent`` headers are continued and every
+traced response carries one back.
+
+With TRACE_EXPORT unset, span() is a no-op.
+
+Environment variables:
+    TRACE_EXPORT          "file" or "otlp"; unset disables tracing
+    TRACE_FILE            span file for the file exporter (default <tmp>/truedata-traces.jsonl)
+    TRACE_OTLP_ENDPOINT   collector URL (default http://localhost:4318/v1/traces)
+    TRACE_SAMPLE_RATE     fraction of new traces recorded, 0-1 (default 1.0)
+    TRACE_SERVICE_NAME    service.name resource attribute (default truedata-api)
+
+Run ``python tracing.py <span file> [trace id]`` to print a trace as a tree
+with its critical path marked.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    """One timed operation; children share its trace_id"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "error", "sampled")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str = "internal",
+                 sampled: bool = True, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or the trace isn't sampled"""
+
+    sampled = False
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileExporter:
+    """Appends spans as JSON lines"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_otlp(), separators=(",", ":")) + "\n")
+
+
+class OtlpExporter:
+    """POSTs spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]}
+        self._client = httpx.Client(timeout=5.0)
+
+    def export(self, spans: List[Span]):
+        body = {"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "truedata.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+        self._client.post(self.endpoint, json=body).raise_for_status()
+
+
+class Tracer:
+    """Creates spans and ships finished ones to an exporter from a background thread"""
+
+    def __init__(self, exporter, sample_rate: float = 1.0, batch_size: int = 512, flush_interval: float = 2.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def new_trace(self) -> str:
+        return secrets.token_hex(16)
+
+    def should_sample(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        batch: List[Span] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                span = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                span = False
+            if span is None:
+                self._export(batch)
+                return
+            if span:
+                batch.append(span)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._export(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _export(self, batch: List[Span]):
+        if not batch:
+            return
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            logger.warning(f"Span export failed ({len(batch)} spans dropped): {str(e)}")
+
+    def shutdown(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+_tracer: Optional[Tracer] = None
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", parent: Optional[Span] = None, **attributes):
+    """Time a block as a child of the current span (or start a new trace)"""
+    tracer = _tracer
+    if tracer is None:
+        yield NOOP_SPAN
+        return
+
+    parent = parent or _current.get()
+    if parent is None:
+        new = Span(name, tracer.new_trace(), None, kind, tracer.should_sample(), attributes)
+    else:
+        new = Span(name, parent.trace_id, parent.span_id, kind, parent.sampled, attributes)
+    token = _current.set(new)
+    try:
+        # Unsampled spans still propagate context so children stay unsampled
+        yield new if new.sampled else NOOP_SPAN
+    except BaseException as e:
+        new.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        if new.sampled:
+            tracer.finish(new)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Span]:
+    """Remote parent from a W3C traceparent header"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    remote = Span("remote", parts[1], None, sampled=parts[3] == "01")
+    remote.span_id = parts[2]
+    return remote
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _tracer is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        remote = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        with span(f"{scope['method']} {scope['path']}", kind="server", parent=remote,
+                  **{"http.method": scope["method"], "http.target": scope["path"]}) as request_span:
+
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    request_span.set_attribute("http.status_code", message["status"])
+                    if request_span.traceparent:
+                        message = dict(message)
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (b"traceparent", request_span.traceparent.encode())
+                        ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                # Router has filled in the matched route by now
+                route = scope.get("route")
+                if route is not None and request_span.sampled:
+                    request_span.name = f"{scope['method']} {route.path}"
+                    request_span.set_attribute("http.route", route.path)
+
+
+def setup_tracing() -> Optional[Tracer]:
+    """Install the tracer configured by TRACE_EXPORT (idempotent)"""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    kind = os.environ.get("TRACE_EXPORT", "").lower()
+    if not kind:
+        return None
+    try:
+        if kind == "file":
+            exporter = FileExporter(
+                os.environ.get("TRACE_FILE") or os.path.join(tempfile.gettempdir(), "truedata-traces.jsonl")
+            )
+        elif kind == "otlp":
+            exporter = OtlpExporter(
+                os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"),
+                os.environ.get("TRACE_SERVICE_NAME", "truedata-api")
+            )
+        else:
+            logger.warning(f"Unknown TRACE_EXPORT value: {kind}")
+            return None
+        _tracer = Tracer(exporter, float(os.environ.get("TRACE_SAMPLE_RATE", "1.0")))
+    except Exception as e:
+        logger.warning(f"Tracing disabled: {str(e)}")
+        return None
+    return _tracer
+
+
+def _print_trace(path: str, trace_id: Optional[str] = None):
+    """Print a trace from a span file as a tree, critical path marked with *"""
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            spans.append(json.loads(line))
+    if not spans:
+        print("No spans recorded")
+        return
+    if trace_id is None:
+        # Latest trace by default
+        trace_id = max(spans, key=lambda s: int(s["endTimeUnixNano"]))["traceId"]
+    spans = [s for s in spans if s["traceId"] == trace_id]
+    ids = {s["spanId"] for s in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for s in spans:
+        parent = s.get("parentSpanId") if s.get("parentSpanId") in ids else None
+        children.setdefault(parent, []).append(s)
+
+    def walk(node, depth, critical, origin):
+        start = (int(node["startTimeUnixNano"]) - origin) / 1e6
+        duration = (int(node["endTimeUnixNano"]) - int(node["startTimeUnixNano"])) / 1e6
+        error = "  ERROR" if node["status"].get("code") == 2 else ""
+        print(f"{'*' if critical else ' '} {start:9.1f}ms {duration:9.1f}ms  {'  ' * depth}{node['name']}{error}")
+        kids = sorted(children.get(node["spanId"], []), key=lambda s: int(s["startTimeUnixNano"]))
+        # The child that finishes last is what the parent waited on
+        last = max(kids, key=lambda s: int(s["endTimeUnixNano"]), default=None)
+        for kid in kids:
+            walk(kid, depth + 1, critical and kid is last, origin)
+
+    print(f"trace {trace_id}")
+    print(f"  {'start':>11} {'duration':>11}")
+    for root in sorted(children.get(None, []), key=lambda s: int(s["startTimeUnixNano"])):
+        walk(root, 0, True, int(root["startTimeUnixNano"]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python tracing.py <span file> [trace id]")
+        sys.exit(1)
+    _print_trace(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
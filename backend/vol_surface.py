@@ -0,0 +1,371 @@
+"""
+Volatility smile / surface fitting.
+
+Each expiry's smile is fitted with raw SVI in total variance
+w = iv^2 * T against log-moneyness k = ln(K / F):
+
+    w(k) = a + b * (rho * (k - m) + sqrt((k - m)^2 + sigma^2))
+
+Quotes are mids (bid/ask, else LTP) of the out-of-the-money side at each
+strike, inverted to IV with the vectorized solver in iv_history.py. The fit
+is a Levenberg-Marquardt least squares. It starts from the previous fit
+for the same symbol and expiry when one is cached, so a refresh usually
+converges in a handful of iterations.
+
+Fits are cached per (symbol, expiry) against the chain payload digest.
+Queries evaluate the cached parameters at any strike without refitting.
+A refit parses and inverts the whole chain, so the server runs it in the
+analytics pool (fit_payload) and only looks up and stores fits here.
+Between expiries, the surface interpolates total variance linearly in time
+at fixed moneyness.
+
+Environment variables:
+    RISK_FREE_RATE      annual rate for forwards and Greeks (default 0.065)
+    SVI_MAX_ITERATIONS  iteration cap per fit (default 100)
+"""
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from iv_history import implied_volatility, norm_cdf
+from market_calendar import CLOSE, IST
+from option_chain import unique_rows
+
+logger = logging.getLogger(__name__)
+
+PARAMS = ("a", "b", "rho", "m", "sigma")
+SECONDS_PER_YEAR = 365.0 * 86400.0
+
+
+def years_to_expiry(expiry: str, now: Optional[datetime] = None) -> float:
+    """Years from now to a DD-MM-YYYY expiry's close"""
+    day = datetime.strptime(expiry, "%d-%m-%Y").date()
+    close = datetime.combine(day, CLOSE, IST)
+    return (close - (now or datetime.now(timezone.utc))).total_seconds() / SECONDS_PER_YEAR
+
+
+def svi(k: np.ndarray, p: np.ndarray) -> np.ndarray:
+    a, b, rho, m, sigma = p
+    d = k - m
+    return a + b * (rho * d + np.sqrt(d * d + sigma * sigma))
+
+
+def _jacobian(k: np.ndarray, p: np.ndarray) -> np.ndarray:
+    a, b, rho, m, sigma = p
+    d = k - m
+    root = np.sqrt(d * d + sigma * sigma)
+    return np.column_stack([
+        np.ones_like(k),
+        rho * d + root,
+        b * d,
+        -b * (rho + d / root),
+        b * sigma / root,
+    ])
+
+
+def _project(p: np.ndarray) -> np.ndarray:
+    """Clamp parameters into the region where raw SVI is a valid smile"""
+    a, b, rho, m, sigma = p
+    b = max(b, 1e-8)
+    rho = min(max(rho, -0.999), 0.999)
+    sigma = max(sigma, 1e-6)
+    # Keep the minimum total variance non-negative
+    a = max(a, -b * sigma * math.sqrt(1.0 - rho * rho) + 1e-10)
+    return np.array([a, b, rho, m, sigma])
+
+
+def initial_guess(k: np.ndarray, w: np.ndarray) -> np.ndarray:
+    lowest = int(np.argmin(w))
+    return _project(np.array([0.5 * w[lowest], 0.1, -0.3, k[lowest], 0.1]))
+
+
+def fit_svi(
+    k: np.ndarray,
+    w: np.ndarray,
+    start: Optional[np.ndarray] = None,
+    max_iterations: int = 100,
+    tolerance: float = 1e-6
+) -> Tuple[np.ndarray, int]:
+    """Least-squares raw SVI parameters for total variances w at log-moneyness k
+
+    Returns the parameters and the number of iterations used.
+    """
+    p = _project(np.asarray(start, dtype=np.float64)) if start is not None else initial_guess(k, w)
+    residual = svi(k, p) - w
+    cost = float(residual @ residual)
+    # A warm start is near the optimum, so begin with nearly pure Gauss-Newton steps
+    damping = 1e-3 if start is None else 1e-6
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        jac = _jacobian(k, p)
+        jtj = jac.T @ jac
+        gradient = jac.T @ residual
+        try:
+            step = np.linalg.solve(jtj + damping * np.diag(np.diag(jtj) + 1e-12), -gradient)
+        except np.linalg.LinAlgError:
+            break
+        candidate = _project(p + step)
+        candidate_residual = svi(k, candidate) - w
+        candidate_cost = float(candidate_residual @ candidate_residual)
+        if candidate_cost < cost:
+            improvement = cost - candidate_cost
+            p, residual, cost = candidate, candidate_residual, candidate_cost
+            damping = max(damping / 3.0, 1e-12)
+            if improvement <= tolerance * cost or np.abs(step).max() < 1e-10:
+                break
+        else:
+            damping *= 4.0
+            if damping > 1e8:
+                break
+    return p, iterations
+
+
+def chain_quotes(data: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Strike-sorted (strike, call mid, put mid) arrays; NaN where a side has no price"""
+    def mid(bid, ask, ltp):
+        if bid and ask and ask >= bid:
+            return 0.5 * (bid + ask)
+        return ltp if ltp and ltp > 0 else math.nan
+
+    rows = unique_rows(data)
+    strikes = np.array([row["strike"] for row in rows], dtype=np.float64)
+    call = np.array([mid(row["call_bid"], row["call_ask"], row["call_ltp"]) for row in rows], dtype=np.float64)
+    put = np.array([mid(row["put_bid"], row["put_ask"], row["put_ltp"]) for row in rows], dtype=np.float64)
+    return strikes, call, put
+
+
+class SmileFit:
+    """Fitted SVI slice for one expiry"""
+
+    __slots__ = ("expiry", "years", "spot", "forward", "rate", "params", "iterations",
+                 "warm_start", "rmse", "points", "strikes", "fitted_at")
+
+    def __init__(self, expiry: str, years: float, spot: float, rate: float, params: np.ndarray,
+                 iterations: int, warm_start: bool, rmse: float, points: int,
+                 strikes: Sequence[float] = ()):
+        self.expiry = expiry
+        self.years = years
+        self.spot = spot
+        self.rate = rate
+        self.forward = spot * math.exp(rate * years)
+        self.params = params
+        self.iterations = iterations
+        self.warm_start = warm_start
+        self.rmse = rmse
+        self.points = points
+        # The chain's strikes, where queries evaluate the smile by default
+        self.strikes = list(strikes)
+        self.fitted_at = time.time()
+
+    def total_variance(self, strikes: np.ndarray) -> np.ndarray:
+        return np.maximum(svi(np.log(np.asarray(strikes, dtype=np.float64) / self.forward), self.params), 0.0)
+
+    def iv(self, strikes: np.ndarray) -> np.ndarray:
+        """Fitted IV (annualized fraction) at the given strikes"""
+        return np.sqrt(self.total_variance(strikes) / self.years)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "expiry": self.expiry,
+            "years": round(self.years, 6),
+            "forward": round(self.forward, 4),
+            "params": {name: round(float(v), 8) for name, v in zip(PARAMS, self.params)},
+            "iterations": self.iterations,
+            "warm_start": self.warm_start,
+            "rmse_iv": round(self.rmse * 100.0, 4),
+            "points": self.points,
+        }
+
+
+def fit_chain(
+    data: Dict[str, Any],
+    expiry: str,
+    spot: float,
+    rate: float,
+    previous: Optional[SmileFit] = None,
+    max_iterations: int = 100,
+    now: Optional[datetime] = None
+) -> Optional[SmileFit]:
+    """Fit one expiry's smile from a raw chain payload (None if too few usable quotes)"""
+    years = years_to_expiry(expiry, now)
+    if years <= 0 or not spot or spot <= 0:
+        return None
+    strikes, call, put = chain_quotes(data)
+    forward = spot * math.exp(rate * years)
+    # Out-of-the-money side at each strike: puts below the forward, calls above
+    use_call = strikes >= forward
+    price = np.where(use_call, call, put)
+    n = len(strikes)
+    iv = implied_volatility(price, np.full(n, spot), strikes, np.full(n, years), rate, use_call)
+    usable = ~np.isnan(iv)
+    if usable.sum() < len(PARAMS):
+        return None
+    k = np.log(strikes[usable] / forward)
+    w = iv[usable] ** 2 * years
+    start = previous.params if previous is not None else None
+    params, iterations = fit_svi(k, w, start, max_iterations)
+    fitted_iv = np.sqrt(np.maximum(svi(k, params), 0.0) / years)
+    rmse = float(np.sqrt(np.mean((fitted_iv - iv[usable]) ** 2)))
+    return SmileFit(expiry, years, spot, rate, params, iterations, previous is not None, rmse, int(usable.sum()),
+                    strikes.tolist())
+
+
+def fit_payload(
+    payload: np.ndarray,
+    expiry: str,
+    spot: float,
+    rate: float,
+    previous: Optional[SmileFit] = None,
+    max_iterations: int = 100
+) -> Optional[SmileFit]:
+    """fit_chain of a raw chain body (UTF-8 JSON as a uint8 array), for the analytics pool"""
+    return fit_chain(json.loads(payload.tobytes()), expiry, spot, rate, previous, max_iterations)
+
+
+def quotes_from_payload(payload: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """chain_quotes of a raw chain body (UTF-8 JSON as a uint8 array), for the analytics pool"""
+    return chain_quotes(json.loads(payload.tobytes()))
+
+
+def greeks(spot, strikes: np.ndarray, years, rate: float, iv: np.ndarray) -> Dict[str, np.ndarray]:
+    """Black-Scholes prices and Greeks (vega per vol point, theta per calendar day)
+
+    spot and years may be scalars or arrays broadcasting against strikes.
+    """
+    sqrt_t = np.sqrt(years)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(spot / strikes) + (rate + 0.5 * iv * iv) * years) / (iv * sqrt_t)
+    d2 = d1 - iv * sqrt_t
+    pdf = np.exp(-0.5 * d1 * d1) / math.sqrt(2.0 * math.pi)
+    discount = strikes * np.exp(-rate * np.asarray(years))
+    nd1, nd2 = norm_cdf(d1), norm_cdf(d2)
+    call = spot * nd1 - discount * nd2
+    decay = -spot * pdf * iv / (2.0 * sqrt_t)
+    return {
+        "call_price": call,
+        "put_price": call - spot + discount,
+        "call_delta": nd1,
+        "put_delta": nd1 - 1.0,
+        "gamma": pdf / (spot * iv * sqrt_t),
+        "vega": spot * pdf * sqrt_t / 100.0,
+        "call_theta": (decay - rate * discount * nd2) / 365.0,
+        "put_theta": (decay + rate * discount * (1.0 - nd2)) / 365.0,
+    }
+
+
+class VolSurface:
+    """Per-expiry SVI slices with warm-started refits, cached by payload digest"""
+
+    def __init__(self, rate: float = 0.065, max_iterations: int = 100, max_entries: int = 256):
+        self.rate = rate
+        self.max_iterations = max_iterations
+        self.max_entries = max_entries
+        self._fits: "OrderedDict[Tuple[str, str], Tuple[str, Optional[SmileFit]]]" = OrderedDict()
+        self.fits = 0
+        self.iterations = 0
+
+    def lookup(self, symbol: str, expiry: str, digest: str) -> Tuple[bool, Optional[SmileFit]]:
+        """(True, fit) if the cached fit came from this payload, else (False, fit to warm-start from)"""
+        key = (symbol, expiry)
+        entry = self._fits.get(key)
+        if entry is not None and entry[0] == digest:
+            self._fits.move_to_end(key)
+            return True, entry[1]
+        return False, entry[1] if entry is not None else None
+
+    def slice(self, symbol: str, expiry: str, digest: str, spot: float, data_loader) -> Optional[SmileFit]:
+        """Fit for this chain payload, refitting (warm-started) only when the payload changed"""
+        current, previous = self.lookup(symbol, expiry, digest)
+        if current:
+            return previous
+        fit = fit_chain(data_loader(), expiry, spot, self.rate, previous, self.max_iterations)
+        return self.store(symbol, expiry, digest, fit, previous)
+
+    def store(self, symbol: str, expiry: str, digest: str, fit: Optional[SmileFit],
+              previous: Optional[SmileFit]) -> Optional[SmileFit]:
+        """Cache a refit of this payload; returns the slice to use"""
+        key = (symbol, expiry)
+        if fit is not None:
+            self.fits += 1
+            self.iterations += fit.iterations
+        # A failed refit keeps the previous slice (and warm start) around
+        self._fits[key] = (digest, fit or previous)
+        self._fits.move_to_end(key)
+        while len(self._fits) > self.max_entries:
+            self._fits.popitem(last=False)
+        return fit or previous
+
+    def cached(self, symbol: str) -> List[SmileFit]:
+        """Cached slices for a symbol, nearest expiry first"""
+        slices = [entry[1] for key, entry in self._fits.items() if key[0] == symbol and entry[1] is not None]
+        return sorted(slices, key=lambda s: s.years)
+
+    def evaluate(self, fit: SmileFit, strikes: Sequence[float], spot: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Fitted IV (percent) and Greeks at arbitrary strikes of one slice"""
+        spot = spot or fit.spot
+        strikes = np.asarray(strikes, dtype=np.float64)
+        iv = fit.iv(strikes)
+        values = greeks(spot, strikes, fit.years, fit.rate, iv)
+        return _rows(strikes, iv, values)
+
+    def interpolate(self, slices: Sequence[SmileFit], years: float, strikes: Sequence[float], spot: float) -> List[Dict[str, Any]]:
+        """IV and Greeks at an arbitrary maturity, linear in total variance between slices"""
+        strikes = np.asarray(strikes, dtype=np.float64)
+        if not slices:
+            return []
+        forward = spot * math.exp(self.rate * years)
+        k = np.log(strikes / forward)
+
+        def variance(fit):
+            return np.maximum(svi(k, fit.params), 0.0)
+
+        times = [s.years for s in slices]
+        if years <= times[0]:
+            # Flat IV before the first expiry
+            w = variance(slices[0]) * years / times[0]
+        elif years >= times[-1]:
+            w = variance(slices[-1]) * years / times[-1]
+        else:
+            upper = next(i for i, t in enumerate(times) if t >= years)
+            lo, hi = slices[upper - 1], slices[upper]
+            weight = (years - lo.years) / (hi.years - lo.years)
+            w = (1.0 - weight) * variance(lo) + weight * variance(hi)
+        iv = np.sqrt(w / years)
+        return _rows(strikes, iv, greeks(spot, strikes, years, self.rate, iv))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slices": len(self._fits),
+            "fits": self.fits,
+            "avg_iterations": round(self.iterations / self.fits, 2) if self.fits else None,
+        }
+
+
+def _rows(strikes: np.ndarray, iv: np.ndarray, values: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    def num(value, digits):
+        return None if not math.isfinite(value) else round(value, digits)
+
+    columns = {name: column.tolist() for name, column in values.items()}
+    return [
+        {
+            "strike": strike,
+            "iv": num(iv_value * 100.0, 4),
+            **{name: num(columns[name][i], 6) for name in columns},
+        }
+        for i, (strike, iv_value) in enumerate(zip(strikes.tolist(), iv.tolist()))
+    ]
+
+
+def surface_from_env() -> VolSurface:
+    return VolSurface(
+        rate=float(os.environ.get("RISK_FREE_RATE", "0.065")),
+        max_iterations=int(os.environ.get("SVI_MAX_ITERATIONS", "100"))
+    )
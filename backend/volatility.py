@@ -0,0 +1,560 @@
+"""
+Realized volatility and correlation over the symbol universe.
+
+Daily OHLC bars live in a BarHistory: one (symbols x days) NumPy array per
+field, saved to VOL_HISTORY_FILE. Bars come from CSV files
+(VOL_HISTORY_DIR/<SYMBOL>.csv with date,open,high,low,close columns) and
+from the dashboard's LTP fetches. Those fetches build today's bar from the
+first, highest, lowest and last price seen, so intraday extremes between
+refreshes are missed. Ticks are held in memory and merged into the file by
+BarHistory.sync() (see there), so several workers can share one file.
+
+VolatilityEngine computes rolling, annualized (in percent, like IV) estimates
+for every symbol at once from cumulative sums:
+
+* close-to-close: sample stdev of log returns
+* Parkinson: high/low range
+* Garman-Klass: high/low range plus open/close
+
+Only completed bars are used. When new bars complete, or a recent bar
+changes, only the affected columns of the cumulative sums are recomputed,
+so the cached results change at most once per trading day in steady state.
+
+Run ``python volatility.py [symbols] [days]`` for a timing benchmark.
+
+Environment variables:
+    VOL_HISTORY_FILE    .npz file holding the bars (default <tmp>/truedata-bars.npz)
+    VOL_HISTORY_DIR     directory of <SYMBOL>.csv daily bars to import at startup
+    VOL_WINDOW          realized-volatility window in bars (default 20)
+    VOL_CORR_WINDOW     correlation window in bars (default 60)
+    VOL_MAX_DAYS        bars kept per symbol (default 300)
+"""
+import asyncio
+import csv
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from market_calendar import CLOSE, IST
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, the last writer wins
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS = 252
+FIELDS = ("open", "high", "low", "close")
+ESTIMATORS = ("close_to_close", "parkinson", "garman_klass")
+_GK_CO = 2.0 * math.log(2.0) - 1.0
+
+
+def _combine(earlier: Sequence[float], later: Sequence[float]) -> Tuple[float, float, float, float]:
+    """One OHLC bar from two consecutive bars of the same day (NaN = no data)"""
+    o1, h1, l1, c1 = earlier
+    o2, h2, l2, c2 = later
+    return (
+        o2 if math.isnan(o1) else o1,
+        h2 if math.isnan(h1) else h1 if math.isnan(h2) else max(h1, h2),
+        l2 if math.isnan(l1) else l1 if math.isnan(l2) else min(l1, l2),
+        c1 if math.isnan(c2) else c2,
+    )
+
+
+class BarHistory:
+    """Daily OHLC bars for many symbols, persisted as one .npz file
+
+    Ticks only change memory. sync() merges the ticks this worker recorded
+    since its last sync into the file under a lock (so workers never
+    overwrite each other's bars) and adopts the merged result, or just
+    reloads the file when another worker changed it. File I/O runs in a
+    thread.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_days: int = 300, save_interval: float = 30.0):
+        self.path = Path(path) if path else None
+        self.max_days = max_days
+        self.save_interval = save_interval
+        self.symbols: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.dates: List[date] = []
+        self.bars = np.full((len(FIELDS), 0, 0), np.nan)
+        # Bumped whenever rows or columns are added, dropped or reloaded
+        self.generation = 0
+        self._modified_from: Optional[int] = None
+        self._loaded_mtime = None
+        self._last_save = 0.0
+        # (symbol, day) -> bar built from ticks not yet merged into the file
+        self._pending: Dict[Tuple[str, date], Tuple[float, float, float, float]] = {}
+
+    def _ensure_symbol(self, symbol: str) -> int:
+        row = self.index.get(symbol)
+        if row is None:
+            row = len(self.symbols)
+            self.symbols.append(symbol)
+            self.index[symbol] = row
+            pad = np.full((len(FIELDS), 1, len(self.dates)), np.nan)
+            self.bars = np.concatenate([self.bars, pad], axis=1)
+            self.generation += 1
+        return row
+
+    def _ensure_day(self, day: date) -> int:
+        """Column for a day, inserting one (and dropping the oldest past max_days) if needed"""
+        if self.dates and day == self.dates[-1]:
+            return len(self.dates) - 1
+        if day in self.dates:
+            return self.dates.index(day)
+        if not self.dates or day > self.dates[-1]:
+            column = len(self.dates)
+            self.dates.append(day)
+        else:
+            # Older than, or in a gap of, the existing range
+            column = next(i for i, d in enumerate(self.dates) if d > day)
+            self.dates.insert(column, day)
+        pad = np.full((len(FIELDS), len(self.symbols), 1), np.nan)
+        self.bars = np.concatenate([self.bars[:, :, :column], pad, self.bars[:, :, column:]], axis=2)
+        self.generation += 1
+        if len(self.dates) > self.max_days:
+            drop = len(self.dates) - self.max_days
+            self.dates = self.dates[drop:]
+            self.bars = self.bars[:, :, drop:]
+            column -= drop
+        return column
+
+    def _touch(self, column: int):
+        if self._modified_from is None or column < self._modified_from:
+            self._modified_from = column
+
+    def _fold(self, symbol: str, day: date, bar: Sequence[float]):
+        """Merge a later bar for the same day into the symbol's bar"""
+        row = self._ensure_symbol(symbol)
+        column = self._ensure_day(day)
+        if column < 0:
+            # Older than anything max_days keeps
+            return
+        self.bars[:, row, column] = _combine(self.bars[:, row, column], bar)
+        self._touch(column)
+
+    def record_tick(self, symbol: str, price: float, now: Optional[datetime] = None):
+        """Fold a price into the symbol's bar for the current trading day"""
+        if price is None or not price > 0:
+            return
+        day = (now or datetime.now(timezone.utc)).astimezone(IST).date()
+        tick = (price, price, price, price)
+        self._fold(symbol, day, tick)
+        if self.path is not None:
+            key = (symbol, day)
+            pending = self._pending.get(key)
+            self._pending[key] = tick if pending is None else _combine(pending, tick)
+
+    def set_bars(self, symbol: str, rows: Sequence[Tuple[date, float, float, float, float]]):
+        """Replace a symbol's bars with (date, open, high, low, close) rows"""
+        row = self._ensure_symbol(symbol)
+        for day, o, h, l, c in sorted(rows):
+            column = self._ensure_day(day)
+            if column >= 0:
+                self.bars[:, row, column] = (o, h, l, c)
+        self.generation += 1
+
+    def load_csv_dir(self, directory: str) -> int:
+        """Import <SYMBOL>.csv files with date,open,high,low,close columns"""
+        loaded = 0
+        for path in sorted(Path(directory).glob("*.csv")):
+            rows = []
+            with open(path, newline="", encoding="utf-8") as f:
+                for record in csv.DictReader(f):
+                    try:
+                        rows.append((
+                            date.fromisoformat(record["date"][:10]),
+                            float(record["open"]), float(record["high"]),
+                            float(record["low"]), float(record["close"]),
+                        ))
+                    except (KeyError, ValueError):
+                        continue
+            if rows:
+                self.set_bars(path.stem.upper(), rows)
+                loaded += 1
+        return loaded
+
+    def consume_changes(self) -> Optional[int]:
+        """First column modified since the last call (None if nothing changed)"""
+        first, self._modified_from = self._modified_from, None
+        return first
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path.with_suffix(".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self):
+        """Atomically replace the file with these bars (per-process temp file)"""
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    bars=self.bars,
+                    symbols=np.array(self.symbols, dtype=str),
+                    dates=np.array(self.dates, dtype="datetime64[D]"),
+                )
+            os.replace(tmp, self.path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._loaded_mtime = os.stat(self.path).st_mtime_ns
+
+    def _read(self) -> "BarHistory":
+        """The saved bars as a new, unattached BarHistory (empty if there's no file)"""
+        saved_history = BarHistory(max_days=self.max_days)
+        saved_history.path = self.path
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return saved_history
+        with np.load(self.path) as saved:
+            saved_history.bars = saved["bars"].astype(np.float64)
+            saved_history.symbols = [str(s) for s in saved["symbols"]]
+            saved_history.dates = [d.astype(date) for d in saved["dates"]]
+        saved_history.index = {s: i for i, s in enumerate(saved_history.symbols)}
+        saved_history._loaded_mtime = mtime
+        return saved_history
+
+    def _merge_into_file(self, pending: Dict[Tuple[str, date], Tuple[float, float, float, float]]) -> "BarHistory":
+        with self._file_lock():
+            merged = self._read()
+            for (symbol, day), bar in pending.items():
+                merged._fold(symbol, day, bar)
+            merged._write()
+        return merged
+
+    def _adopt(self, other: "BarHistory"):
+        """Take over another instance's bars, then re-apply ticks not yet saved"""
+        self.bars, self.symbols, self.dates, self.index = other.bars, other.symbols, other.dates, other.index
+        self._loaded_mtime = other._loaded_mtime
+        self.generation += 1
+        for (symbol, day), bar in self._pending.items():
+            self._fold(symbol, day, bar)
+
+    def _replace_in_file(self, symbol: str, rows: Sequence[Tuple[date, float, float, float, float]]) -> "BarHistory":
+        with self._file_lock():
+            merged = self._read()
+            merged.set_bars(symbol, rows)
+            merged._write()
+        return merged
+
+    async def store_bars(self, symbol: str, rows: Sequence[Tuple[date, float, float, float, float]]):
+        """Replace a symbol's bars in the file, keeping every other bar in it (backfills)
+
+        Unlike save(), this runs while workers are live: the file is re-read
+        under the lock, so bars they merged since we loaded it survive.
+        """
+        if self.path is None:
+            self.set_bars(symbol, rows)
+            return
+        self._adopt(await asyncio.to_thread(self._replace_in_file, symbol, rows))
+
+    def save(self):
+        """Write the in-memory bars as they are (startup imports)"""
+        if self.path is None:
+            return
+        with self._file_lock():
+            self._write()
+        self._last_save = time.monotonic()
+
+    def reload_if_changed(self) -> bool:
+        """Pick up bars another worker saved since we last loaded or saved (blocking)"""
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        self._adopt(self._read())
+        return True
+
+    async def sync(self, force: bool = False) -> bool:
+        """Save new ticks (at most every save_interval) and pick up other workers' bars
+
+        Returns True if the in-memory bars were replaced. Errors are logged,
+        not raised; unsaved ticks are kept for the next attempt.
+        """
+        if self.path is None:
+            return False
+        pending = self._pending
+        try:
+            if pending and (force or time.monotonic() - self._last_save >= self.save_interval):
+                self._pending = {}
+                merged = await asyncio.to_thread(self._merge_into_file, pending)
+                self._last_save = time.monotonic()
+            else:
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                except FileNotFoundError:
+                    return False
+                if mtime == self._loaded_mtime:
+                    return False
+                merged = await asyncio.to_thread(self._read)
+        except Exception as e:
+            if self._pending is not pending:
+                # Put the unsaved ticks back ahead of any recorded since
+                for key, bar in self._pending.items():
+                    pending[key] = _combine(pending[key], bar) if key in pending else bar
+                self._pending = pending
+            logger.warning(f"Bar history sync failed: {str(e)}")
+            return False
+        self._adopt(merged)
+        return True
+
+
+def _rolling_sum(cumulative: np.ndarray, window: int) -> np.ndarray:
+    """Window sums along axis 1 from a cumulative sum with a leading zero column"""
+    out = np.full((cumulative.shape[0], cumulative.shape[1] - 1), np.nan)
+    if cumulative.shape[1] - 1 >= window:
+        out[:, window - 1:] = cumulative[:, window:] - cumulative[:, :-window]
+    return out
+
+
+def daily_terms(bars: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-bar terms the estimators sum over (NaN where a bar is missing)"""
+    o, h, l, c = bars
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = np.full_like(c, np.nan)
+        ret[:, 1:] = np.log(c[:, 1:] / c[:, :-1])
+        hl2 = np.log(h / l) ** 2
+        co2 = np.log(c / o) ** 2
+    return {"ret": ret, "ret2": ret * ret, "hl2": hl2, "gk": 0.5 * hl2 - _GK_CO * co2}
+
+
+def realized_volatility(bars: np.ndarray, window: int) -> Dict[str, np.ndarray]:
+    """Rolling annualized RV (percent) for every symbol and bar; NaN until a full window"""
+    terms = daily_terms(bars)
+    return _estimators(_cumulate(terms), window)
+
+
+def _cumulate(terms: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    sums = {}
+    for name, values in terms.items():
+        valid = ~np.isnan(values)
+        zeros = np.zeros((values.shape[0], 1))
+        sums[name] = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0.0), axis=1)], axis=1)
+        sums[name + "_n"] = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+    return sums
+
+
+def _estimators(sums: Dict[str, np.ndarray], window: int) -> Dict[str, np.ndarray]:
+    def window_of(name):
+        total = _rolling_sum(sums[name], window)
+        count = _rolling_sum(sums[name + "_n"], window)
+        # Require a complete window
+        return np.where(count == window, total, np.nan)
+
+    with np.errstate(invalid="ignore"):
+        s1, s2 = window_of("ret"), window_of("ret2")
+        c2c_var = (s2 - s1 * s1 / window) / (window - 1)
+        park_var = window_of("hl2") / (4.0 * math.log(2.0) * window)
+        gk_var = window_of("gk") / window
+        scale = TRADING_DAYS * 100.0 ** 2
+        return {
+            "close_to_close": np.sqrt(np.maximum(c2c_var, 0.0) * scale),
+            "parkinson": np.sqrt(np.maximum(park_var, 0.0) * scale),
+            "garman_klass": np.sqrt(np.maximum(gk_var, 0.0) * scale),
+        }
+
+
+def correlation_matrix(close: np.ndarray, window: int) -> np.ndarray:
+    """Correlation of daily log returns over the last `window` bars
+
+    Missing returns are treated as the symbol's mean return, which keeps the
+    computation one matrix product; symbols with fewer than two returns get NaN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.log(close[:, -window - 1:][:, 1:] / close[:, -window - 1:][:, :-1])
+        valid = ~np.isnan(returns)
+        counts = valid.sum(axis=1)
+        means = np.where(counts > 0, np.nansum(returns, axis=1) / np.maximum(counts, 1), 0.0)
+        centered = np.where(valid, returns - means[:, None], 0.0)
+        norms = np.sqrt((centered * centered).sum(axis=1))
+        corr = (centered @ centered.T) / np.outer(norms, norms)
+    corr[counts < 2, :] = np.nan
+    corr[:, counts < 2] = np.nan
+    np.fill_diagonal(corr, np.where(counts >= 2, 1.0, np.nan))
+    return np.clip(corr, -1.0, 1.0)
+
+
+def _json_matrix(matrix: np.ndarray) -> List[List[Optional[float]]]:
+    rows = np.round(matrix, 4).tolist()
+    if np.isnan(matrix).any():
+        rows = [[None if v != v else v for v in line] for line in rows]
+    return rows
+
+
+class VolatilityEngine:
+    """Latest RV per symbol and correlations, cached until the completed bars change"""
+
+    def __init__(self, history: BarHistory, window: int = 20, corr_window: int = 60):
+        self.history = history
+        self.window = window
+        self.corr_window = corr_window
+        self._generation = None
+        self._columns = 0
+        self._sums: Optional[Dict[str, np.ndarray]] = None
+        self._latest: Dict[str, Dict[str, Optional[float]]] = {}
+        self._corr_cache: Dict[Tuple, Dict[str, Any]] = {}
+
+    def completed_columns(self, now: Optional[datetime] = None) -> int:
+        """Bars that are final: before today, or today's once the session has closed"""
+        local = (now or datetime.now(timezone.utc)).astimezone(IST)
+        dates = self.history.dates
+        if dates and (dates[-1] < local.date() or local.time() >= CLOSE):
+            return len(dates)
+        return max(len(dates) - 1, 0)
+
+    def _sync(self, now: Optional[datetime] = None):
+        history = self.history
+        columns = self.completed_columns(now)
+        modified_from = history.consume_changes()
+        if self._sums is not None and history.generation == self._generation:
+            # Recompute from the earliest column that changed or newly completed
+            start = min(self._columns, self._columns if modified_from is None else modified_from)
+            if start >= columns and columns == self._columns:
+                return
+            if start == 0:
+                self._sums = _cumulate(daily_terms(history.bars[:, :, :columns]))
+            else:
+                # Returns at `start` need the close before it; drop that column's terms
+                terms = {k: v[:, 1:] for k, v in daily_terms(history.bars[:, :, start - 1:columns]).items()}
+                for name, values in _cumulate(terms).items():
+                    kept = self._sums[name][:, :start + 1]
+                    self._sums[name] = np.concatenate([kept, kept[:, -1:] + values[:, 1:]], axis=1)
+        else:
+            self._sums = _cumulate(daily_terms(history.bars[:, :, :columns]))
+        self._generation = history.generation
+        self._columns = columns
+        self._corr_cache.clear()
+
+        latest = _estimators({k: v[:, -self.window - 1:] for k, v in self._sums.items()}, self.window) \
+            if columns else {name: np.full((len(history.symbols), 0), np.nan) for name in ESTIMATORS}
+        self._latest = {}
+        for row, symbol in enumerate(history.symbols):
+            values = {}
+            for name in ESTIMATORS:
+                series = latest[name][row]
+                value = float(series[-1]) if series.size else math.nan
+                values[name] = None if math.isnan(value) else round(value, 2)
+            self._latest[symbol] = values
+
+    def latest(self, now: Optional[datetime] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        self._sync(now)
+        return self._latest
+
+    def rv(self, symbol: str, estimator: str = "close_to_close") -> Optional[float]:
+        """Latest cached RV for one symbol (no recomputation)"""
+        return (self._latest.get(symbol) or {}).get(estimator)
+
+    def correlations(self, symbols: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        self._sync()
+        history = self.history
+        selected = [s for s in (symbols or history.symbols) if s in history.index]
+        key = tuple(selected)
+        cached = self._corr_cache.get(key)
+        if cached is None:
+            rows = [history.index[s] for s in selected]
+            close = history.bars[3][rows, :self._columns]
+            matrix = correlation_matrix(close, self.corr_window) if self._columns > 1 else np.full((len(rows),) * 2, np.nan)
+            cached = self._corr_cache[key] = {
+                "symbols": selected,
+                "window": self.corr_window,
+                "as_of": history.dates[self._columns - 1].isoformat() if self._columns else None,
+                "matrix": _json_matrix(matrix),
+            }
+        return cached
+
+
+def engine_from_env() -> VolatilityEngine:
+    history = BarHistory(
+        os.environ.get("VOL_HISTORY_FILE") or os.path.join(tempfile.gettempdir(), "truedata-bars.npz"),
+        max_days=int(os.environ.get("VOL_MAX_DAYS", "300"))
+    )
+    try:
+        history.reload_if_changed()
+    except Exception as e:
+        logger.warning(f"Could not load bar history: {str(e)}")
+    directory = os.environ.get("VOL_HISTORY_DIR")
+    if directory:
+        try:
+            logger.info(f"Imported daily bars for {history.load_csv_dir(directory)} symbols")
+            history.save()
+        except Exception as e:
+            logger.warning(f"Could not import bars from {directory}: {str(e)}")
+    return VolatilityEngine(
+        history,
+        window=int(os.environ.get("VOL_WINDOW", "20")),
+        corr_window=int(os.environ.get("VOL_CORR_WINDOW", "60"))
+    )
+
+
+def _benchmark(count: int, days: int, repeat: int = 5):
+    """Time a full recompute and an incremental one-bar update"""
+    rng = np.random.default_rng(42)
+    returns = rng.normal(0.0, 0.015, (count, days))
+    close = 1000.0 * np.exp(np.cumsum(returns, axis=1))
+    open_ = close * np.exp(rng.normal(0.0, 0.004, (count, days)))
+    spread = np.abs(rng.normal(0.0, 0.008, (count, days)))
+    history = BarHistory()
+    history.symbols = [f"SYM{i:04d}" for i in range(count)]
+    history.index = {s: i for i, s in enumerate(history.symbols)}
+    history.dates = [date(2024, 1, 1) + timedelta(days=i) for i in range(days)]
+    history.bars = np.stack([
+        open_, np.maximum(open_, close) * np.exp(spread), np.minimum(open_, close) * np.exp(-spread), close
+    ])
+    engine = VolatilityEngine(history)
+    now = datetime.combine(history.dates[-1] + timedelta(days=1), CLOSE, IST)
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat * 1000
+
+    def full():
+        history.generation += 1
+        engine.latest(now)
+
+    def incremental():
+        history.bars[3, :, -1] *= 1.0001
+        history._touch(len(history.dates) - 1)
+        engine.latest(now)
+
+    full_ms = timed(full)
+    incremental_ms = timed(incremental)
+    corr_ms = timed(lambda: (engine._corr_cache.clear(), engine.correlations()))
+    print(f"{count} symbols x {days} bars, window {engine.window}")
+    print(f"full recompute      {full_ms:8.2f} ms")
+    print(f"one-bar update      {incremental_ms:8.2f} ms")
+    print(f"correlation matrix  {corr_ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500, int(sys.argv[2]) if len(sys.argv) > 2 else 252)
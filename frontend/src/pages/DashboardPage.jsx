@@ -22,6 +22,17 @@ const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || window.location.origin;
 const API = `${BACKEND_URL}/api`;
 
 const AUTO_REFRESH_INTERVAL = 30 * 60 * 1000; // 30 minutes in milliseconds
+// Never poll faster than this, whatever the server recommends
+const MIN_REFRESH_INTERVAL = 60 * 1000;
+// Alert polling when the server can't stream events
+const ALERT_POLL_INTERVAL = 15 * 1000;
+
+const describeInterval = (ms) => {
+  const minutes = Math.round(ms / 60000);
+  if (minutes < 60) return `${minutes} minute${minutes === 1 ? "" : "s"}`;
+  const hours = Math.round(minutes / 60);
+  return `${hours} hour${hours === 1 ? "" : "s"}`;
+};
 
 const DashboardPage = ({ token, username, onLogout }) => {
   const [dashboardData, setDashboardData] = useState([]);
@@ -29,6 +40,7 @@ const DashboardPage = ({ token, username, onLogout }) => {
   const [refreshing, setRefreshing] = useState(false);
   const [autoRefreshEnabled, setAutoRefreshEnabled] = useState(true);
   const [lastUpdated, setLastUpdated] = useState(null);
+  const [marketStatus, setMarketStatus] = useState(null);
   const [selectedStock, setSelectedStock] = useState(null);
   const { theme, setTheme } = useTheme();
 
@@ -50,6 +62,18 @@ const DashboardPage = ({ token, username, onLogout }) => {
     }
   }, [token]);
 
+  // Session phase and the refresh interval the backend recommends for it
+  const fetchMarketStatus = useCallback(async () => {
+    try {
+      const response = await axios.get(`${API}/market/status`);
+      setMarketStatus(response.data);
+      return response.data;
+    } catch (error) {
+      console.error("Market status error:", error);
+      return null;
+    }
+  }, []);
+
   const handleRefresh = async () => {
     setRefreshing(true);
     await fetchDashboardData();
@@ -62,7 +86,7 @@ const DashboardPage = ({ token, username, onLogout }) => {
     toast.info(
       autoRefreshEnabled
         ? "Auto-refresh paused"
-        : "Auto-refresh resumed (30 min interval)"
+        : "Auto-refresh resumed"
     );
   };
 
@@ -84,17 +108,88 @@ const DashboardPage = ({ token, username, onLogout }) => {
     loadInitialData();
   }, [fetchDashboardData]);
 
-  // Auto-refresh setup
+  // Auto-refresh setup: the delay follows the market session (frequent while
+  // volatile, slower when calm, suspended until the next session when closed)
   useEffect(() => {
     if (!autoRefreshEnabled) return;
 
-    const interval = setInterval(() => {
-      fetchDashboardData();
-      toast.info("Auto-refresh: Data updated");
-    }, AUTO_REFRESH_INTERVAL);
+    let timer;
+    let cancelled = false;
+
+    const schedule = async () => {
+      const status = await fetchMarketStatus();
+      if (cancelled) return;
+      const delay = status
+        ? Math.max(status.refresh_after * 1000, MIN_REFRESH_INTERVAL)
+        : AUTO_REFRESH_INTERVAL;
+      timer = setTimeout(async () => {
+        await fetchDashboardData();
+        toast.info("Auto-refresh: Data updated");
+        schedule();
+      }, delay);
+    };
+    schedule();
 
-    return () => clearInterval(interval);
-  }, [autoRefreshEnabled, fetchDashboardData]);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [autoRefreshEnabled, fetchDashboardData, fetchMarketStatus]);
+
+  // Alerts fired on the server are pushed here as server-sent events. Where
+  // the server can't stream (serverless deployments answer 204) fall back to
+  // polling /alerts/events by event id.
+  useEffect(() => {
+    let cancelled = false;
+    let timer;
+    const seen = new Set();
+    const since = new Date().toISOString();
+    const notify = (event) => {
+      if (seen.has(event.id)) return;
+      seen.add(event.id);
+      toast.warning(
+        `${event.symbol}: ${event.field.replace(/_/g, " ")} ${event.direction} ${event.threshold} (now ${event.value})`
+      );
+    };
+
+    const poll = async (after) => {
+      let last = after;
+      try {
+        const response = await axios.get(`${API}/alerts/events`, {
+          params: after ? { token, after } : { token, since },
+        });
+        for (const event of response.data.events) {
+          notify(event);
+          last = event.id;
+        }
+      } catch (error) {
+        // No MongoDB or an expired session - stop polling
+        return;
+      }
+      if (!cancelled) timer = setTimeout(() => poll(last), ALERT_POLL_INTERVAL);
+    };
+
+    const source = new EventSource(
+      `${API}/alerts/stream?token=${encodeURIComponent(token)}`
+    );
+    source.addEventListener("alert", (message) => notify(JSON.parse(message.data)));
+    // Once the stream has opened, let the browser reconnect after network blips;
+    // if it never opens, don't keep reconnecting
+    let opened = false;
+    source.onopen = () => {
+      opened = true;
+    };
+    source.onerror = () => {
+      if (opened) return;
+      source.close();
+      poll(null);
+    };
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+      source.close();
+    };
+  }, [token]);
 
   const formatNumber = (num) => {
     if (num === null || num === undefined) return "--";
@@ -267,6 +362,12 @@ const DashboardPage = ({ token, username, onLogout }) => {
                     <th className="text-right px-4 py-3 text-xs font-semibold text-slate-600 dark:text-slate-300 uppercase tracking-wider">
                       IV %ile
                     </th>
+                    <th className="text-right px-4 py-3 text-xs font-semibold text-slate-600 dark:text-slate-300 uppercase tracking-wider">
+                      RV
+                    </th>
+                    <th className="text-right px-4 py-3 text-xs font-semibold text-slate-600 dark:text-slate-300 uppercase tracking-wider">
+                      IV/RV
+                    </th>
                     <th className="text-left px-4 py-3 text-xs font-semibold text-slate-600 dark:text-slate-300 uppercase tracking-wider">
                       Signal
                     </th>
@@ -318,6 +419,12 @@ const DashboardPage = ({ token, username, onLogout }) => {
                       <td className="px-4 py-4 text-right mono text-sm text-slate-600 dark:text-slate-400">
                         {stock.iv_percentile ? `${stock.iv_percentile}%` : "--"}
                       </td>
+                      <td className="px-4 py-4 text-right mono text-sm text-slate-600 dark:text-slate-400">
+                        {stock.rv ? `${stock.rv.toFixed(2)}%` : "--"}
+                      </td>
+                      <td className="px-4 py-4 text-right mono text-sm text-slate-600 dark:text-slate-400">
+                        {stock.iv_rv_ratio ? stock.iv_rv_ratio.toFixed(2) : "--"}
+                      </td>
                       <td className="px-4 py-4">
                         {stock.error ? (
                           <span className="text-xs text-red-500 flex items-center gap-1">
@@ -351,7 +458,14 @@ const DashboardPage = ({ token, username, onLogout }) => {
         {autoRefreshEnabled && (
           <div className="mt-4 text-center text-xs text-slate-500 dark:text-slate-400">
             <Activity className="w-4 h-4 inline mr-1" />
-            Auto-refresh enabled - Updates every 30 minutes
+            {marketStatus?.phase === "closed"
+              ? "Market closed - showing last close, auto-refresh resumes at the next session"
+              : `Auto-refresh enabled - Updates every ${describeInterval(
+                  Math.max(
+                    (marketStatus?.refresh_after ?? AUTO_REFRESH_INTERVAL / 1000) * 1000,
+                    MIN_REFRESH_INTERVAL
+                  )
+                )}`}
           </div>
         )}
       </main>
@@ -0,0 +1,214 @@
+"""
+Micro-benchmark harness for the backend hot paths.
+
+The ``bench`` fixture works like pytest-benchmark's ``benchmark``: call it
+with a function and its arguments, it returns the function's result and
+records the best per-call time over several timed rounds. Results are
+compared against baseline.json and a test fails when its throughput drops
+more than BENCH_THRESHOLD below the baseline. Timing noise only ever makes
+code look slower, so an apparent regression is re-measured up to
+BENCH_RETRIES times before it counts.
+
+Throughput is compared relative to a fixed pure-Python calibration workload
+timed right before and after each benchmark. That keeps a baseline recorded
+on one machine meaningful on a faster or slower one, and cancels out most of
+the drift from other load on the same machine.
+
+Environment variables:
+    BENCH_SAVE_BASELINE   "1" writes the measured results to baseline.json
+    BENCH_THRESHOLD       allowed throughput drop, 0-1 (default 0.3)
+    BENCH_MIN_TIME        minimum seconds per timed round (default 0.02)
+    BENCH_ROUNDS          timed rounds per benchmark (default 5)
+    BENCH_RETRIES         re-measurements before a regression fails (default 2)
+"""
+import gc
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+BENCH_DIR = Path(__file__).parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+FIXTURE_PATH = BENCH_DIR / "fixtures" / "recorded.jsonl.gz"
+
+# Import the backend the way the serverless entry points do, without
+# touching /dev/shm, the prefetch loop or process pools
+sys.path.insert(0, str(BENCH_DIR.parents[1] / "backend"))
+os.environ.setdefault("SHARED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "truedata-bench-cache"))
+os.environ.setdefault("PREFETCH_ENABLED", "false")
+os.environ.setdefault("ANALYTICS_WORKERS", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+SAVE_BASELINE = os.environ.get("BENCH_SAVE_BASELINE") == "1"
+THRESHOLD = float(os.environ.get("BENCH_THRESHOLD", "0.3"))
+MIN_TIME = float(os.environ.get("BENCH_MIN_TIME", "0.02"))
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", "5"))
+RETRIES = int(os.environ.get("BENCH_RETRIES", "2"))
+
+# test name -> (calls per second, calls per calibration run), for this run
+_results = {}
+
+
+def _best_seconds_per_call(func) -> float:
+    """Best per-call time over ROUNDS rounds of at least MIN_TIME each"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_TIME:
+            break
+        loops *= 2
+
+    best = elapsed / loops
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            for _ in range(loops):
+                func()
+            best = min(best, (time.perf_counter() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def _calibration_workload():
+    rows = [{"strike": i * 50.0, "oi": i * 75} for i in range(200)]
+    total = 0.0
+    for row in rows:
+        total += row["strike"] * row["oi"]
+    json.dumps(rows)
+    sorted(rows, key=lambda r: -r["oi"])
+    return total
+
+
+def calibration_ops() -> float:
+    return 1.0 / _best_seconds_per_call(_calibration_workload)
+
+
+def _load_baseline():
+    try:
+        return json.loads(BASELINE_PATH.read_text())
+    except FileNotFoundError:
+        return None
+
+
+class Benchmark:
+    """Times a callable and checks it against the recorded baseline"""
+
+    def __init__(self, name: str, baseline):
+        self.name = name
+        self.baseline = baseline
+        self.ops = None
+        self.relative = None
+
+    def _measure(self, func):
+        before = calibration_ops()
+        ops = 1.0 / _best_seconds_per_call(func)
+        # The faster calibration is the one least disturbed by other load
+        relative = ops / max(before, calibration_ops())
+        if self.relative is None or relative > self.relative:
+            self.ops, self.relative = ops, relative
+
+    def __call__(self, func, *args, **kwargs):
+        result = func(*args, **kwargs)  # warm-up, and the value returned to the test
+        call = lambda: func(*args, **kwargs)  # noqa: E731
+        self._measure(call)
+        if not SAVE_BASELINE:
+            for _ in range(RETRIES):
+                if not self._regressed():
+                    break
+                self._measure(call)
+        _results[self.name] = (self.ops, self.relative)
+        if not SAVE_BASELINE and self._regressed():
+            change = self.change()
+            pytest.fail(
+                f"{self.name}: throughput is {-change:.0%} below the baseline "
+                f"({self.ops:,.0f} calls/s now, threshold {THRESHOLD:.0%})"
+            )
+        return result
+
+    def change(self):
+        """Relative throughput change against the baseline, or None without one"""
+        if not self.baseline or self.name not in self.baseline["benchmarks"]:
+            return None
+        return self.relative / self.baseline["benchmarks"][self.name]["relative"] - 1.0
+
+    def _regressed(self) -> bool:
+        change = self.change()
+        return change is not None and change < -THRESHOLD
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    return _load_baseline()
+
+
+@pytest.fixture
+def bench(request, baseline):
+    return Benchmark(request.node.nodeid.split("::", 1)[1], baseline)
+
+
+@pytest.fixture(scope="session")
+def recorded():
+    """Recorded TrueData responses keyed by record_key (see make_fixtures.py)"""
+    responses = {}
+    with gzip.open(FIXTURE_PATH, "rt", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            responses[entry["key"]] = entry["body"]
+    return responses
+
+
+@pytest.fixture(scope="session")
+def chain_bodies(recorded):
+    """Recorded option-chain bodies, smallest first"""
+    bodies = [body for key, body in recorded.items() if key.startswith("getoptionchain")]
+    return sorted(bodies, key=lambda body: len(json.loads(body).get("Records") or []))
+
+
+@pytest.fixture(scope="session")
+def ltp_bodies(recorded):
+    return [body for key, body in recorded.items() if key.startswith("getLTPSpot")]
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: backend micro-benchmark")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not SAVE_BASELINE or not _results:
+        return
+    # Entries not re-run in this session are kept as they were
+    benchmarks = (_load_baseline() or {"benchmarks": {}})["benchmarks"]
+    for name, (ops, relative) in _results.items():
+        benchmarks[name] = {"calls_per_second": round(ops, 1), "relative": round(relative, 6)}
+    BASELINE_PATH.write_text(json.dumps(
+        {"benchmarks": dict(sorted(benchmarks.items()))}, indent=2
+    ) + "\n")
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _results:
+        return
+    baseline = _load_baseline() if not SAVE_BASELINE else None
+    terminalreporter.section("benchmarks (calls/s)")
+    for name, (ops, relative) in sorted(_results.items()):
+        line = f"{ops:>14,.0f}  {name}"
+        result = Benchmark(name, baseline)
+        result.relative = relative
+        change = result.change()
+        if change is not None:
+            line += f"  ({change:+.0%} vs baseline)"
+        terminalreporter.write_line(line)
+    if SAVE_BASELINE:
+        terminalreporter.write_line(f"baseline written to {BASELINE_PATH}")
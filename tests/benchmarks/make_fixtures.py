@@ -0,0 +1,127 @@
+"""
+Build the recorded-response fixture the benchmarks run against.
+
+The fixture is a market recorder segment (see backend/market_recorder.py):
+gzip JSON lines of {ts, key, status, body} for getLTPSpot and getoptionchain
+responses.
+
+    python tests/benchmarks/make_fixtures.py --from <MARKET_RECORD_DIR>
+        copies the LTP responses plus the smallest, median and largest
+        option chains from a real recording
+
+    python tests/benchmarks/make_fixtures.py
+        writes deterministic synthetic chains (60 / 240 / 960 records) in
+        the Records layout the backend normalizes
+
+Re-record the baseline (BENCH_SAVE_BASELINE=1) after replacing the fixture.
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+FIXTURE_PATH = Path(__file__).parent / "fixtures" / "recorded.jsonl.gz"
+RECORDED_AT = 1763632799.0  # fixed so the file is reproducible
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from market_recorder import SEGMENT_GLOB, record_key  # noqa: E402
+
+# (symbol, spot, strike step, records)
+SYNTHETIC_CHAINS = [
+    ("ITC", 412.35, 2.5, 60),
+    ("NIFTY", 24812.6, 50.0, 240),
+    ("BANKNIFTY", 53977.15, 25.0, 960),
+]
+SYNTHETIC_EXPIRY = "27-11-2025"
+
+
+def synthetic_record(rng: random.Random, symbol: str, strike: float, spot: float) -> list:
+    """One chain row: call side at 0-10, strike at 11, put side at 12-21"""
+    moneyness = (strike - spot) / spot
+    call_ltp = round(max(spot - strike, 0.0) + spot * 0.02 * rng.random() + 0.05, 2)
+    put_ltp = round(max(strike - spot, 0.0) + spot * 0.02 * rng.random() + 0.05, 2)
+    oi_scale = max(1.0 - abs(moneyness) * 8, 0.05)
+    call_oi = int(rng.randint(20000, 900000) * oi_scale)
+    put_oi = int(rng.randint(20000, 900000) * oi_scale)
+    ts = "2025-11-20T15:29:59"
+    return [
+        f"{symbol}25NOV{strike:g}CE", ts, rng.randint(25, 1800),
+        call_oi, call_ltp,
+        round(call_ltp - 0.05, 2), rng.randint(25, 5000),
+        round(call_ltp + 0.05, 2), rng.randint(25, 5000),
+        rng.randint(1001, 4000000), int(call_oi * rng.uniform(0.8, 1.2)),
+        strike,
+        int(put_oi * rng.uniform(0.8, 1.2)), put_oi, rng.randint(25, 1800), 0,
+        round(put_ltp - 0.05, 2), round(put_ltp + 0.05, 2), put_ltp,
+        rng.randint(1001, 4000000),
+        f"{symbol}25NOV{strike:g}PE", ts,
+    ]
+
+
+def synthetic_lines():
+    rng = random.Random(20251120)
+    lines = []
+    for symbol, spot, step, count in SYNTHETIC_CHAINS:
+        lines.append({
+            "ts": RECORDED_AT,
+            "key": record_key("getLTPSpot", {"symbol": symbol, "series": "EQ", "response": "csv"}),
+            "status": 200,
+            "body": f"LTP\n{spot}\n",
+        })
+        atm = round(spot / step) * step
+        strikes = [atm + (i - count // 2) * step for i in range(count)]
+        records = [synthetic_record(rng, symbol, strike, spot) for strike in strikes]
+        lines.append({
+            "ts": RECORDED_AT,
+            "key": record_key("getoptionchain", {"symbol": symbol, "expiry": SYNTHETIC_EXPIRY, "response": "json"}),
+            "status": 200,
+            "body": json.dumps({"Records": records}),
+        })
+    return lines
+
+
+def recorded_lines(directory: str):
+    """LTP responses plus the smallest, median and largest chains of a recording"""
+    ltp, chains = {}, {}
+    for path in sorted(glob.glob(os.path.join(directory, SEGMENT_GLOB))):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("status") != 200:
+                    continue
+                if entry["key"].startswith("getLTPSpot"):
+                    ltp[entry["key"]] = entry
+                elif entry["key"].startswith("getoptionchain"):
+                    chains[entry["key"]] = entry
+
+    def size(entry):
+        return len(json.loads(entry["body"]).get("Records") or [])
+
+    ranked = sorted(chains.values(), key=size)
+    if not ranked:
+        raise SystemExit(f"No option chain responses recorded in {directory}")
+    picked = {id(e): e for e in (ranked[0], ranked[len(ranked) // 2], ranked[-1])}
+    return list(ltp.values()) + list(picked.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="source", help="market recorder directory to copy responses from")
+    args = parser.parse_args()
+
+    lines = recorded_lines(args.source) if args.source else synthetic_lines()
+    FIXTURE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # mtime=0 keeps the gzip bytes reproducible
+    with open(FIXTURE_PATH, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+        for entry in lines:
+            f.write((json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8"))
+    print(f"Wrote {len(lines)} responses to {FIXTURE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Dashboard hot paths: LTP parsing, per-symbol metrics and response serialization"""
+from datetime import datetime, timezone
+
+import pytest
+
+from market_snapshot import MarketSnapshot
+from server import DashboardResponse, StockData, TOP_20_STOCKS, parse_ltp_csv, stock_metrics
+
+pytestmark = pytest.mark.benchmark
+
+NOW = datetime(2025, 11, 20, 10, 0, tzinfo=timezone.utc)
+
+
+def dashboard_symbols(count):
+    return [TOP_20_STOCKS[i % len(TOP_20_STOCKS)] + ("" if i < len(TOP_20_STOCKS) else str(i)) for i in range(count)]
+
+
+def dashboard_rows(symbols, ltp_bodies):
+    ltps = [parse_ltp_csv(body) for body in ltp_bodies]
+    return [(s, ltps[i % len(ltps)] * (1 + i / 1000)) for i, s in enumerate(symbols)]
+
+
+def test_parse_ltp_csv(bench, ltp_bodies):
+    parsed = bench(lambda: [parse_ltp_csv(body) for body in ltp_bodies])
+    assert all(value > 0 for value in parsed)
+
+
+def test_stock_metrics(bench, ltp_bodies):
+    rows = dashboard_rows(TOP_20_STOCKS, ltp_bodies)
+    metrics = bench(lambda: [stock_metrics(symbol, ltp) for symbol, ltp in rows])
+    assert all(m["signal"] in ("Bullish", "Bearish", "Neutral", "High Volatility") for m in metrics)
+
+
+@pytest.mark.parametrize("count", [20, 500])
+def test_stock_data_models(bench, ltp_bodies, count):
+    rows = [
+        (symbol, ltp, stock_metrics(symbol, ltp))
+        for symbol, ltp in dashboard_rows(dashboard_symbols(count), ltp_bodies)
+    ]
+
+    def build():
+        return DashboardResponse(
+            success=True,
+            data=[StockData(symbol=symbol, spot=ltp, **m) for symbol, ltp, m in rows],
+            timestamp=NOW
+        ).model_dump_json()
+
+    assert bench(build).startswith('{"success":true')
+
+
+@pytest.mark.parametrize("count", [20, 500])
+def test_market_snapshot(bench, ltp_bodies, count):
+    rows = [
+        (symbol, ltp, stock_metrics(symbol, ltp))
+        for symbol, ltp in dashboard_rows(dashboard_symbols(count), ltp_bodies)
+    ]
+
+    def build():
+        snapshot = MarketSnapshot([symbol for symbol, _, _ in rows])
+        for index, (_, ltp, m) in enumerate(rows):
+            snapshot.set_row(index, spot=ltp, **m)
+        return snapshot.to_json(NOW)
+
+    assert bench(build).startswith(b'{"success":true')
@@ -0,0 +1,47 @@
+"""Option-chain payload handling, from the raw upstream body to analytics"""
+import json
+
+import pytest
+
+from analytics import chain_oi_arrays, max_pain
+from option_chain import SortedChain, normalized_rows
+
+pytestmark = pytest.mark.benchmark
+
+SIZES = ["small", "medium", "large"]
+
+
+@pytest.fixture(params=range(len(SIZES)), ids=SIZES)
+def chain_body(request, chain_bodies):
+    return chain_bodies[min(request.param, len(chain_bodies) - 1)]
+
+
+def test_parse_and_compact(bench, chain_body):
+    """What a snapshot refresh does with a fresh getoptionchain response"""
+    payload = bench(lambda: json.dumps(json.loads(chain_body), separators=(",", ":")).encode())
+    assert payload.startswith(b'{"Records":')
+
+
+def test_sorted_chain(bench, chain_body):
+    data = json.loads(chain_body)
+    chain = bench(SortedChain, data)
+    assert chain.strikes == sorted(chain.strikes)
+
+
+def test_strike_window(bench, chain_body):
+    chain = SortedChain(json.loads(chain_body))
+    spot = chain.distinct_strikes[len(chain.distinct_strikes) // 2]
+    records, atm = bench(chain.around, spot, 10)
+    assert atm == spot and records
+
+
+def test_normalized_rows(bench, chain_body):
+    data = json.loads(chain_body)
+    rows = bench(lambda: list(normalized_rows(data)))
+    assert len(rows) == len(data["Records"])
+
+
+def test_max_pain(bench, chain_body):
+    data = json.loads(chain_body)
+    result = bench(lambda: max_pain(**chain_oi_arrays(data)))
+    assert result["max_pain"] is not None
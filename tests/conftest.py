@@ -0,0 +1,5 @@
+"""Shared test setup: import the backend modules the way the entry points do"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "backend"))
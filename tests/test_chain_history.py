@@ -0,0 +1,216 @@
+"""Chain history codec: samples encoded and rebuilt through chain_at"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from chain_history import FIELDS, ChainHistory
+
+SYMBOL = "NIFTY"
+EXPIRY = "27-01-2026"
+START = datetime(2026, 1, 5, 4, 0, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in self.docs:
+                yield doc
+        return iterate()
+
+
+class FakeCollection:
+    """The slice of the Motor collection API chain_history uses"""
+
+    def __init__(self):
+        self.docs = []
+
+    @staticmethod
+    def _matches(doc, query):
+        for key, condition in query.items():
+            if isinstance(condition, dict):
+                if "$lte" in condition and not doc[key] <= condition["$lte"]:
+                    return False
+                if "$gt" in condition and not doc[key] > condition["$gt"]:
+                    return False
+            elif doc.get(key) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor([doc for doc in self.docs if self._matches(doc, query)])
+
+    async def find_one(self, query, projection=None, sort=()):
+        docs = [doc for doc in self.docs if self._matches(doc, query)]
+        for key, direction in reversed(sort):
+            docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return docs[0] if docs else None
+
+
+class FakeDB:
+    def __init__(self):
+        self.chain_history = FakeCollection()
+
+
+def make_history(db, keyframe_every=30):
+    return ChainHistory(lambda: db, keyframe_every=keyframe_every)
+
+
+def store(history, db, ts, strikes, values):
+    """Encode a sample against the newest stored one, as record() does; returns the doc"""
+    latest = asyncio.run(db.chain_history.find_one(
+        {"symbol": SYMBOL, "expiry": EXPIRY}, sort=[("ts", -1), ("_id", -1)]
+    ))
+    doc = history.encode(SYMBOL, EXPIRY, ts, strikes, values, latest["_id"] if latest else None)
+    if doc is not None:
+        db.chain_history.docs.append(doc)
+    return doc
+
+
+def chain(strikes, seed):
+    rng = np.random.default_rng(seed)
+    values = np.vstack([
+        rng.integers(0, 500000, (2, len(strikes))).astype(np.float64),
+        np.round(rng.uniform(1, 800, (2, len(strikes))), 2),
+        rng.integers(0, 100000, (2, len(strikes))).astype(np.float64),
+    ])
+    return np.asarray(strikes, dtype=np.float64), values
+
+
+def assert_chain_at(history, at, strikes, values):
+    rebuilt = asyncio.run(history.chain_at(SYMBOL, EXPIRY, at))
+    np.testing.assert_array_equal(rebuilt["strikes"], strikes)
+    np.testing.assert_array_equal(rebuilt["values"], values)
+
+
+def test_deltas_round_trip():
+    db = FakeDB()
+    history = make_history(db)
+    strikes, values = chain([100, 150, 200, 250], seed=1)
+    samples = []
+    for minute in range(6):
+        values = values.copy()
+        values[:, minute % 4] += 25
+        values[2, (minute + 1) % 4] = 12.35
+        # Prices have two decimals
+        values = np.round(values, 2)
+        ts = START + timedelta(minutes=minute)
+        store(history, db, ts, strikes, values)
+        samples.append((ts, values))
+    assert [doc["keyframe"] for doc in db.chain_history.docs] == [True] + [False] * 5
+    for ts, values in samples:
+        assert_chain_at(history, ts, strikes, values)
+    # Between samples, and before the first one
+    assert_chain_at(history, samples[2][0] + timedelta(seconds=30), strikes, samples[2][1])
+    assert_chain_at(history, START - timedelta(hours=1), strikes, samples[0][1])
+
+
+def test_unchanged_sample_is_not_stored():
+    db = FakeDB()
+    history = make_history(db)
+    strikes, values = chain([100, 200], seed=2)
+    assert store(history, db, START, strikes, values) is not None
+    assert store(history, db, START + timedelta(minutes=1), strikes, values.copy()) is None
+    assert len(db.chain_history.docs) == 1
+
+
+def test_added_and_removed_strikes_start_a_keyframe():
+    db = FakeDB()
+    history = make_history(db)
+    strikes, values = chain([100, 150, 200], seed=3)
+    store(history, db, START, strikes, values)
+    added_strikes, added = chain([50, 100, 150, 200], seed=4)
+    store(history, db, START + timedelta(minutes=1), added_strikes, added)
+    removed_strikes, removed = chain([100, 200], seed=5)
+    store(history, db, START + timedelta(minutes=2), removed_strikes, removed)
+    assert [doc["keyframe"] for doc in db.chain_history.docs] == [True, True, True]
+    assert_chain_at(history, START, strikes, values)
+    assert_chain_at(history, START + timedelta(minutes=1), added_strikes, added)
+    assert_chain_at(history, START + timedelta(minutes=2), removed_strikes, removed)
+
+
+def test_values_going_missing_and_back():
+    db = FakeDB()
+    history = make_history(db)
+    strikes, values = chain([100, 150, 200], seed=6)
+    store(history, db, START, strikes, values)
+    missing = values.copy()
+    missing[FIELDS.index("call_ltp"), 1] = np.nan
+    missing[FIELDS.index("put_oi"), :] = np.nan
+    store(history, db, START + timedelta(minutes=1), strikes, missing)
+    back = values.copy()
+    back[FIELDS.index("call_ltp"), 1] = 0.05
+    store(history, db, START + timedelta(minutes=2), strikes, back)
+    assert [doc["keyframe"] for doc in db.chain_history.docs] == [True, False, False]
+    assert_chain_at(history, START + timedelta(minutes=1), strikes, missing)
+    assert_chain_at(history, START + timedelta(minutes=2), strikes, back)
+
+
+def test_keyframe_rollover():
+    db = FakeDB()
+    history = make_history(db, keyframe_every=3)
+    strikes, values = chain([100, 150, 200], seed=7)
+    samples = []
+    for minute in range(8):
+        values = values.copy()
+        values[0, minute % 3] += 100
+        ts = START + timedelta(minutes=minute)
+        store(history, db, ts, strikes, values)
+        samples.append((ts, values))
+    docs = db.chain_history.docs
+    assert [doc["keyframe"] for doc in docs] == [True, False, False] * 2 + [True, False]
+    assert [doc["seq"] for doc in docs] == [0, 1, 2] * 2 + [0, 1]
+    for ts, values in samples:
+        assert_chain_at(history, ts, strikes, values)
+
+
+def test_interleaved_workers_in_the_same_second():
+    db = FakeDB()
+    first, second = make_history(db), make_history(db)
+    strikes, values = chain([100, 150, 200], seed=8)
+    store(first, db, START, strikes, values)
+    one = values.copy()
+    one[0, 0] += 50
+    store(first, db, START, strikes, one)
+    # The first worker checks the latest sample, then the second worker
+    # writes before the first one's insert lands
+    latest = max(db.chain_history.docs, key=lambda doc: (doc["ts"], doc["_id"]))["_id"]
+    other = values.copy()
+    other[1, 2] += 999
+    store(second, db, START, strikes, other)
+    two = one.copy()
+    two[0, 1] += 75
+    doc = first.encode(SYMBOL, EXPIRY, START, strikes, two, latest)
+    db.chain_history.docs.append(doc)
+    # The late delta stays on the first worker's keyframe
+    assert not doc["keyframe"] and doc["root"] == db.chain_history.docs[0]["_id"]
+    assert_chain_at(first, START, strikes, two)
+    # Its own sample is the newest again, so it carries on with deltas; the
+    # second worker's last sample isn't, so it starts a new keyframe
+    three = two.copy()
+    three[0, 2] += 5
+    assert store(first, db, START + timedelta(seconds=1), strikes, three)["keyframe"] is False
+    assert_chain_at(first, START + timedelta(seconds=1), strikes, three)
+    assert store(second, db, START + timedelta(seconds=2), strikes, other + 1)["keyframe"] is True
+    assert_chain_at(first, START + timedelta(seconds=2), strikes, other + 1)
+
+
+def test_changes_align_on_later_strikes():
+    db = FakeDB()
+    history = make_history(db)
+    strikes, values = chain([100, 200], seed=9)
+    store(history, db, START, strikes, values)
+    later_strikes, later = chain([100, 150, 200], seed=10)
+    store(history, db, START + timedelta(minutes=5), later_strikes, later)
+    result = asyncio.run(history.changes(SYMBOL, EXPIRY, START, START + timedelta(minutes=5)))
+    columns = result["columns"]
+    assert columns["strike"] == [100.0, 150.0, 200.0]
+    assert columns["call_oi_change"][1] is None
+    assert columns["call_oi_change"][0] == round(later[0, 0] - values[0, 0], 2)
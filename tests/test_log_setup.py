@@ -0,0 +1,53 @@
+"""JSON log formatting: tracebacks survive both the synchronous and queued paths"""
+import io
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from log_setup import JsonFormatter, PreparedQueueHandler
+
+
+def make_logger(handler):
+    logger = logging.getLogger(f"test_log_setup.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def log_exception(logger):
+    try:
+        raise RuntimeError("upstream down")
+    except RuntimeError:
+        logger.exception("boom", extra={"category": "upstream"})
+
+
+def assert_traceback(output):
+    entry = json.loads(output.getvalue().strip())
+    assert entry["message"] == "boom"
+    assert entry["category"] == "upstream"
+    assert "Traceback" in entry["exc"]
+    assert "RuntimeError: upstream down" in entry["exc"]
+
+
+def test_synchronous_handler_keeps_traceback():
+    output = io.StringIO()
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(JsonFormatter())
+    log_exception(make_logger(handler))
+    assert_traceback(output)
+
+
+def test_queued_handler_keeps_traceback():
+    output = io.StringIO()
+    stream = logging.StreamHandler(output)
+    stream.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, stream)
+    listener.start()
+    try:
+        log_exception(make_logger(PreparedQueueHandler(log_queue)))
+    finally:
+        listener.stop()
+    assert_traceback(output)
@@ -0,0 +1,51 @@
+"""Duplicate strikes resolve the same way in every per-strike view"""
+import numpy as np
+
+from analytics import chain_oi_arrays
+from chain_history import FIELDS, chain_matrix
+from option_chain import SortedChain, unique_rows
+from vol_surface import chain_quotes
+
+
+def record(strike, call_oi, call_ltp, call_bid, call_ask, put_oi, put_bid, put_ask, put_ltp):
+    """A raw getoptionchain row (see normalize_record for the column layout)"""
+    return [
+        "NIFTY", "27-01-2026", 0, call_oi, call_ltp, call_bid, call_ask, 0, 0, 0, 0,
+        strike, put_oi, 0, 0, 0, put_bid, put_ask, put_ltp, 0,
+    ]
+
+
+DATA = {"Records": [
+    record(26100, 900, 41.0, 40.5, 41.5, 1200, 120.0, 121.0, 120.5),
+    # The first 26000 row has no call quote; the second one has no put quote
+    record(26000, 1500, 90.0, None, None, 2500, 70.0, 71.0, 70.5),
+    record(26000, 1600, 92.0, 91.0, 93.0, None, None, None, None),
+    record(25900, 800, 150.0, 149.0, 151.0, 3000, 45.0, 46.0, 45.5),
+]}
+
+
+def test_first_row_of_a_duplicate_strike_wins_whole():
+    rows = unique_rows(DATA)
+    assert [row["strike"] for row in rows] == [25900, 26000, 26100]
+    first = rows[1]
+    assert (first["call_oi"], first["call_ltp"], first["put_oi"]) == (1500, 90.0, 2500)
+    # Nothing is borrowed from the second 26000 row
+    assert first["call_bid"] is None and first["call_ask"] is None
+
+
+def test_views_agree_on_duplicate_strikes():
+    columns = SortedChain(DATA).columns()
+    strikes, values = chain_matrix(DATA)
+    quote_strikes, call, put = chain_quotes(DATA)
+    oi = chain_oi_arrays(DATA)
+
+    assert columns["strike"] == strikes.tolist() == quote_strikes.tolist() == oi["strike"].tolist()
+    for field in ("call_oi", "put_oi", "call_ltp", "put_ltp"):
+        np.testing.assert_array_equal(
+            values[FIELDS.index(field)], [np.nan if v is None else v for v in columns[field]]
+        )
+    np.testing.assert_array_equal(oi["call_oi"], columns["call_oi"])
+    np.testing.assert_array_equal(oi["put_oi"], columns["put_oi"])
+    # 26000 has no call bid/ask in its first row, so the call mid falls back to its LTP
+    assert call.tolist() == [150.0, 90.0, 41.0]
+    assert put.tolist() == [45.5, 70.5, 120.5]